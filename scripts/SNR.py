@@ -1,70 +1,49 @@
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
+
+from aggregates import example_std
+from loader import scan_tables
+from preview import PREVIEW_FRACTION, print_sampling_error
+from variance import decompose, example_moments
 
 DATA_DIR = "../inference-scratch"
 OUTPUT_FILE = "signal_to_noise_audit.png"
+COMPONENTS_FILE = "signal_to_noise_components.csv"
 
 def analyze_signal_to_noise():
     print("Loading data for Signal-to-Noise Audit...")
     
-    files = glob.glob(f"{DATA_DIR}/**/*.parquet", recursive=True)
-    
-    if not files:
-        print(f"No parquet files found in {DATA_DIR}")
-        return
+    # One file at a time; the group-by's memory cap is set by MEDARC_MEMORY_BUDGET.
+    moments = example_moments(scan_tables(DATA_DIR, columns=['example_id', 'reward']))
 
-    print(f"Found {len(files)} files. Compiling data...")
-    
-    dfs = []
-    for f in files:
-        if os.path.getsize(f) == 0:
-            continue
-
-        try:
-            dataset_name = os.path.basename(f).replace('.parquet', '')
-            
-            df = pd.read_parquet(f)
-            
-            df['dataset'] = dataset_name
-            
-            if 'model_id' not in df.columns:
-                folder_name = os.path.basename(os.path.dirname(f))
-                df['model_id'] = folder_name
-            else:
-                # Ensure it's a string for grouping consistency
-                df['model_id'] = df['model_id'].astype(str)
-
-            dfs.append(df)
-            
-        except Exception as e:
-            print(f"Skipped {f}: {e}")
-            
-    if not dfs:
-        print("No valid data loaded.")
+    if moments is None:
+        print(f"No valid data loaded from {DATA_DIR}.")
         return
 
-    full_df = pd.concat(dfs, ignore_index=True)
-    print(f"Data loaded: {len(full_df)} total rows across {full_df['dataset'].nunique()} datasets.")
+    print(f"Data loaded: {int(moments['n'].sum())} total rows across {moments['dataset'].nunique()} datasets.")
 
 
     print("Calculating stability metrics...")
     
-    rollout_stats = full_df.groupby(['dataset', 'model_id', 'example_id'])['reward'].std().reset_index()
+    audit_df = decompose(moments)
     
-    dataset_noise = rollout_stats.groupby('dataset')['reward'].mean().reset_index()
-    dataset_noise.columns = ['dataset', 'noise_score']
+    audit_df['noise_score'] = audit_df['noise_score'].fillna(0)
 
-    dataset_skill = full_df.groupby('dataset')['reward'].mean().reset_index()
-    dataset_skill.columns = ['dataset', 'mean_accuracy']
+    print("\n--- Variance Components (model / example / rollout) ---")
+    print(audit_df.drop(columns=['n_models', 'n_rollouts']).round(3).to_string(index=False))
+    audit_df.to_csv(COMPONENTS_FILE, index=False)
+    print(f"Saved variance components to {COMPONENTS_FILE}")
 
-    audit_df = pd.merge(dataset_noise, dataset_skill, on='dataset')
-    
-    audit_df['noise_score'] = audit_df['noise_score'].fillna(0)
+    # The preview samples the same examples for every model, so an example
+    # (across models) is the sampled unit.
+    rollout_stats = moments.assign(reward=example_std(moments, 'sum', 'sumsq'))
+    print_sampling_error(rollout_stats, 'dataset', 'reward', label="noise score", preview=PREVIEW_FRACTION)
+    print_sampling_error(moments.rename(columns={'sum': 'reward'}), 'dataset', 'reward',
+                         label="mean accuracy", count='n', preview=PREVIEW_FRACTION)
 
-    
+    plot_signal_to_noise(audit_df)
+
+def plot_signal_to_noise(audit_df, output_file=OUTPUT_FILE):
     plt.figure(figsize=(14, 9))
     sns.set_theme(style="whitegrid")
 
@@ -109,8 +88,8 @@ def analyze_signal_to_noise():
     plt.legend(loc='upper right')
     plt.tight_layout()
 
-    plt.savefig(OUTPUT_FILE)
-    print(f"Generated analysis chart: {OUTPUT_FILE}")
+    plt.savefig(output_file)
+    print(f"Generated analysis chart: {output_file}")
 
 if __name__ == "__main__":
     analyze_signal_to_noise()
\ No newline at end of file
@@ -0,0 +1,325 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from loader import scan_table
+from schema import decode_keys
+from spill import MEMORY_BUDGET, SpillingGroupBy
+
+EXAMPLE_KEYS = ['model_id', 'dataset', 'example_id']
+CELL_KEYS = ['model_id', 'dataset']
+
+# Columns of a cell table that can be summed across cells; everything else
+# is derived from them by finalize_cells().
+ADDITIVE_COLUMNS = [
+    'n_rollouts', 'sum_reward', 'n_tokens', 'sum_tokens', 'n_examples',
+    'sum_pass_1', 'n_pass_k', 'sum_pass_k', 'noise_sum', 'noise_n',
+    'n_capped', 'sum_reward_capped', 'sum_tokens_capped',
+    'ex_sum_sq', 'ex_sum_n', 'ex_n_sq',
+]
+
+# Rollouts above this many completion tokens are left out of the *_capped
+# columns, matching the cap the token-efficiency scripts apply.
+TOKEN_CAP = 8000
+
+# A cell's rollout budget is the largest k that at least this share of its
+# examples have k rollouts for. Pass@k is only reported up to the budget.
+MIN_COVERAGE = 0.95
+
+# Rows per Arrow group-by pass in grouped_sums().
+CHUNK_ROWS = 1 << 20
+SUM_OF_NONE_IS_0 = pc.ScalarAggregateOptions(min_count=0)
+
+
+def pass_at_k(n, c, k):
+    """
+    Vectorised unbiased Pass@k estimator: 1 - C(n-c, k) / C(n, k). NaN for
+    examples with fewer than k samples, which cannot support Pass@k.
+    """
+    n = np.asarray(n, dtype=float)
+    c = np.asarray(c, dtype=float)
+    prob_fail = np.ones_like(n)
+    for i in range(k):
+        prob_fail *= np.clip((n - c - i) / np.maximum(n - i, 1), 0.0, None)
+    return np.where(n >= k, 1.0 - prob_fail, np.nan)
+
+
+def cell_budgets(stats, min_coverage=MIN_COVERAGE):
+    """Rollout budget per (model, dataset): the largest k for which Pass@k is reported."""
+    def budget(n):
+        return int(np.sort(n.to_numpy())[int(len(n) * (1 - min_coverage))])
+    return stats.groupby(CELL_KEYS, observed=True)['n'].agg(budget).rename('budget')
+
+
+def pass_at_k_valid(stats, k, min_coverage=MIN_COVERAGE):
+    """
+    Per-example Pass@k, NaN unless the example has at least k rollouts and
+    its cell's budget reaches k.
+    """
+    budget = stats.join(cell_budgets(stats, min_coverage), on=CELL_KEYS)['budget']
+    return pd.Series(pass_at_k(stats['n'], stats['n_correct'], k), index=stats.index).where(budget >= k)
+
+
+def pass_at_k_curve(stats, k_max=None):
+    """
+    Pass@k for k = 1..k_max in every (model, dataset) cell, over the examples
+    with at least k rollouts, so no k is ever capped. One row per cell and k
+    with the number of those examples, the sum and sum of squares of their
+    Pass@k, and of their gain over Pass@(k-1). k_max defaults to the most
+    rollouts any example has.
+    """
+    groups = stats.groupby(CELL_KEYS, observed=True, sort=True)
+    codes = groups.ngroup().to_numpy()
+    cells = groups.size().index
+    n = stats['n'].to_numpy(dtype=float)
+    c = stats['n_correct'].to_numpy(dtype=float)
+    k_max = int(n.max(initial=0)) if k_max is None else k_max
+
+    # C(n-c, k) / C(n, k), built up one factor per k.
+    prob_fail = np.ones_like(n)
+    parts = []
+    for k in range(1, k_max + 1):
+        before = 1.0 - prob_fail
+        prob_fail = prob_fail * np.clip((n - c - (k - 1)) / np.maximum(n - (k - 1), 1), 0.0, None)
+        valid = n >= k
+        if not valid.any():
+            break
+        p, gain, code = 1.0 - prob_fail[valid], (1.0 - prob_fail - before)[valid], codes[valid]
+        parts.append(pd.DataFrame({
+            'k': k,
+            'n_examples': np.bincount(code, minlength=len(cells)),
+            'sum_pass_k': np.bincount(code, p, len(cells)),
+            'sumsq_pass_k': np.bincount(code, p * p, len(cells)),
+            'sum_gain': np.bincount(code, gain, len(cells)),
+            'sumsq_gain': np.bincount(code, gain * gain, len(cells)),
+        }, index=cells))
+    if not parts:
+        return pd.DataFrame(columns=CELL_KEYS + ['k', 'n_examples', 'sum_pass_k', 'sumsq_pass_k',
+                                                 'sum_gain', 'sumsq_gain'])
+    curve = pd.concat(parts).reset_index()
+    return curve[curve['n_examples'] > 0].reset_index(drop=True)
+
+
+def as_table(data):
+    """Arrow table for a scan result, converting a DataFrame if that is what was passed."""
+    if isinstance(data, pa.Table):
+        return data
+    return pa.Table.from_pandas(data, preserve_index=False)
+
+
+def _sorted_frame(table, keys):
+    return decode_keys(table).sort_by([(k, 'ascending') for k in keys]).to_pandas()
+
+
+def _pair(batch, row):
+    return tuple(batch.column(k)[row].as_py() for k in CELL_KEYS)
+
+
+def _tables(data):
+    """The Arrow tables behind `data`: a table, a DataFrame, or an iterable of tables (e.g. loader.scan_tables())."""
+    if isinstance(data, (pa.Table, pd.DataFrame)):
+        yield as_table(data)
+    else:
+        yield from data
+
+
+def _chunks(data, rows=CHUNK_ROWS):
+    """
+    Slices of roughly `rows` rows, cut only between record batches of
+    different (model_id, dataset) cells, so a scan_table() result (which
+    keeps each file's rows together) or a stream of per-file tables never
+    has a cell split across slices.
+    """
+    batches, size, last, schema = [], 0, None, None
+    for table in _tables(data):
+        schema = schema or table.schema
+        cuttable = all(k in schema.names for k in CELL_KEYS)
+        for batch in table.to_batches():
+            if batch.num_rows == 0:
+                continue
+            if size >= rows and (not cuttable or _pair(batch, 0) != last):
+                yield pa.Table.from_batches(batches).unify_dictionaries()
+                batches, size = [], 0
+            batches.append(batch)
+            size += batch.num_rows
+            last = _pair(batch, -1) if cuttable else None
+    if batches:
+        yield pa.Table.from_batches(batches).unify_dictionaries()
+    elif schema is not None:
+        yield schema.empty_table()
+
+
+def _cells(part):
+    return set(map(tuple, decode_keys(part.select(CELL_KEYS)).group_by(CELL_KEYS).aggregate([])
+                   .to_pandas().itertuples(index=False)))
+
+
+def grouped_sums(data, keys, derive, budget=MEMORY_BUDGET):
+    """
+    Per-group sums of the columns `derive(chunk)` returns ({name: array}),
+    as a pandas frame sorted by `keys`, or None when `data` is an empty
+    stream. The derived columns are built and grouped one CHUNK_ROWS slice
+    at a time, so they never exist for the whole table at once; the
+    per-slice sums are merged with a second group-by only if some
+    (model_id, dataset) cell spans two slices. Slices past `budget` bytes
+    are spilled to disk and merged partition by partition (see spill.py).
+    Counts are sums of 0/1 columns; a group whose values are all null sums
+    to 0. `derive` may also return computed key columns, which are grouped
+    on rather than summed.
+    """
+    disjoint = all(k in keys for k in CELL_KEYS)
+    seen, n_parts = set(), 0
+    with SpillingGroupBy(keys, budget) as groups:
+        for chunk in _chunks(data):
+            columns = derive(chunk)
+            frame = pa.table({**{k: columns.pop(k) if k in columns else chunk[k] for k in keys}, **columns})
+            part = (frame.group_by(keys).aggregate([(c, 'sum', SUM_OF_NONE_IS_0) for c in columns])
+                    .rename_columns({f'{c}_sum': c for c in columns}))
+            if disjoint:
+                cells = _cells(part)
+                disjoint = seen.isdisjoint(cells)
+                seen |= cells
+            groups.add(part)
+            n_parts += 1
+        merged = groups.result(regroup=n_parts > 1 and not disjoint)
+    if merged is None:
+        return None
+    return _sorted_frame(merged.select(keys + [c for c in merged.column_names if c not in keys]), keys)
+
+
+def _ones(chunk):
+    return pa.array(np.ones(chunk.num_rows, dtype=np.int64))
+
+
+def example_stats(data, token_cap=TOKEN_CAP):
+    """
+    Per-example rollout tallies from a rollout-level Arrow table (or
+    DataFrame): rollout count, correct count, reward sum and sum of squares,
+    token count and sum, and the same reward/token sums over rollouts within
+    `token_cap`. Grouped in Arrow; only the per-example result is pandas.
+    """
+    def derive(chunk):
+        reward = chunk['reward']
+        if 'model_token_completion' in chunk.column_names:
+            tokens = chunk['model_token_completion']
+        else:
+            tokens = pa.nulls(chunk.num_rows, pa.int64())
+        capped = pc.fill_null(pc.less_equal(tokens, token_cap), False)
+        return {
+            'n': _ones(chunk),
+            'n_correct': pc.cast(pc.greater(reward, 0), pa.int64()),
+            'sum_reward': reward,
+            'sumsq_reward': pc.multiply(reward, reward),
+            'n_tokens': pc.cast(pc.is_valid(tokens), pa.int64()),
+            'sum_tokens': tokens,
+            'n_capped': pc.cast(capped, pa.int64()),
+            'sum_reward_capped': pc.if_else(capped, reward, 0.0),
+            'sum_tokens_capped': pc.if_else(capped, tokens, 0),
+        }
+    return grouped_sums(data, EXAMPLE_KEYS, derive)
+
+
+def group_mean(data, by, columns):
+    """Mean of each of `columns` per `by` group (nulls skipped), computed in Arrow."""
+    by = [by] if isinstance(by, str) else list(by)
+    table = as_table(data)
+    out = table.group_by(by).aggregate([(c, 'mean') for c in columns])
+    out = out.rename_columns({f'{c}_mean': c for c in columns})
+    return _sorted_frame(out.select(by + list(columns)), by)
+
+
+def example_std(stats, total='sum_reward', squares='sumsq_reward'):
+    """
+    Sample std of reward across an example's rollouts (NaN for a single
+    rollout), from the count `n` and the `total` and `squares` columns.
+    """
+    n = stats['n'].astype(float)
+    var = (stats[squares] - stats[total] ** 2 / n) / (n - 1)
+    return np.sqrt(var.clip(lower=0)).where(n > 1)
+
+
+def cell_table(stats, k=None):
+    """
+    Rolls per-example tallies up to one additive row per (model, dataset).
+    Pass@k counts only the examples with at least k rollouts in cells whose
+    budget reaches k (n_pass_k of them), as in tables.pass_at_k_table(); k
+    defaults to the median cell budget.
+    """
+    if k is None:
+        k = int(cell_budgets(stats).median())
+    frame = stats.assign(
+        pass_1=stats['n_correct'] / stats['n'],
+        pass_k=pass_at_k_valid(stats, k),
+        noise=example_std(stats),
+        ex_sum_sq=stats['sum_reward'] ** 2,
+        ex_sum_n=stats['sum_reward'] * stats['n'],
+        ex_n_sq=stats['n'] ** 2,
+    )
+    cells = frame.groupby(CELL_KEYS, observed=True).agg(
+        n_rollouts=('n', 'sum'),
+        sum_reward=('sum_reward', 'sum'),
+        n_tokens=('n_tokens', 'sum'),
+        sum_tokens=('sum_tokens', 'sum'),
+        n_examples=('n', 'size'),
+        sum_pass_1=('pass_1', 'sum'),
+        n_pass_k=('pass_k', 'count'),
+        sum_pass_k=('pass_k', 'sum'),
+        noise_sum=('noise', 'sum'),
+        noise_n=('noise', 'count'),
+        n_capped=('n_capped', 'sum'),
+        sum_reward_capped=('sum_reward_capped', 'sum'),
+        sum_tokens_capped=('sum_tokens_capped', 'sum'),
+        ex_sum_sq=('ex_sum_sq', 'sum'),
+        ex_sum_n=('ex_sum_n', 'sum'),
+        ex_n_sq=('ex_n_sq', 'sum'),
+    ).reset_index()
+    cells.attrs['k'] = k
+    return finalize_cells(cells)
+
+
+def finalize_cells(cells):
+    """Adds the derived metrics to a frame of (possibly summed) additive columns."""
+    out = cells.copy()
+    out['accuracy'] = out['sum_reward'] / out['n_rollouts']
+    out['mean_tokens'] = out['sum_tokens'] / out['n_tokens'].where(out['n_tokens'] > 0)
+    out['pass_1'] = out['sum_pass_1'] / out['n_examples']
+    out['pass_k'] = out['sum_pass_k'] / out['n_pass_k'].where(out['n_pass_k'] > 0)
+    out['noise_score'] = out['noise_sum'] / out['noise_n'].where(out['noise_n'] > 0)
+    out['capped_accuracy'] = out['sum_reward_capped'] / out['n_capped'].where(out['n_capped'] > 0)
+    out['capped_tokens'] = out['sum_tokens_capped'] / out['n_capped'].where(out['n_capped'] > 0)
+    out['accuracy_se'] = accuracy_se(out)
+    return out
+
+
+def accuracy_se(cells):
+    """
+    Standard error of the rollout-weighted accuracy, treating each example
+    (with all its rollouts) as one sampled unit. Built from the additive
+    ex_* columns, so it stays valid after rollup().
+    """
+    n, s = cells['n_rollouts'], cells['sum_reward']
+    k = cells['n_examples']
+    mean = s / n
+    resid = cells['ex_sum_sq'] - 2 * mean * cells['ex_sum_n'] + mean ** 2 * cells['ex_n_sq']
+    return np.sqrt((resid.clip(lower=0) * k / (k - 1).where(k > 1)) / n ** 2)
+
+
+def rollup(cells, by):
+    """Merges cells over everything but `by` (e.g. 'model_id' for per-model totals)."""
+    by = [by] if isinstance(by, str) else list(by)
+    summed = cells.groupby(by, observed=True)[ADDITIVE_COLUMNS].sum().reset_index()
+    summed.attrs = dict(cells.attrs)
+    return finalize_cells(summed)
+
+
+def build_cells(data_dir, token_cap=TOKEN_CAP, **scan_kwargs):
+    """Scans the corpus once and returns its (model, dataset) cell table."""
+    table = scan_table(data_dir, columns=['example_id', 'reward'],
+                       optional=['model_token_completion'], **scan_kwargs)
+    if table is None:
+        return None
+    stats = example_stats(table, token_cap)
+    cells = cell_table(stats)
+    cells.attrs['token_cap'] = token_cap
+    return cells
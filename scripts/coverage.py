@@ -0,0 +1,209 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregates import example_stats
+from loader import corpus_key, prune_cache, scan_table
+from preview import PREVIEW_FRACTION
+from quarantine import CACHE_DIR
+
+DATA_DIR = "../inference-scratch"
+COVERAGE_FORMAT = 1
+
+# How rollouts of one example collapse to a single correct/incorrect bit.
+MODES = {
+    'any': lambda n, c: c > 0,
+    'majority': lambda n, c: 2 * c > n,
+}
+
+
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """Set bits per row of a uint64 bitset array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8)
+    return _BYTE_COUNTS[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def pack(bools):
+    """(rows, n) bool matrix -> (rows, ceil(n / 64)) uint64 bitsets."""
+    rows, n = bools.shape
+    padded = np.zeros((rows, -(-n // 64) * 64), dtype=bool)
+    padded[:, :n] = bools
+    return np.packbits(padded, axis=1, bitorder='little').view(np.uint64)
+
+
+class CorrectnessIndex:
+    """
+    Bit-packed (model x example) correctness. Each model has one uint64
+    bitset per mode ('any', 'majority') plus a `covered` bitset of the
+    examples it has results for; an example is a (dataset, example_id) pair.
+    All queries are popcounts over ANDs/ORs of these rows.
+    """
+
+    def __init__(self, models, examples, bits, covered):
+        self.models = list(models)
+        self.examples = examples
+        self.bits = bits
+        self.covered = covered
+        self._row = {m: i for i, m in enumerate(self.models)}
+
+    @classmethod
+    def from_stats(cls, stats):
+        models, m_idx = np.unique(stats['model_id'].to_numpy(dtype=object), return_inverse=True)
+        keys = pd.MultiIndex.from_arrays([stats['dataset'], stats['example_id']])
+        u_idx, uniques = pd.factorize(keys)
+        examples = uniques.to_frame(index=False, name=['dataset', 'example_id'])
+
+        shape = (len(models), len(examples))
+        covered = np.zeros(shape, dtype=bool)
+        covered[m_idx, u_idx] = True
+        n, c = stats['n'].to_numpy(), stats['n_correct'].to_numpy()
+        bits = {}
+        for mode, rule in MODES.items():
+            dense = np.zeros(shape, dtype=bool)
+            dense[m_idx, u_idx] = rule(n, c)
+            bits[mode] = pack(dense)
+        return cls(models, examples, bits, pack(covered))
+
+    def rows(self, models):
+        return [self._row[m] for m in models]
+
+    def scope(self, models=None, datasets=None):
+        """Examples every one of `models` has results for, optionally limited to `datasets`."""
+        rows = self.rows(models or self.models)
+        mask = np.bitwise_and.reduce(self.covered[rows], axis=0)
+        if datasets is not None:
+            names = self.examples['dataset']
+            members = [d for d in names.unique() if any(t in d for t in datasets)]
+            mask &= pack(names.isin(members).to_numpy()[None, :])[0]
+        return mask
+
+    def accuracy(self, mode='any', scope=None):
+        scope = self.scope() if scope is None else scope
+        return pd.Series(popcount(self.bits[mode] & scope) / max(popcount(scope), 1),
+                         index=self.models, name=f'accuracy_{mode}')
+
+    def error_overlap(self, mode='any', scope=None):
+        """
+        Pairwise Jaccard overlap of error sets: both wrong / either wrong.
+        High overlap means the two models fail on the same examples and gain
+        little from being ensembled.
+        """
+        scope = self.scope() if scope is None else scope
+        wrong = ~self.bits[mode] & scope
+        overlap = np.zeros((len(self.models), len(self.models)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(len(self.models)):
+                overlap[i] = popcount(wrong[i] & wrong) / popcount(wrong[i] | wrong)
+        return pd.DataFrame(overlap, index=self.models, columns=self.models)
+
+    def oracle_accuracy(self, models, mode='any', scope=None):
+        """Share of examples at least one of `models` gets right."""
+        scope = self.scope(models) if scope is None else scope
+        union = np.bitwise_or.reduce(self.bits[mode][self.rows(models)], axis=0)
+        return popcount(union & scope) / max(popcount(scope), 1)
+
+    def greedy_subset(self, k, mode='any', candidates=None, scope=None):
+        """
+        Greedy best-k ensemble: repeatedly add the model that covers the most
+        still-uncovered examples. Returns [(model, oracle accuracy so far)].
+        """
+        candidates = list(candidates or self.models)
+        scope = self.scope(candidates) if scope is None else scope
+        total = max(popcount(scope), 1)
+        bits = self.bits[mode][self.rows(candidates)] & scope
+
+        chosen, union, path = [], np.zeros_like(scope), []
+        for _ in range(min(k, len(candidates))):
+            gains = popcount(bits & ~union)
+            gains[chosen] = -1
+            best = int(np.argmax(gains))
+            if gains[best] <= 0 and chosen:
+                break
+            chosen.append(best)
+            union |= bits[best]
+            path.append((candidates[best], popcount(union) / total))
+        return path
+
+    def save(self, path):
+        np.savez_compressed(
+            path, models=np.array(self.models, dtype=object),
+            datasets=self.examples['dataset'].to_numpy(dtype=object),
+            example_ids=self.examples['example_id'].to_numpy(),
+            covered=self.covered, **{f'bits_{m}': b for m, b in self.bits.items()},
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as z:
+            examples = pd.DataFrame({'dataset': z['datasets'], 'example_id': z['example_ids']})
+            bits = {m: z[f'bits_{m}'] for m in MODES}
+            return cls(z['models'].tolist(), examples, bits, z['covered'])
+
+
+def load_index(data_dir, preview=PREVIEW_FRACTION, rebuild=False, cache_dir=CACHE_DIR):
+    """CorrectnessIndex for the corpus, cached under `cache_dir` until the corpus changes."""
+    path = os.path.join(cache_dir, f"coverage-{corpus_key(data_dir, COVERAGE_FORMAT, preview)}.npz")
+    if os.path.exists(path) and not rebuild:
+        os.utime(path)
+        return CorrectnessIndex.load(path)
+
+    table = scan_table(data_dir, columns=['example_id', 'reward'], preview=preview)
+    if table is None:
+        return None
+    index = CorrectnessIndex.from_stats(example_stats(table))
+    os.makedirs(cache_dir, exist_ok=True)
+    index.save(path)
+    prune_cache(os.path.join(cache_dir, f"coverage-{'?' * 16}.npz"), current=path)
+    return index
+
+
+def analyze_coverage(data_dir=DATA_DIR, k=5, mode='any', datasets=None, models=None):
+    print("Loading correctness index...")
+    index = load_index(data_dir)
+    if index is None:
+        print(f"No valid data loaded from {data_dir}.")
+        return
+
+    candidates = models or index.models
+    scope = index.scope(candidates, datasets)
+    n_scope = popcount(scope)
+    print(f"{len(candidates)} models, {n_scope} examples answered by all of them "
+          f"(of {len(index.examples)} total). Correct = '{mode}' over rollouts.")
+    if n_scope == 0:
+        print("No examples are shared by every selected model; narrow --models or --datasets.")
+        return
+
+    acc = index.accuracy(mode, scope)[candidates].sort_values(ascending=False)
+    print("\n--- Single-model accuracy ---")
+    print(acc.round(3).to_string())
+
+    overlap = index.error_overlap(mode, scope).loc[candidates, candidates]
+    pairs = overlap.where(np.triu(np.ones(overlap.shape, dtype=bool), 1)).stack()
+    print("\n--- Least overlapping error sets (best ensembling pairs) ---")
+    print(pairs.sort_values().head(10).round(3).to_string())
+
+    print(f"\n--- Greedy best-{k} oracle ensemble ---")
+    for i, (model, covered) in enumerate(index.greedy_subset(k, mode, candidates, scope), 1):
+        print(f"{i}. +{model:<40} oracle accuracy {covered:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ensemble/oracle coverage over the correctness bitsets.")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--mode', choices=list(MODES), default='any')
+    parser.add_argument('--datasets', help="comma-separated task keywords")
+    parser.add_argument('--models', help="comma-separated model ids to choose from")
+    args = parser.parse_args()
+    analyze_coverage(
+        args.data_dir, args.k, args.mode,
+        datasets=args.datasets.split(',') if args.datasets else None,
+        models=args.models.split(',') if args.models else None,
+    )
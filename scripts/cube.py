@@ -0,0 +1,156 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from aggregates import ADDITIVE_COLUMNS, TOKEN_CAP, build_cells, finalize_cells
+from loader import corpus_key, prune_cache
+from preview import PREVIEW_FRACTION
+from quarantine import CACHE_DIR
+
+CUBE_FORMAT = 2
+
+# metric -> (numerator, denominator) over the additive cube columns.
+METRICS = {
+    'accuracy': ('sum_reward', 'n_rollouts'),
+    'capped_accuracy': ('sum_reward_capped', 'n_capped'),
+    'mean_tokens': ('sum_tokens', 'n_tokens'),
+    'capped_tokens': ('sum_tokens_capped', 'n_capped'),
+    'pass_1': ('sum_pass_1', 'n_examples'),
+    'pass_k': ('sum_pass_k', 'n_pass_k'),
+    'noise_score': ('noise_sum', 'noise_n'),
+}
+
+
+def group_members(datasets, spec):
+    """
+    Boolean mask over `datasets` for one task group. `spec` is a list of
+    keywords matched as substrings of the dataset name, or a dict with
+    'include' and optional 'exclude' keyword lists.
+    """
+    if isinstance(spec, dict):
+        include, exclude = spec['include'], spec.get('exclude', [])
+    else:
+        include, exclude = spec, []
+    return np.array([
+        any(t in d for t in include) and not any(t in d for t in exclude)
+        for d in datasets
+    ], dtype=bool)
+
+
+class ScoreCube:
+    """
+    Dense model x dataset arrays of the additive cell columns. Any composite
+    score is a ratio of two matrix products against a dataset-membership
+    matrix, so regrouping tasks never touches the corpus.
+    """
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.models = np.array(sorted(cells['model_id'].unique()), dtype=object)
+        self.datasets = np.array(sorted(cells['dataset'].unique()), dtype=object)
+        self.k = cells.attrs.get('k')
+        self.token_cap = cells.attrs.get('token_cap')
+
+        rows = pd.Index(self.models).get_indexer(cells['model_id'])
+        cols = pd.Index(self.datasets).get_indexer(cells['dataset'])
+        shape = (len(self.models), len(self.datasets))
+        self.arrays = {}
+        for col in ADDITIVE_COLUMNS:
+            arr = np.zeros(shape)
+            arr[rows, cols] = cells[col].to_numpy(dtype=float)
+            self.arrays[col] = arr
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[rows, cols] = True
+
+    def membership(self, groups):
+        return np.column_stack([group_members(self.datasets, spec) for spec in groups.values()]).astype(float)
+
+    def composite(self, groups, metric='accuracy', average='micro', with_se=False):
+        """
+        One column per group in `groups` ({name: spec}), one row per model.
+
+        micro -- pooled over every rollout/example of the group, so large
+                 datasets weigh more (the historical rote_vs_reason score)
+        macro -- unweighted mean of the per-dataset scores
+        Models with no data in a group get NaN. with_se adds `<name>_se`
+        columns (accuracy only), treating examples as the sampled units.
+        """
+        num_col, den_col = METRICS[metric]
+        G = self.membership(groups)
+        num, den = self.arrays[num_col], self.arrays[den_col]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if average == 'micro':
+                values = (num @ G) / (den @ G)
+            elif average == 'macro':
+                valid = self.present & (den > 0)
+                per_cell = np.where(valid, num / np.where(valid, den, 1), 0.0)
+                values = (per_cell @ G) / (valid @ G)
+            else:
+                raise ValueError(f"average must be 'micro' or 'macro', not {average!r}")
+
+        out = pd.DataFrame(values, index=pd.Index(self.models, name='model_id'), columns=list(groups))
+        if with_se:
+            if metric != 'accuracy':
+                raise ValueError("sampling errors are only tracked for accuracy")
+            se = self._accuracy_se(G, average)
+            for i, name in enumerate(groups):
+                out[f'{name}_se'] = se[:, i]
+        return out
+
+    def _accuracy_se(self, G, average):
+        a = self.arrays
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if average == 'micro':
+                n, s, k = a['n_rollouts'] @ G, a['sum_reward'] @ G, a['n_examples'] @ G
+                mean = s / n
+                resid = (a['ex_sum_sq'] @ G) - 2 * mean * (a['ex_sum_n'] @ G) + mean ** 2 * (a['ex_n_sq'] @ G)
+                return np.sqrt(np.clip(resid, 0, None) * k / np.where(k > 1, k - 1, np.nan)) / n
+            n, s, k = a['n_rollouts'], a['sum_reward'], a['n_examples']
+            mean = s / n
+            resid = a['ex_sum_sq'] - 2 * mean * a['ex_sum_n'] + mean ** 2 * a['ex_n_sq']
+            var = np.nan_to_num(np.clip(resid, 0, None) * k / np.where(k > 1, k - 1, np.nan) / n ** 2)
+            valid = (self.present & (n > 0)).astype(float)
+            return np.sqrt(var @ G) / (valid @ G)
+
+    def table(self):
+        return finalize_cells(self.cells)
+
+
+def load_cube(data_dir, token_cap=TOKEN_CAP, preview=PREVIEW_FRACTION, rebuild=False, cache_dir=CACHE_DIR):
+    """
+    Returns the ScoreCube for the corpus as it is on disk now. The cube is
+    persisted under `cache_dir` keyed by the corpus signature, token cap and
+    preview fraction, and only rebuilt from parquet when one of them changes.
+    """
+    path = os.path.join(cache_dir, f"score_cube-{corpus_key(data_dir, CUBE_FORMAT, token_cap, preview)}.parquet")
+
+    if os.path.exists(path) and not rebuild:
+        os.utime(path)
+        table = pq.read_table(path)
+        meta = json.loads(table.schema.metadata[b'medarc_cube'])
+        cells = table.to_pandas()
+        cells.attrs.update(meta)
+        print(f"Loaded score cube {path} ({len(cells)} cells).")
+        return ScoreCube(cells)
+
+    print("Building score cube from the corpus...")
+    cells = build_cells(data_dir, token_cap=token_cap, preview=preview)
+    if cells is None:
+        return None
+    cells = cells[['model_id', 'dataset'] + ADDITIVE_COLUMNS]
+    meta = {'k': cells.attrs.get('k'), 'token_cap': token_cap, 'preview': preview, 'format': CUBE_FORMAT}
+    cells.attrs.update(meta)
+
+    table = pa.Table.from_pandas(cells, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'medarc_cube': json.dumps(meta)})
+    os.makedirs(cache_dir, exist_ok=True)
+    pq.write_table(table, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    prune_cache(os.path.join(cache_dir, f"score_cube-{'?' * 16}.parquet"), current=path)
+    print(f"Saved score cube to {path}.")
+    return ScoreCube(cells)
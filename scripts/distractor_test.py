@@ -1,47 +1,29 @@
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
+
+from aggregates import group_mean
+from loader import scan_table
+from preview import print_sampling_error
+from tables import KEYWORD_OP4, KEYWORD_OP5
 
 DATA_DIR = "../inference-scratch"
 OUTPUT_FILE = "distractor_stress_test.png"
 
-KEYWORD_OP4 = "medbullets-op4"
-KEYWORD_OP5 = "medbullets-op5"
-
 def load_task_data(task_keyword):
     """
     Searches for all parquet files matching a keyword and calculates 
     mean reward (accuracy) per model.
     """
     print(f"Searching for '{task_keyword}' data...")
-    files = glob.glob(f"{DATA_DIR}/**/*{task_keyword}*.parquet", recursive=True)
-    
-    if not files:
-        print(f"  -> No files found for {task_keyword}")
-        return None
+    table = scan_table(DATA_DIR, columns=['reward'], datasets=[task_keyword])
 
-    df_list = []
-    for f in files:
-        if os.path.getsize(f) == 0: continue
-        
-        try:
-            temp_df = pd.read_parquet(f, columns=['reward']) 
-            
-            model_id = os.path.basename(os.path.dirname(f))
-            temp_df['model_id'] = model_id
-            
-            df_list.append(temp_df)
-        except Exception:
-            pass
-            
-    if not df_list:
+    if table is None:
+        print(f"  -> No files found for {task_keyword}")
         return None
-        
-    full_df = pd.concat(df_list, ignore_index=True)
     
-    return full_df.groupby('model_id')['reward'].mean()
+    print_sampling_error(table, 'model_id', 'reward', label=f"{task_keyword} accuracy")
+    return group_mean(table, 'model_id', ['reward']).set_index('model_id')['reward']
 
 def analyze_distractors():
     acc_op4 = load_task_data(KEYWORD_OP4)
@@ -65,7 +47,10 @@ def analyze_distractors():
     comparison['Performance Drop'] = comparison['Op4 Accuracy'] - comparison['Op5 Accuracy']
     
     comparison = comparison.sort_values('Performance Drop', ascending=False)
-    
+
+    plot_distractors(comparison)
+
+def plot_distractors(comparison, output_file=OUTPUT_FILE):
     if len(comparison) > 15:
         top_movers = comparison.head(10)
         bottom_movers = comparison.tail(5)
@@ -131,8 +116,8 @@ def analyze_distractors():
         )
 
     plt.tight_layout()
-    plt.savefig(OUTPUT_FILE, dpi=300)
-    print(f"Generated {OUTPUT_FILE}")
+    plt.savefig(output_file, dpi=300)
+    print(f"Generated {output_file}")
 
 if __name__ == "__main__":
     analyze_distractors()
\ No newline at end of file
@@ -1,15 +1,14 @@
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
-import json
-import numpy as np
 from adjustText import adjust_text
 
+from aggregates import group_mean
+from loader import scan_table
+from preview import print_sampling_error
+from registry import METADATA_FILE
+
 DATA_DIR = "inference-scratch"
 OUTPUT_FILE = "token_efficiency_single_trend.png"
-METADATA_FILE = "model_metadata.json"
 
 TARGET_TASKS = [
     'medqa', 
@@ -20,45 +19,28 @@ TARGET_TASKS = [
 ]
 
 FONT_SIZE = 9
+TOKEN_CAP = 8000
 
 def analyze_token_efficiency():
     print("Loading data for Token Efficiency...")
-    files = []
-    for task in TARGET_TASKS:
-        found = glob.glob(f"{DATA_DIR}/**/*{task}*.parquet", recursive=True)
-        files.extend(found)
-    
-    if not files: return
-
-    dfs = []
-    for f in files:
-        if os.path.getsize(f) == 0: continue
-        try:
-            temp_df = pd.read_parquet(f)
-            temp_df['model_id'] = os.path.basename(os.path.dirname(f))
-            
-            if 'model_token_completion' in temp_df.columns: pass
-            elif 'generation_token_count' in temp_df.columns:
-                 temp_df['model_token_completion'] = temp_df['generation_token_count']
-            else: continue 
-            
-            dfs.append(temp_df[['model_id', 'reward', 'model_token_completion']])
-        except Exception: pass
-
-    if not dfs: return
-
-    df = pd.concat(dfs, ignore_index=True)
-    df = df[df['model_token_completion'] <= 8000] 
+    table = scan_table(
+        DATA_DIR,
+        columns=['reward', 'model_token_completion'],
+        datasets=TARGET_TASKS,
+        max_tokens=TOKEN_CAP,
+        classes=['family'],
+        metadata_file=METADATA_FILE,
+    )
+    if table is None: return
 
-    model_metrics = df.groupby('model_id').agg(
-        Accuracy=('reward', 'mean'),
-        Cost=('model_token_completion', 'mean')
-    ).reset_index()
+    model_metrics = group_mean(table, ['model_id', 'family'], ['reward', 'model_token_completion']).rename(
+        columns={'reward': 'Accuracy', 'model_token_completion': 'Cost', 'family': 'Family'}
+    )
+    print_sampling_error(table, 'model_id', ['reward', 'model_token_completion'], label="Accuracy / Cost")
 
-    think_keywords = ['think', 'reason', 'qwq', 'intellect', 'gpt-oss', 'sonnet-4_5', 'gpt_5_1']
-    model_metrics['Family'] = model_metrics['model_id'].apply(lambda x: 
-        'Thinking' if any(k in x.lower() for k in think_keywords) else 'Standard')
+    plot_single_trend(model_metrics)
 
+def plot_single_trend(model_metrics, output_file=OUTPUT_FILE):
     print(f"Plotting {len(model_metrics)} models...")
 
     sns.set_theme(style="whitegrid", context="paper")
@@ -106,8 +88,8 @@ def analyze_token_efficiency():
     plt.legend(loc="lower right")
     plt.tight_layout()
     
-    plt.savefig(OUTPUT_FILE, dpi=300)
-    print(f"Generated {OUTPUT_FILE}")
+    plt.savefig(output_file, dpi=300)
+    print(f"Generated {output_file}")
 
 if __name__ == "__main__":
     analyze_token_efficiency()
\ No newline at end of file
@@ -0,0 +1,294 @@
+import functools
+import glob
+import hashlib
+import json
+import operator
+import os
+import zlib
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from preview import MIN_EXAMPLES, PREVIEW_FRACTION, chosen_ranges, select_ranges
+from quarantine import Quarantine, SkipReport, file_fingerprint, footer_rows
+from registry import METADATA_FILE, load_metadata, load_registry
+from schema import CANONICAL_SCHEMA, SCAN_INFO_KEY, normalizer_for, to_frame
+from sync import is_manifest, manifest_files
+
+# Cache files kept per kind (score cubes, coverage indexes, pipeline memos).
+CACHE_KEEP = 3
+
+
+def _matches(value, wanted):
+    if callable(wanted):
+        return bool(wanted(value))
+    if isinstance(wanted, (list, tuple, set, frozenset)):
+        return value in wanted
+    return value == wanted
+
+
+def select_models(metadata, where):
+    """
+    Returns the model ids whose metadata matches every attribute in `where`.
+    Values may be a literal, a collection of allowed values or a predicate,
+    e.g. {'reasoning': True, 'size_without_quant': ['Small', 'Medium']}.
+    """
+    return {
+        mid for mid, info in metadata.items()
+        if all(_matches(info.get(attr), wanted) for attr, wanted in where.items())
+    }
+
+
+def corpus_files(data_dir):
+    """
+    (path, path relative to the corpus root) for every parquet file. `data_dir`
+    is a corpus directory or a snapshot manifest written by sync.py, whose
+    files are read straight from the content-addressed store.
+    """
+    if is_manifest(data_dir):
+        return manifest_files(data_dir)
+    return [(f, os.path.relpath(f, data_dir).replace(os.sep, '/'))
+            for f in sorted(glob.glob(f"{data_dir}/**/*.parquet", recursive=True))]
+
+
+def shard_of(rel, n_shards):
+    """Stable shard number for a file, from its path relative to the corpus root."""
+    return zlib.crc32(rel.encode()) % n_shards
+
+
+def discover_files(data_dir, datasets=None, models=None, shard=None, paths=None):
+    """
+    Lists (path, model_id, dataset) for every parquet file in corpus_files().
+    Datasets match as substrings of the file name, like the old
+    `*{task}*.parquet` globs; models match the parent folder exactly.
+    `shard=(i, n)` keeps only the files that shard_of() puts in shard i;
+    `paths` keeps only the listed files.
+    """
+    if paths is not None:
+        paths = {os.path.normpath(p) for p in paths}
+    found = []
+    for f, rel in corpus_files(data_dir):
+        dataset_name = os.path.basename(rel).replace('.parquet', '')
+        model_id = os.path.basename(os.path.dirname(rel))
+
+        if shard is not None and shard_of(rel, shard[1]) != shard[0]:
+            continue
+        if paths is not None and os.path.normpath(f) not in paths:
+            continue
+        if models is not None and model_id not in models:
+            continue
+        if datasets is not None and not any(t in dataset_name for t in datasets):
+            continue
+        found.append((f, model_id, dataset_name))
+    return found
+
+
+def corpus_signature(data_dir):
+    """(path, size, mtime) of every parquet file; changes whenever the corpus does."""
+    signature = []
+    for f, _ in corpus_files(data_dir):
+        st = os.stat(f)
+        signature.append((f, st.st_size, st.st_mtime_ns))
+    return tuple(signature)
+
+
+def corpus_key(data_dir, *params):
+    """Short hash of the corpus signature plus any build parameters, for cache file names."""
+    payload = json.dumps([list(params), corpus_signature(data_dir)])
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def prune_cache(pattern, current=None, keep=CACHE_KEEP):
+    """
+    Deletes the files matching the glob `pattern` except `current` and the
+    most recently used others, `keep` files in all. Readers touch a cache
+    file when they reuse it, so the order is by last use.
+    """
+    others = [f for f in glob.glob(pattern) if current is None or os.path.abspath(f) != os.path.abspath(current)]
+    others.sort(key=os.path.getmtime, reverse=True)
+    for path in others[max(keep - (current is not None), 0):]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _projected(columns, optional, max_tokens, preview):
+    """The canonical columns a scan with these arguments reads."""
+    projected = set(columns) | set(optional)
+    if preview:
+        projected.add('example_id')
+    if max_tokens is not None:
+        projected.add('model_token_completion')
+    return sorted(projected)
+
+
+def in_ranges(example_id, lo, hi):
+    """Filter keeping the rows whose `example_id` expression falls in one of the inclusive ranges (lo, hi)."""
+    if (lo == hi).all():
+        return example_id.isin(pa.array(lo, type=CANONICAL_SCHEMA.field('example_id').type))
+    ranges = [(example_id >= a) & (example_id <= b) for a, b in zip(lo.tolist(), hi.tolist())]
+    return functools.reduce(operator.or_, ranges)
+
+
+def _scan_file(path, columns, optional, max_tokens, preview, dataset_name):
+    norm = normalizer_for(path)
+    if preview and 'example_id' not in columns:
+        columns = list(columns) + ['example_id']
+    needed = list(columns) + (['model_token_completion'] if max_tokens is not None else [])
+    if not all(norm.has(col) for col in needed):
+        return None
+    columns = list(columns) + [col for col in optional if col not in columns]
+
+    row_filter = None
+    if max_tokens is not None:
+        row_filter = norm.raw('model_token_completion') <= max_tokens
+
+    # Renames, coalescing and casts happen inside the scan, and the filter
+    # lets row groups whose statistics rule them out go undecoded.
+    dataset = ds.dataset(path, format="parquet")
+    if not preview:
+        return dataset.to_table(columns=norm.projection(columns), filter=row_filter)
+
+    # Preview: the sampled id ranges go into the scan filter, so row groups
+    # whose example_id statistics fall outside them are never read. The
+    # ranges come from the row groups of the dataset's first file.
+    def read_ids():
+        ids = dataset.to_table(columns=norm.projection(['example_id']))['example_id']
+        row_groups = [rg.num_rows for fragment in dataset.get_fragments() for rg in fragment.row_groups]
+        return ids.to_numpy(zero_copy_only=False), row_groups
+
+    def scan(lo, hi):
+        keep = in_ranges(norm.expr('example_id'), lo, hi)
+        return dataset.to_table(columns=norm.projection(columns),
+                                filter=keep if row_filter is None else row_filter & keep)
+
+    lo, hi, n_chosen = chosen_ranges(dataset_name, read_ids, preview)
+    table = scan(lo, hi)
+    # A file that shares too few ids with its dataset's sample (a model run on
+    # other examples) gets a sample of its own ids instead.
+    if pc.count_distinct(table['example_id']).as_py() < min(MIN_EXAMPLES, n_chosen):
+        table = scan(*select_ranges(*read_ids(), preview))
+    return table
+
+
+def _constant(value, n):
+    """A dictionary-encoded column repeating `value`: 4 bytes a row instead of the string."""
+    return pa.DictionaryArray.from_arrays(pa.array(np.zeros(n, dtype=np.int32)), pa.array([value]))
+
+
+def scan_tables(data_dir, columns, optional=(), datasets=None, models=None, where=None,
+                max_tokens=None, metadata_file=METADATA_FILE, quarantine=None,
+                preview=PREVIEW_FRACTION, shard=None, paths=None, classes=(), skipped=None):
+    """
+    scan_table() as a stream: yields each file's table, with `model_id` and
+    `dataset` attached, as soon as it is read, so an aggregate such as
+    aggregates.example_stats() can consume the corpus without it ever being
+    in memory at once. Pass a quarantine.SkipReport as `skipped` to see
+    what was left out; the summary is printed once the stream is exhausted.
+    """
+    if where:
+        allowed = select_models(load_registry(metadata_file).metadata, where)
+        models = allowed if models is None else set(models) & allowed
+    if models is not None:
+        models = set(models)
+
+    if preview:
+        print(f"PREVIEW MODE: sampling {preview:.0%} of examples per model/dataset.")
+    if quarantine is None:
+        quarantine = Quarantine()
+    if skipped is None:
+        skipped = SkipReport()
+    registry = load_registry(metadata_file) if classes else None
+
+    for f, model_id, dataset_name in discover_files(data_dir, datasets, models, shard, paths):
+        if os.path.getsize(f) == 0:
+            skipped.add(model_id, dataset_name, 'EmptyFile', rows=0)
+            continue
+
+        fingerprint = file_fingerprint(f)
+        projected = _projected(columns, optional, max_tokens, preview)
+        known = quarantine.lookup(f, fingerprint, projected)
+        if known is not None:
+            skipped.add(model_id, dataset_name, f"quarantined {known['error_class']}", known['rows'])
+            continue
+
+        try:
+            table = _scan_file(f, columns, optional, max_tokens, preview, dataset_name)
+        except pa.ArrowException as e:
+            # Out of memory or an I/O error from the OS (errno set) says
+            # nothing about the file, so it is not remembered.
+            if isinstance(e, MemoryError) or (isinstance(e, OSError) and e.errno is not None):
+                raise
+            rows = footer_rows(f)
+            entry = quarantine.add(f, fingerprint, e, rows=rows, columns=None if rows is None else projected)
+            skipped.add(model_id, dataset_name, entry['error_class'], entry['rows'])
+            continue
+        quarantine.release(f, fingerprint, projected)
+
+        if table is None:
+            skipped.add(model_id, dataset_name, 'MissingColumns', footer_rows(f))
+            continue
+
+        table = table.append_column('model_id', _constant(model_id, table.num_rows))
+        table = table.append_column('dataset', _constant(dataset_name, table.num_rows))
+        if registry is not None:
+            table = registry.attach(table, classes)
+        yield table
+
+    quarantine.save()
+    skipped.print_summary()
+
+
+def scan_table(data_dir, columns, optional=(), datasets=None, models=None, where=None,
+               max_tokens=None, metadata_file=METADATA_FILE, quarantine=None,
+               preview=PREVIEW_FRACTION, shard=None, paths=None, classes=()):
+    """
+    Loads `columns` from every matching parquet file into one Arrow table
+    with `model_id` and `dataset` attached. Column names and dtypes follow
+    schema.CANONICAL_SCHEMA whatever spelling the file used. The per-file
+    tables are concatenated without copying; aggregate with
+    aggregates.example_stats() / group_mean() and convert only the results.
+
+    optional   -- extra columns that come back as nulls when a file lacks them
+    datasets   -- task keywords, matched against file names
+    models     -- model ids to keep
+    where      -- metadata attribute filters, see select_models()
+    max_tokens -- drop rollouts with more completion tokens than this
+    preview    -- if set, keep only this fraction of examples per
+                  (model, dataset); see preview.select_ranges()
+    shard      -- (i, n): scan only shard i of n, see discover_files()
+    paths      -- scan only these files
+    classes    -- registry.CLASS_COLUMNS to attach (e.g. ['family', 'size']),
+                  classified once per model from `metadata_file`
+
+    Files with no spelling of a requested column are skipped. Files that
+    fail to open or decode are recorded in the quarantine index, for the
+    columns that were requested, and not read for those columns again until
+    they change; memory and OS-level I/O errors are raised instead.
+    Everything skipped is summarised on stdout and kept in the table's
+    schema.scan_info()['skipped'].
+    """
+    skipped = SkipReport()
+    tables = list(scan_tables(data_dir, columns, optional, datasets, models, where, max_tokens,
+                              metadata_file, quarantine, preview, shard, paths, classes, skipped))
+    if not tables:
+        return None
+
+    # Every file already comes out in the canonical dtypes, so the schemas match.
+    # Concatenation only collects the chunks; unifying the one-entry key
+    # dictionaries rewrites the int32 indices, not the data.
+    table = pa.concat_tables(tables).unify_dictionaries()
+    info = {'skipped': skipped.to_frame().to_dict('records'), 'preview': preview}
+    return table.replace_schema_metadata({SCAN_INFO_KEY: json.dumps(info, default=int)})
+
+
+def scan_corpus(data_dir, columns, **kwargs):
+    """
+    scan_table() as a pandas DataFrame, with the skipped files in
+    `df.attrs['skipped']` and the preview fraction in `df.attrs['preview']`.
+    """
+    table = scan_table(data_dir, columns, **kwargs)
+    return None if table is None else to_frame(table)
@@ -0,0 +1,212 @@
+"""
+Sharded report builds through mergeable partial aggregates.
+
+    # on each analysis host (or any subset of the corpus)
+    python partials.py map --data-dir ../inference-scratch --shard 0/3 --out host0.partial
+    # anywhere, once the partials are collected
+    python partials.py reduce host*.partial --out-dir tables
+    # both steps with local worker processes
+    python partials.py run --data-dir ../inference-scratch --processes 4 --out-dir tables
+
+A partial is a directory holding
+    manifest.json       format/version, token cap, shard, the files it covers
+                        (with fingerprints) and the files it skipped
+    examples.parquet    one row per (model_id, dataset, example_id) with the
+                        additive rollout tallies of aggregates.example_stats();
+                        a file without example ids is one null-id row
+    token_hist.parquet  completion-token histogram per (model_id, dataset,
+                        correct) over the fixed tables.TOKEN_EDGES bins
+
+Every column is a count or a sum, so partials merge by key-wise addition
+in any order, and an example split across partials merges exactly.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from aggregates import EXAMPLE_KEYS, TOKEN_CAP, example_stats
+from loader import METADATA_FILE, corpus_files, scan_table, shard_of
+from quarantine import file_fingerprint
+from registry import load_registry
+from schema import scan_info
+from tables import (AVERAGE, HIST_KEYS, KEYWORD_OP4, KEYWORD_OP5, TARGET_TASKS, TASK_GROUPS, composite_table,
+                    distractor_table, efficiency_table, pass_at_k_curve_table, pass_at_k_table,
+                    rollout_budget_table, snr_table, thinking_length_table, token_efficiency_table,
+                    token_histogram)
+
+DATA_DIR = "../inference-scratch"
+PARTIAL_FORMAT = "medarc-partial"
+PARTIAL_VERSION = 2
+
+
+def map_shard(data_dir, out, shard=None, token_cap=TOKEN_CAP):
+    """Builds the partial for one shard of `data_dir` (all of it when shard is None)."""
+    # Keyed by the path under the corpus root: in a sync.py snapshot, two
+    # paths with identical content share one blob.
+    files = [(f, rel) for f, rel in corpus_files(data_dir) if shard is None or shard_of(rel, shard[1]) == shard[0]]
+    # example_id is optional: files without it still count toward the
+    # rollout-level tables, under a null example_id (see final_tables()).
+    table = scan_table(data_dir, columns=['reward'],
+                       optional=['example_id', 'model_token_completion'], shard=shard, preview=0)
+
+    if table is None:
+        examples = pd.DataFrame(columns=EXAMPLE_KEYS)
+        hist = pd.DataFrame(columns=HIST_KEYS + ['bin', 'count'])
+        skipped = []
+    else:
+        examples = example_stats(table, token_cap)
+        hist = token_histogram(table)
+        skipped = scan_info(table)['skipped']
+
+    manifest = {
+        'format': PARTIAL_FORMAT,
+        'version': PARTIAL_VERSION,
+        'token_cap': token_cap,
+        'shard': f"{shard[0]}/{shard[1]}" if shard else None,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'files': {rel: file_fingerprint(f) for f, rel in files},
+        'skipped': skipped,
+        'rows': 0 if table is None else table.num_rows,
+    }
+
+    tmp = f"{out}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    examples.to_parquet(os.path.join(tmp, 'examples.parquet'), index=False)
+    hist.to_parquet(os.path.join(tmp, 'token_hist.parquet'), index=False)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(tmp, out)
+    print(f"Wrote partial {out}: {len(manifest['files'])} files, {manifest['rows']} rows, "
+          f"{len(examples)} examples.")
+    return out
+
+
+def read_partials(paths):
+    """Loads and merges partial directories into (example stats, token histogram, manifests)."""
+    manifests, examples, hists = [], [], []
+    seen = {}
+    for path in paths:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != PARTIAL_FORMAT or manifest.get('version') != PARTIAL_VERSION:
+            raise ValueError(f"{path} is not a version {PARTIAL_VERSION} {PARTIAL_FORMAT}")
+        if manifests and manifest['token_cap'] != manifests[0]['token_cap']:
+            raise ValueError(f"{path} was built with token_cap={manifest['token_cap']}, "
+                             f"expected {manifests[0]['token_cap']}")
+        for rel in manifest['files']:
+            if rel in seen:
+                raise ValueError(f"{rel} is covered by both {seen[rel]} and {path}; "
+                                 "merging would double count it")
+            seen[rel] = path
+        manifests.append(manifest)
+        examples.append(pd.read_parquet(os.path.join(path, 'examples.parquet')))
+        hists.append(pd.read_parquet(os.path.join(path, 'token_hist.parquet')))
+
+    examples = pd.concat(examples, ignore_index=True)
+    value_cols = [c for c in examples.columns if c not in EXAMPLE_KEYS]
+    stats = examples.groupby(EXAMPLE_KEYS, observed=True, dropna=False)[value_cols].sum().reset_index()
+    hist = pd.concat(hists, ignore_index=True)
+    hist = hist.groupby(HIST_KEYS + ['bin'], observed=True)['count'].sum().reset_index()
+    return stats, hist, manifests
+
+
+def final_tables(stats, hist, registry):
+    """
+    The tables behind each report figure, computed from merged partials with
+    each script's own settings. Everything except thinking_length matches
+    the scripts exactly. Like the scripts, only the per-example tables
+    leave out rollouts from files without example ids.
+    """
+    keyed = stats[stats['example_id'].notna()]
+    return {
+        'efficiency_frontier': efficiency_table(stats, TARGET_TASKS, registry),
+        'token_efficiency': token_efficiency_table(stats, TARGET_TASKS, registry),
+        'pass_at_k': pass_at_k_table(keyed),
+        'rollout_budget': rollout_budget_table(keyed, pass_at_k_curve_table(keyed)),
+        'distractor': distractor_table(stats, KEYWORD_OP4, KEYWORD_OP5),
+        'rote_vs_reason': composite_table(keyed, TASK_GROUPS, AVERAGE),
+        'signal_to_noise': snr_table(keyed),
+        'thinking_length': thinking_length_table(hist, registry),
+    }
+
+
+def reduce_partials(paths, out_dir, metadata_file=METADATA_FILE):
+    stats, hist, manifests = read_partials(paths)
+    n_files = sum(len(m['files']) for m in manifests)
+    print(f"Merged {len(manifests)} partials covering {n_files} files, {len(stats)} examples.")
+
+    skipped = pd.DataFrame([r for m in manifests for r in m['skipped']])
+    if not skipped.empty:
+        print(f"WARNING: shards skipped {int(skipped['files'].sum())} files "
+              f"({int(skipped['rows'].sum())} rows):")
+        print(skipped.to_string(index=False))
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, table in final_tables(stats, hist, load_registry(metadata_file)).items():
+        path = os.path.join(out_dir, f"{name}.csv")
+        table.to_csv(path, index=False)
+        print(f"  {path}: {len(table)} rows")
+    return out_dir
+
+
+def _map_worker(args):
+    return map_shard(*args)
+
+
+def run_local(data_dir, out_dir, processes, metadata_file=METADATA_FILE, token_cap=TOKEN_CAP):
+    """Map over `processes` shards in parallel local processes, then reduce."""
+    work = tempfile.mkdtemp(prefix="medarc-partials-")
+    try:
+        jobs = [(data_dir, os.path.join(work, f"shard{i}.partial"), (i, processes), token_cap)
+                for i in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            paths = list(pool.map(_map_worker, jobs))
+        return reduce_partials(paths, out_dir, metadata_file)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _shard(spec):
+    i, n = (int(x) for x in spec.split('/'))
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard must be i/n with 0 <= i < n, got {spec}")
+    return i, n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Map/reduce the report over corpus shards.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_map = sub.add_parser('map', help="aggregate one shard into a partial")
+    p_map.add_argument('--data-dir', default=DATA_DIR)
+    p_map.add_argument('--shard', type=_shard, help="i/n; omit to cover the whole directory")
+    p_map.add_argument('--token-cap', type=int, default=TOKEN_CAP)
+    p_map.add_argument('--out', required=True)
+
+    p_reduce = sub.add_parser('reduce', help="merge partials into the final tables")
+    p_reduce.add_argument('partials', nargs='+')
+    p_reduce.add_argument('--out-dir', default='tables')
+    p_reduce.add_argument('--metadata', default=METADATA_FILE)
+
+    p_run = sub.add_parser('run', help="map with local processes, then reduce")
+    p_run.add_argument('--data-dir', default=DATA_DIR)
+    p_run.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    p_run.add_argument('--token-cap', type=int, default=TOKEN_CAP)
+    p_run.add_argument('--out-dir', default='tables')
+    p_run.add_argument('--metadata', default=METADATA_FILE)
+
+    args = parser.parse_args()
+    if args.command == 'map':
+        map_shard(args.data_dir, args.out, args.shard, args.token_cap)
+    elif args.command == 'reduce':
+        reduce_partials(args.partials, args.out_dir, args.metadata)
+    else:
+        run_local(args.data_dir, args.out_dir, args.processes, args.metadata, args.token_cap)
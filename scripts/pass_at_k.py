@@ -1,83 +1,63 @@
-import pandas as pd
-import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
+
+from aggregates import example_stats, pass_at_k_valid
+from loader import scan_tables
+from preview import PREVIEW_FRACTION, print_sampling_error
+from tables import MIN_GAIN, benchmark_budget_table, pass_at_k_curve_table, pass_at_k_table, rollout_budget_table
 
 DATA_DIR = "../inference-scratch"
 OUTPUT_FILE = "pass_at_k_ordered_by_pass1.png"
-
-def calculate_pass_at_k(n, c, k):
-    """
-    Estimates Pass@k using the unbiased estimator.
-    """
-    k_adj = min(n, k)
-    if c == n: return 1.0
-    if c == 0: return 0.0
-    
-    prob_fail = 1.0
-    for i in range(k_adj):
-        prob_fail *= (n - c - i) / (n - i)
-    
-    return 1.0 - prob_fail
+CURVES_FILE = "pass_at_k_curves.png"
+BUDGET_FILE = "rollout_budget.csv"
 
 def analyze_pass_k_sorted_by_baseline():
     print("Loading data for Pass@k Analysis...")
     
-    files = glob.glob(f"{DATA_DIR}/**/*.parquet", recursive=True)
-    
-    if not files:
-        print(f"No parquet files found in {DATA_DIR}.")
-        return
+    # Streamed file by file into the per-example group-by, which spills to
+    # disk past MEDARC_MEMORY_BUDGET instead of holding every example at once.
+    rollout_stats = example_stats(scan_tables(DATA_DIR, columns=['example_id', 'reward']))
 
-    print(f"Found {len(files)} files. Compiling data...")
-    
-    df_list = []
-    for f in files:
-        if os.path.getsize(f) == 0:
-            continue
-            
-        try:
-            temp_df = pd.read_parquet(f)
-            
-            dataset_name = os.path.basename(f).replace('.parquet', '')
-            model_id = os.path.basename(os.path.dirname(f))
-            
-            temp_df['dataset'] = dataset_name
-            temp_df['model_id'] = model_id
-            
-            if 'reward' in temp_df.columns and 'example_id' in temp_df.columns:
-                df_list.append(temp_df[['model_id', 'dataset', 'example_id', 'reward']])
-                
-        except Exception:
-            pass
-
-    if not df_list:
-        print("Could not load any valid dataframes.")
+    if rollout_stats is None:
+        print(f"Could not load any valid dataframes from {DATA_DIR}.")
         return
 
-    df = pd.concat(df_list, ignore_index=True)
-    print(f"Loaded {len(df)} total rows.")
+    print(f"Loaded {int(rollout_stats['n'].sum())} total rows.")
 
-    rollout_counts = df.groupby(['model_id', 'dataset', 'example_id']).size()
-    max_k_found = int(rollout_counts.max())
-    target_k = max_k_found 
-    
-    print(f"DEBUG: Max samples found: {max_k_found}. Calculating Pass@{target_k}...")
+    # Each (model, dataset) cell only supports Pass@k up to the rollouts its
+    # examples actually have; nothing past that budget is capped or reported.
+    curve = pass_at_k_curve_table(rollout_stats)
+    budgets = rollout_budget_table(rollout_stats, curve)
+    benchmarks = benchmark_budget_table(budgets)
 
-    df['is_correct'] = df['reward'] > 0
-    rollout_stats = df.groupby(['model_id', 'dataset', 'example_id'])['is_correct'].agg(['count', 'sum']).reset_index()
-    rollout_stats.columns = ['model_id', 'dataset', 'example_id', 'n_samples', 'n_correct']
-    
+    print(f"\n--- Rollouts needed per benchmark (until one more adds < {MIN_GAIN:.1%} Pass@k) ---")
+    print(benchmarks.round(1).to_string(index=False))
+    budgets.to_csv(BUDGET_FILE, index=False)
+    print(f"Saved per-cell rollout budgets to {BUDGET_FILE}")
+    plot_pass_at_k_curves(curve)
+
+    model_scores = pass_at_k_table(rollout_stats)
+    target_k = model_scores.attrs['k']
+    datasets = model_scores.attrs['datasets']
+    print(f"Comparing models at Pass@{target_k} on the {len(datasets)} datasets every model has {target_k} rollouts for.")
+    if model_scores.attrs['excluded']:
+        print(f"Left out {len(model_scores.attrs['excluded'])} datasets where some model has fewer: "
+              + ", ".join(model_scores.attrs['excluded']))
+    if not datasets:
+        return
+
+    # The sampling error covers the same examples as the bars.
+    rollout_stats = rollout_stats[rollout_stats['dataset'].isin(datasets)]
+    rollout_stats = rollout_stats.assign(pass_k=pass_at_k_valid(rollout_stats, target_k)).dropna(subset=['pass_k'])
+    rollout_stats = rollout_stats.rename(columns={'n': 'n_samples', 'pass_k': f'pass_{target_k}'})
     rollout_stats['pass_1'] = rollout_stats['n_correct'] / rollout_stats['n_samples']
-    
-    rollout_stats[f'pass_{target_k}'] = rollout_stats.apply(
-        lambda x: calculate_pass_at_k(x['n_samples'], x['n_correct'], target_k), axis=1
-    )
-    
-    model_scores = rollout_stats.groupby('model_id')[[ 'pass_1', f'pass_{target_k}']].mean().reset_index()
-    
+    rollout_stats = rollout_stats[['model_id', 'dataset', 'example_id', 'n_samples', 'n_correct', 'pass_1', f'pass_{target_k}']]
+    print_sampling_error(rollout_stats, 'model_id', ['pass_1', f'pass_{target_k}'], cluster=None,
+                         preview=PREVIEW_FRACTION)
+
+    plot_pass_at_k(model_scores, target_k)
+
+def plot_pass_at_k(model_scores, target_k, output_file=OUTPUT_FILE):
     model_scores = model_scores.sort_values('pass_1', ascending=False)
 
     plt.figure(figsize=(14, 8))
@@ -108,8 +88,35 @@ def analyze_pass_k_sorted_by_baseline():
     plt.legend()
     plt.tight_layout()
     
-    plt.savefig(OUTPUT_FILE)
-    print(f"Saved analysis to {OUTPUT_FILE}")
+    plt.savefig(output_file)
+    print(f"Saved analysis to {output_file}")
+
+def plot_pass_at_k_curves(curve, output_file=CURVES_FILE):
+    """Pass@k against k per dataset, one line per model, each ending at its cell's budget."""
+    datasets = sorted(curve['dataset'].unique())
+    cols = min(4, len(datasets))
+    rows = -(-len(datasets) // cols)
+    fig, axes = plt.subplots(rows, cols, figsize=(4.5 * cols, 3.5 * rows), sharey=True, squeeze=False)
+    sns.set_theme(style="whitegrid")
+    models = sorted(curve['model_id'].unique())
+    palette = dict(zip(models, sns.color_palette(n_colors=len(models))))
+
+    for ax, dataset in zip(axes.flat, datasets):
+        sns.lineplot(data=curve[curve['dataset'] == dataset], x='k', y='pass_k', hue='model_id',
+                     hue_order=models, palette=palette, marker='o', ax=ax, legend=False)
+        ax.set_title(dataset, fontsize=11)
+        ax.set_xscale('log', base=2)
+        ax.set_xlabel("Rollouts (k)")
+        ax.set_ylabel("Pass@k")
+    for ax in list(axes.flat)[len(datasets):]:
+        ax.axis('off')
+
+    handles = [plt.Line2D([], [], color=palette[m], marker='o') for m in models]
+    fig.legend(handles, models, loc='lower center', ncol=min(len(models), 6), fontsize=9)
+    fig.suptitle("Pass@k up to each cell's rollout budget", fontsize=16, weight='bold')
+    fig.tight_layout(rect=(0, 0.06, 1, 0.97))
+    fig.savefig(output_file)
+    print(f"Saved curves to {output_file}")
 
 if __name__ == "__main__":
     analyze_pass_k_sorted_by_baseline()
\ No newline at end of file
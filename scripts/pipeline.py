@@ -0,0 +1,385 @@
+"""
+The report as a DAG of memoized stages.
+
+    python pipeline.py                                   # every figure
+    python pipeline.py --only pass_at_k_figure,snr_figure
+    python pipeline.py --token-cap 16000                 # recomputes only what the cap feeds
+    python pipeline.py --graph                           # print the DAG and exit
+
+Stages run discover -> load -> aggregate -> metric -> figure. Each node's
+result is stored under <cache dir>/pipeline/, keyed by a hash of its own
+parameters and the keys of its inputs. Source nodes (the corpus and the
+metadata file) are keyed by their content: the file fingerprints and the
+metadata itself. Changing one parameter therefore only invalidates the
+nodes downstream of the first node that reads it. Nodes whose inputs are
+ready run concurrently on a thread pool. Figure nodes are serialised,
+because pyplot keeps global state.
+
+The rollout tables are not stored: memoization starts at the per-example
+stats, and the corpus is scanned only when a stage that reads rollouts is
+stale. Memos of superseded keys are pruned after each run.
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pyarrow.compute as pc
+
+from aggregates import TOKEN_CAP, example_stats
+from distractor_test import plot_distractors
+from efficiency_frontier_trend import plot_single_trend
+from loader import METADATA_FILE, corpus_signature, load_metadata, prune_cache, scan_table
+from pass_at_k import plot_pass_at_k, plot_pass_at_k_curves
+from preview import PREVIEW_FRACTION
+from quarantine import CACHE_DIR
+from registry import ModelRegistry
+from rote_vs_reason import plot_rote_vs_reason
+from schema import to_frame
+from SNR import plot_signal_to_noise
+from sync import hash_file
+from tables import (AVERAGE, KEYWORD_OP4, KEYWORD_OP5, TARGET_TASKS, TASK_GROUPS, composite_table, distractor_table,
+                    efficiency_table, pass_at_k_curve_table, pass_at_k_table, rollout_budget_table, snr_table,
+                    token_efficiency_table)
+from thinking_length import plot_thinking_length
+from thinking_tax import plot_efficiency_frontier
+from token_efficiency import plot_token_efficiency
+
+DATA_DIR = "../inference-scratch"
+OUTPUT_DIR = "figures"
+PIPELINE_FORMAT = 7
+WORKERS = 4
+
+DEFAULT_PARAMS = {
+    'data_dir': DATA_DIR,
+    'metadata_file': METADATA_FILE,
+    'preview': PREVIEW_FRACTION,
+    'token_cap': TOKEN_CAP,
+    'target_tasks': TARGET_TASKS,
+    'task_groups': TASK_GROUPS,
+    'average': AVERAGE,
+    'distractor_tasks': [KEYWORD_OP4, KEYWORD_OP5],
+    'output_dir': OUTPUT_DIR,
+}
+
+
+class Node:
+    """
+    One stage. `fn` is called with the results of `deps` as positional
+    arguments and the named `params` as keywords.
+
+    source -- always run; the key is a hash of the result, so downstream
+              memos survive as long as the content is unchanged
+    figure -- result is an output path; run one at a time, and treat the memo
+              as stale if the file is gone or no longer holds what this key
+              wrote (another run with other parameters overwrote it)
+    memo   -- False for bulky intermediates (the rollouts): never stored,
+              only rebuilt in-process when a stale node downstream needs them
+    """
+
+    def __init__(self, name, fn, deps=(), params=(), source=False, figure=False, memo=True):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        self.source = source
+        self.figure = figure
+        self.memo = memo
+
+
+def _hash(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+class Pipeline:
+    def __init__(self, nodes, cache_dir=CACHE_DIR, workers=WORKERS):
+        self.nodes = {node.name: node for node in nodes}
+        self.cache_dir = os.path.join(cache_dir, 'pipeline')
+        self.workers = workers
+        self.plot_lock = threading.Lock()
+
+    def order(self, targets=None):
+        """The nodes `targets` depend on (all nodes by default), dependencies first."""
+        ordered, seen = [], set()
+
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError(f"cycle through {' -> '.join(path + (name,))}")
+            if name in seen:
+                return
+            for dep in self.nodes[name].deps:
+                visit(dep, path + (name,))
+            seen.add(name)
+            ordered.append(name)
+
+        for name in targets or self.nodes:
+            if name not in self.nodes:
+                raise KeyError(f"unknown node {name!r}; have {', '.join(self.nodes)}")
+            visit(name)
+        return ordered
+
+    def _path(self, name, key):
+        return os.path.join(self.cache_dir, f"{name}-{key}.pkl")
+
+    def _call(self, node, values, params):
+        kwargs = {p: params[p] for p in node.params}
+        if not node.figure:
+            return node.fn(*values, **kwargs)
+        with self.plot_lock:
+            try:
+                return node.fn(*values, **kwargs)
+            finally:
+                plt.close('all')
+
+    def _store(self, name, key, value):
+        if self.nodes[name].figure:
+            # Every key writes the same output file, so remember what this one wrote.
+            value = {'path': value, 'sha256': hash_file(value)}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(name, key)
+        with open(f"{path}.tmp", 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    def _load(self, name, key):
+        path = self._path(name, key)
+        os.utime(path)
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+        return value['path'] if self.nodes[name].figure else value
+
+    def _figure_current(self, name, key):
+        """True while the figure node's output file is the one its memo wrote."""
+        with open(self._path(name, key), 'rb') as f:
+            memo = pickle.load(f)
+        return os.path.exists(memo['path']) and hash_file(memo['path']) == memo['sha256']
+
+    def _prune(self, order, keys):
+        """Drops memos of superseded keys, keeping the last few per node."""
+        for name in order:
+            node = self.nodes[name]
+            if node.source:
+                continue
+            pattern = os.path.join(self.cache_dir, f"{name}-{'?' * 16}.pkl")
+            if node.memo:
+                prune_cache(pattern, current=self._path(name, keys[name]))
+            else:
+                prune_cache(pattern, keep=0)
+
+    def run(self, targets=None, force=(), **overrides):
+        """
+        Brings `targets` up to date and returns {node: result} for them.
+        `overrides` replace DEFAULT_PARAMS; nodes in `force` are recomputed
+        even when memoized (and so is everything downstream of them).
+        """
+        params = {**DEFAULT_PARAMS, **overrides}
+        order = self.order(targets)
+        targets = list(targets or [name for name in order if self.nodes[name].memo])
+
+        # Pass 1: keys. Sources run here, since their key is their content.
+        keys, values, status = {}, {}, {}
+        for name in order:
+            node = self.nodes[name]
+            own = [PIPELINE_FORMAT, name, {p: params[p] for p in node.params}]
+            if node.source:
+                start = time.time()
+                values[name] = self._call(node, [], params)
+                keys[name] = _hash(own, values[name])
+                status[name] = f"source ({time.time() - start:.1f}s)"
+                continue
+            keys[name] = _hash(own, [keys[d] for d in node.deps])
+
+        # Which memos are missing or stale.
+        stale, forced = set(), set()
+        for name in order:
+            node = self.nodes[name]
+            if name in force or forced & set(node.deps):
+                forced.add(name)
+            if node.source or not node.memo:
+                continue
+            if name in forced or not os.path.exists(self._path(name, keys[name])):
+                stale.add(name)
+            elif node.figure and not self._figure_current(name, keys[name]):
+                stale.add(name)
+
+        # Memoized values are loaded lazily, only when a stale node or the caller
+        # needs them; unmemoized ones are computed then. One lock per node, taken
+        # in dependency order.
+        locks = {name: threading.Lock() for name in order}
+
+        def value_of(name):
+            with locks[name]:
+                if name not in values:
+                    node = self.nodes[name]
+                    if node.memo:
+                        values[name] = self._load(name, keys[name])
+                        status.setdefault(name, "cached")
+                    else:
+                        start = time.time()
+                        values[name] = self._call(node, [value_of(d) for d in node.deps], params)
+                        status[name] = f"computed, not stored ({time.time() - start:.1f}s)"
+            return values[name]
+
+        def compute(name):
+            node = self.nodes[name]
+            inputs = [value_of(d) for d in node.deps]
+            start = time.time()
+            value = self._call(node, inputs, params)
+            self._store(name, keys[name], value)
+            return value, time.time() - start
+
+        pending = [name for name in order if name in stale]
+        done = {name for name in order if name not in stale}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for name in [n for n in pending if all(d in done for d in self.nodes[n].deps)]:
+                    pending.remove(name)
+                    running[pool.submit(compute, name)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    value, seconds = future.result()
+                    with locks[name]:
+                        values[name] = value
+                    status[name] = f"computed ({seconds:.1f}s)"
+                    done.add(name)
+
+        results = {name: value_of(name) for name in targets}
+        self._prune(order, keys)
+        for name in order:
+            print(f"  {name:<28} {status.get(name, 'cached' if self.nodes[name].memo else 'not needed')}")
+        return results
+
+    def describe(self):
+        for name in self.order():
+            node = self.nodes[name]
+            kind = 'source' if node.source else 'figure' if node.figure else '' if node.memo else 'not stored'
+            print(f"{name:<28} <- {', '.join(node.deps) or '-':<28} "
+                  f"params: {', '.join(node.params) or '-'} {kind}")
+
+
+def _scan(signature, data_dir, preview):
+    return scan_table(data_dir, columns=['example_id', 'reward'],
+                      optional=['model_token_completion'], preview=preview)
+
+
+def _thinking_rollouts(rollouts, registry):
+    rollouts = registry.attach(rollouts, ['family'])
+    df = to_frame(rollouts.filter(pc.equal(rollouts['family'], 'Thinking')))
+    return df.assign(Outcome=np.where(df['reward'] > 0, 'Correct', 'Incorrect'))
+
+
+def _plot(plot, filename, prepare=None):
+    """Figure node body: draws `plot` into <output_dir>/<filename> and returns the path."""
+    def run(*values, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, filename)
+        plot(*(prepare(*values) if prepare else values), output_file=path)
+        return path
+    return run
+
+
+def _csv(filename):
+    """Like _plot(), for a node whose output is its input table written as CSV."""
+    def run(table, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, filename)
+        table.to_csv(path, index=False)
+        return path
+    return run
+
+
+REPORT = [
+    # discover
+    Node('corpus', lambda data_dir: corpus_signature(data_dir), params=['data_dir'], source=True),
+    Node('metadata', lambda metadata_file: load_metadata(metadata_file), params=['metadata_file'], source=True),
+    Node('registry', lambda metadata, metadata_file: ModelRegistry(metadata, metadata_file),
+         deps=['metadata'], params=['metadata_file']),
+    # load (the loader normalises column names during the scan)
+    Node('rollouts', _scan, deps=['corpus'], params=['data_dir', 'preview'], memo=False),
+    # aggregate
+    # Only the efficiency tables read the capped columns, so only they depend on the cap.
+    Node('example_stats', example_stats, deps=['rollouts']),
+    Node('capped_stats', example_stats, deps=['rollouts'], params=['token_cap']),
+    Node('thinking_rollouts', _thinking_rollouts, deps=['rollouts', 'registry'], memo=False),
+    # metric
+    Node('efficiency', lambda stats, registry, target_tasks: efficiency_table(stats, target_tasks, registry),
+         deps=['capped_stats', 'registry'], params=['target_tasks']),
+    Node('token_efficiency', lambda stats, registry, target_tasks: token_efficiency_table(stats, target_tasks, registry),
+         deps=['capped_stats', 'registry'], params=['target_tasks']),
+    Node('pass_at_k', pass_at_k_table, deps=['example_stats']),
+    Node('pass_at_k_curve', pass_at_k_curve_table, deps=['example_stats']),
+    Node('rollout_budget', rollout_budget_table, deps=['example_stats', 'pass_at_k_curve']),
+    Node('distractor', lambda stats, distractor_tasks: distractor_table(stats, *distractor_tasks),
+         deps=['example_stats'], params=['distractor_tasks']),
+    Node('rote_vs_reason', lambda stats, task_groups, average: composite_table(stats, task_groups, average),
+         deps=['example_stats'], params=['task_groups', 'average']),
+    Node('snr', snr_table, deps=['example_stats']),
+    # figure
+    Node('token_efficiency_figure', _plot(plot_token_efficiency, "token_efficiency.png"),
+         deps=['token_efficiency'], params=['output_dir'], figure=True),
+    Node('efficiency_frontier_figure', _plot(plot_efficiency_frontier, "thinking_efficiency_frontier_final_previous.png"),
+         deps=['efficiency'], params=['output_dir'], figure=True),
+    Node('single_trend_figure', _plot(plot_single_trend, "token_efficiency_single_trend.png"),
+         deps=['efficiency'], params=['output_dir'], figure=True),
+    Node('pass_at_k_figure',
+         _plot(plot_pass_at_k, "pass_at_k_ordered_by_pass1.png", lambda t: (t, t.attrs['k'])),
+         deps=['pass_at_k'], params=['output_dir'], figure=True),
+    Node('pass_at_k_curves_figure', _plot(plot_pass_at_k_curves, "pass_at_k_curves.png"),
+         deps=['pass_at_k_curve'], params=['output_dir'], figure=True),
+    Node('rollout_budget_csv', _csv("rollout_budget.csv"),
+         deps=['rollout_budget'], params=['output_dir'], figure=True),
+    Node('distractor_figure',
+         _plot(plot_distractors, "distractor_stress_test.png", lambda t: (t.set_index('model_id'),)),
+         deps=['distractor'], params=['output_dir'], figure=True),
+    Node('rote_vs_reason_figure',
+         _plot(plot_rote_vs_reason, "rote_vs_reason_quadrant.png",
+               lambda t, registry: (registry.join(t, ['family']).rename(columns={'family': 'Type'}).set_index('model_id'),)),
+         deps=['rote_vs_reason', 'registry'], params=['output_dir'], figure=True),
+    Node('snr_figure', _plot(plot_signal_to_noise, "signal_to_noise_audit.png"),
+         deps=['snr'], params=['output_dir'], figure=True),
+    Node('thinking_length_figure', _plot(plot_thinking_length, "thinking_length_correlation.png"),
+         deps=['thinking_rollouts'], params=['output_dir'], figure=True),
+]
+
+
+def _list(value):
+    return [v for v in value.split(',') if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the report figures through the memoized stage DAG.")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--metadata', default=METADATA_FILE)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--token-cap', type=int, default=TOKEN_CAP)
+    parser.add_argument('--target-tasks', type=_list, default=TARGET_TASKS,
+                        help="comma-separated task keywords for the efficiency figures")
+    parser.add_argument('--only', type=_list, help="comma-separated nodes to bring up to date")
+    parser.add_argument('--force', type=_list, default=[], help="comma-separated nodes to recompute")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--graph', action='store_true', help="print the DAG and exit")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(REPORT, workers=args.workers)
+    if args.graph:
+        pipeline.describe()
+    else:
+        pipeline.run(
+            args.only, force=args.force,
+            data_dir=args.data_dir, metadata_file=args.metadata, output_dir=args.output_dir,
+            token_cap=args.token_cap, target_tasks=args.target_tasks,
+        )
@@ -0,0 +1,182 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from schema import scan_info, to_frame
+
+# Set MEDARC_PREVIEW=0.1 to run any script on ~10% of the examples.
+PREVIEW_FRACTION = float(os.environ.get("MEDARC_PREVIEW", 0) or 0)
+# Small strata are kept whole up to this many examples.
+MIN_EXAMPLES = int(os.environ.get("MEDARC_PREVIEW_MIN_EXAMPLES", 30))
+
+Z_95 = 1.96
+
+
+def select_examples(example_ids, fraction, min_examples=MIN_EXAMPLES):
+    """
+    Deterministic sample of example ids: an id is kept when its hash falls
+    below `fraction` of the hash range. The hash depends only on the id, so
+    every model gets the same examples of a dataset and all rollouts of a
+    selected example stay together. Strata smaller than `min_examples` after
+    thinning are topped up with the next-smallest hashes. A fraction of 1 or
+    more keeps every id.
+    """
+    ids = np.unique(np.asarray(example_ids))
+    if fraction >= 1:
+        return ids
+    hashes = pd.util.hash_array(ids)
+    keep = hashes < np.uint64(max(fraction, 0.0) * 2.0 ** 64)
+    if keep.sum() < min(min_examples, len(ids)):
+        keep = np.zeros(len(ids), dtype=bool)
+        keep[np.argsort(hashes)[:min_examples]] = True
+    return ids[keep]
+
+
+def select_ranges(example_ids, row_groups, fraction, min_examples=MIN_EXAMPLES):
+    """
+    Deterministic sample of a file's examples as inclusive id ranges
+    (lo, hi), for a file stored in example order: each row group spans
+    one range and is kept when the hash of its first id falls below
+    `fraction` of the hash range. Filtering on the ranges keeps whole
+    examples, even one that straddles two row groups, and lets a scan skip
+    every row group whose id statistics fall outside them. `row_groups`
+    holds the row counts of the file's row groups. If fewer than
+    `min_examples` ids are covered, row groups are added in hash order
+    until they are. Ids out of order fall back to select_examples(), one
+    range per id.
+    """
+    ids = np.asarray(example_ids)
+    if len(ids) and np.any(ids[1:] < ids[:-1]):
+        ids = select_examples(ids, fraction, min_examples)
+        return ids, ids
+    starts = np.cumsum(np.concatenate([[0], row_groups]))[:-1].astype(np.int64)
+    starts = starts[starts < len(ids)]
+    ends = np.append(starts[1:], len(ids)) - 1
+    lo, hi = ids[starts], ids[ends]
+    if fraction >= 1:
+        return lo[:1], hi[-1:]
+    hashes = pd.util.hash_array(lo)
+    keep = hashes < np.uint64(max(fraction, 0.0) * 2.0 ** 64)
+    unique = np.unique(ids)
+    for block in np.argsort(hashes):
+        if keep[block]:
+            continue
+        if covered(unique, *_merge(lo[keep], hi[keep])) >= min(min_examples, len(unique)):
+            break
+        keep[block] = True
+    return _merge(lo[keep], hi[keep])
+
+
+def covered(unique_ids, lo, hi):
+    """How many of the sorted `unique_ids` fall in the disjoint ranges (lo, hi)."""
+    return int((np.searchsorted(unique_ids, hi, side='right') - np.searchsorted(unique_ids, lo, side='left')).sum())
+
+
+def _merge(lo, hi):
+    """Sorted ranges with overlapping ones joined."""
+    order = np.argsort(lo, kind='stable')
+    merged_lo, merged_hi = [], []
+    for a, b in zip(lo[order], hi[order]):
+        if merged_hi and a <= merged_hi[-1]:
+            merged_hi[-1] = max(merged_hi[-1], b)
+        else:
+            merged_lo.append(a)
+            merged_hi.append(b)
+    return np.array(merged_lo, dtype=lo.dtype), np.array(merged_hi, dtype=hi.dtype)
+
+
+# Sampled id ranges per (dataset, fraction, min_examples) in this process:
+# the first file of a dataset picks them, later files only filter on them.
+_chosen = {}
+
+
+def chosen_ranges(dataset, read_ids, fraction, min_examples=MIN_EXAMPLES):
+    """
+    The preview sample of `dataset`: select_ranges() id ranges and how many
+    examples of the first file they cover. `read_ids()` returns a file's
+    example ids in file order and its row group sizes, and is only called
+    for the first file of the dataset.
+    """
+    key = (dataset, fraction, min_examples)
+    if key not in _chosen:
+        ids, row_groups = read_ids()
+        lo, hi = select_ranges(ids, row_groups, fraction, min_examples)
+        _chosen[key] = lo, hi, covered(np.unique(ids), lo, hi)
+    return _chosen[key]
+
+
+def preview_fraction(data):
+    """The preview fraction a DataFrame or scan_table() result was sampled at (0 for a full scan)."""
+    if isinstance(data, pa.Table):
+        return scan_info(data)['preview'] or 0
+    return (data.attrs.get('preview') or 0) if data is not None else 0
+
+
+def is_preview(data):
+    """True for a DataFrame or scan_table() result that came from a preview scan."""
+    return bool(preview_fraction(data))
+
+
+def sampling_error(df, by, value, cluster=('dataset', 'example_id'), count=None):
+    """
+    Mean of `value` per `by` group with its standard error, treating each
+    `cluster` (an example of a dataset and all its rollouts) as one sampled
+    unit. With cluster=None every row is its own unit. If `count` names a
+    column, each row is already a tally: `value` holds the sum of that many
+    observations (e.g. per-example reward sums and rollout counts). Returns
+    columns [*by, value, f'{value}_se', 'n_units'].
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    cluster = [c for c in (cluster or []) if c not in by]
+    frame = df[by + [value] + cluster + ([count] if count else [])].dropna(subset=[value])
+    if count:
+        frame = frame.rename(columns={value: 'sum', count: 'count'})
+    else:
+        frame = frame.assign(sum=frame[value], count=1)
+
+    if cluster:
+        units = frame.groupby(by + cluster, observed=True)[['sum', 'count']].sum().reset_index()
+    else:
+        units = frame
+
+    totals = units.groupby(by, observed=True)[['sum', 'count']].transform('sum')
+    mean = totals['sum'] / totals['count']
+    # Linearised variance of a ratio estimator over sampled units.
+    units['resid2'] = (units['sum'] - mean * units['count']) ** 2
+
+    g = units.groupby(by, observed=True)
+    out = g[['sum', 'count']].sum()
+    out['n_units'] = g.size()
+    out[value] = out['sum'] / out['count']
+    k = out['n_units']
+    var = g['resid2'].sum() * k / (k - 1).where(k > 1) / out['count'] ** 2
+    out[f'{value}_se'] = np.sqrt(var)
+    return out.reset_index()[by + [value, f'{value}_se', 'n_units']]
+
+
+def print_sampling_error(df, by, values, cluster=('dataset', 'example_id'), label=None, count=None,
+                         preview=None):
+    """
+    Prints mean ± 95% interval for each metric when `df` came from a preview
+    scan. Pass `preview` for a frame derived from a streamed scan, which
+    carries no scan info of its own.
+    """
+    preview = preview_fraction(df) if preview is None else preview
+    if not preview:
+        return
+    if isinstance(df, pa.Table):
+        df = to_frame(df)
+    by = [by] if isinstance(by, str) else list(by)
+    values = [values] if isinstance(values, str) else values
+    print(f"PREVIEW ({preview:.0%} of examples) -- {label or ', '.join(values)} "
+          f"with 95% sampling intervals:")
+
+    report = None
+    for value in values:
+        part = sampling_error(df, by, value, cluster, count)
+        part[value] = [f"{m:.3f} ± {Z_95 * s:.3f}" for m, s in zip(part[value], part[f'{value}_se'].fillna(0))]
+        part = part[by + [value, 'n_units']]
+        report = part if report is None else report.drop(columns='n_units').merge(part, on=by)
+    print(report.to_string(index=False))
@@ -0,0 +1,128 @@
+import json
+import os
+import time
+from collections import defaultdict
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+CACHE_DIR = os.environ.get("MEDARC_CACHE_DIR", ".analysis_cache")
+QUARANTINE_FILE = os.path.join(CACHE_DIR, "quarantine.json")
+
+
+def file_fingerprint(path):
+    """Cheap change detector: size plus modification time."""
+    st = os.stat(path)
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def footer_rows(path):
+    """Row count from the parquet footer, or None if the footer is unreadable."""
+    try:
+        return pq.ParquetFile(path).metadata.num_rows
+    except Exception:
+        return None
+
+
+class Quarantine:
+    """
+    Persistent index of files that failed to load. An entry is honoured only
+    while the file's fingerprint is unchanged, so a re-downloaded file gets
+    read again on the next run.
+
+    A file whose footer cannot be read is quarantined whole (`columns` is
+    None). A file that opens but fails to decode is quarantined only for the
+    columns that were projected: a scan that does not ask for all of them
+    still reads it.
+    """
+
+    def __init__(self, path=QUARANTINE_FILE):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def _covers(entry, columns):
+        return entry.get('columns') is None or set(entry['columns']) <= set(columns)
+
+    def lookup(self, path, fingerprint, columns):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None or entry['fingerprint'] != fingerprint or not self._covers(entry, columns):
+            return None
+        return entry
+
+    def add(self, path, fingerprint, error, rows=None, columns=None):
+        entry = {
+            'fingerprint': fingerprint,
+            'error_class': type(error).__name__,
+            'message': str(error)[:500],
+            'rows': rows,
+            'columns': None if columns is None else sorted(columns),
+            'quarantined_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.entries[os.path.abspath(path)] = entry
+        self.dirty = True
+        return entry
+
+    def release(self, path, fingerprint, columns):
+        """Drops the entry once the file changed or a scan of its failing columns succeeded."""
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if entry is not None and (entry['fingerprint'] != fingerprint or self._covers(entry, columns)):
+            del self.entries[key]
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class SkipReport:
+    """Tallies files and rows left out of one scan, per model and dataset."""
+
+    def __init__(self):
+        self.cells = defaultdict(lambda: {'files': 0, 'rows': 0, 'unknown_rows': 0, 'reasons': set()})
+
+    def add(self, model_id, dataset, reason, rows=None):
+        cell = self.cells[(model_id, dataset)]
+        cell['files'] += 1
+        cell['reasons'].add(reason)
+        if rows is None:
+            cell['unknown_rows'] += 1
+        else:
+            cell['rows'] += rows
+
+    def __bool__(self):
+        return bool(self.cells)
+
+    def to_frame(self):
+        records = [
+            {'model_id': m, 'dataset': d, 'files': c['files'], 'rows': c['rows'],
+             'files_unknown_rows': c['unknown_rows'], 'reasons': ', '.join(sorted(c['reasons']))}
+            for (m, d), c in sorted(self.cells.items())
+        ]
+        return pd.DataFrame(records, columns=['model_id', 'dataset', 'files', 'rows',
+                                              'files_unknown_rows', 'reasons'])
+
+    def print_summary(self):
+        if not self:
+            return
+        table = self.to_frame()
+        unknown = int(table['files_unknown_rows'].sum())
+        print(f"WARNING: skipped {int(table['files'].sum())} files "
+              f"({int(table['rows'].sum())} rows"
+              + (f", plus {unknown} files with unreadable footers" if unknown else "")
+              + "):")
+        print(table.to_string(index=False))
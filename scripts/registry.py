@@ -0,0 +1,146 @@
+"""
+What model_metadata.json says about each model, validated and classified once.
+
+    registry = load_registry()
+    registry.classify('qwq-32b')    # {'family': 'Thinking', 'size': 'Medium', 'params': 32.0, ...}
+    table = scan_table(DATA_DIR, ['reward'], classes=['family', 'size'])
+
+Every analysis takes its model families from here rather than from its own
+keyword list. The metadata is checked when it is loaded, so a misspelt
+size bucket or a non-boolean `reasoning` fails loudly instead of quietly
+becoming a new family. Scans attach the classes with a dictionary join on
+the model_id column: one lookup per model, and the result arrives in
+pandas as categorical columns. Models missing from the metadata are
+classified by FALLBACK_THINK_KEYWORDS in their id, with a note.
+"""
+import functools
+import json
+import numbers
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+# Resolved from this file, so scripts find it whatever directory they run from.
+METADATA_FILE = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'model_metadata.json'))
+
+FAMILIES = ['Standard', 'Thinking']
+SIZE_BUCKETS = ['Tiny', 'Small', 'Medium', 'Large', 'API', 'Unknown']
+CLASS_COLUMNS = ['family', 'size', 'params', 'display_name']
+CATEGORIES = {'family': FAMILIES, 'size': SIZE_BUCKETS}
+
+# Only consulted for models model_metadata.json does not list: the union of
+# the keyword lists the scripts used to carry.
+FALLBACK_THINK_KEYWORDS = ['think', 'reason', 'qwq', 'intellect', 'gpt-oss', 'sonnet-4_5', 'gpt_5_1']
+
+
+def load_metadata(path=METADATA_FILE):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model metadata file {path} not found; pass the right path with --metadata "
+                                f"or metadata_file=")
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def validate_metadata(metadata, source=METADATA_FILE):
+    """Raises ValueError listing every model whose entry has a missing or malformed field."""
+    problems = []
+    for model_id, info in metadata.items():
+        if not isinstance(info, dict):
+            problems.append(f"{model_id}: expected an object, got {type(info).__name__}")
+            continue
+        if not isinstance(info.get('reasoning'), bool):
+            problems.append(f"{model_id}: 'reasoning' must be true or false, got {info.get('reasoning')!r}")
+        for key in ('size_without_quant', 'size_with_quant'):
+            if key in info and info[key] not in SIZE_BUCKETS[:-1]:
+                problems.append(f"{model_id}: '{key}' must be one of {SIZE_BUCKETS[:-1]}, got {info[key]!r}")
+        params = info.get('params')
+        if params is not None and (isinstance(params, bool) or not isinstance(params, numbers.Real) or params <= 0):
+            problems.append(f"{model_id}: 'params' must be a positive number of billions or null, got {params!r}")
+        if 'name' in info and not (isinstance(info['name'], str) and info['name'].strip()):
+            problems.append(f"{model_id}: 'name' must be a non-empty string")
+    if problems:
+        raise ValueError(f"{source} has invalid model metadata:\n  " + "\n  ".join(problems))
+
+
+class ModelRegistry:
+    """Validated metadata plus a per-model classification computed on first use."""
+
+    def __init__(self, metadata, source=METADATA_FILE):
+        validate_metadata(metadata, source)
+        self.metadata = metadata
+        self.source = source
+        self.classes = {}
+
+    def __contains__(self, model_id):
+        return model_id in self.metadata
+
+    @property
+    def model_ids(self):
+        return list(self.metadata)
+
+    def classify(self, model_id):
+        """{family, size, params, display_name} for one model."""
+        if model_id not in self.classes:
+            info = self.metadata.get(model_id)
+            if info is None:
+                reasoning = any(k in model_id.lower() for k in FALLBACK_THINK_KEYWORDS)
+                print(f"NOTE: {model_id} is not in {self.source}; classified as "
+                      f"{'Thinking' if reasoning else 'Standard'} from its id.")
+                info = {}
+            else:
+                reasoning = info['reasoning']
+            self.classes[model_id] = {
+                'family': 'Thinking' if reasoning else 'Standard',
+                'size': info.get('size_without_quant', 'Unknown'),
+                'params': None if info.get('params') is None else float(info['params']),
+                'display_name': info.get('name') or model_id,
+            }
+        return self.classes[model_id]
+
+    def frame(self, model_ids=None):
+        """One row per model (default: every model in the metadata), indexed by model_id."""
+        model_ids = self.model_ids if model_ids is None else list(model_ids)
+        out = pd.DataFrame([self.classify(m) for m in model_ids], index=pd.Index(model_ids, name='model_id'),
+                           columns=CLASS_COLUMNS)
+        for column, categories in CATEGORIES.items():
+            out[column] = pd.Categorical(out[column], categories=categories)
+        out['params'] = out['params'].astype(float)
+        return out
+
+    def join(self, frame, columns=CLASS_COLUMNS):
+        """`frame` with the class `columns` of its model_id column added."""
+        return frame.join(self.frame(frame['model_id'].unique())[list(columns)], on='model_id')
+
+    def _class_array(self, model_ids, column):
+        if not pa.types.is_dictionary(model_ids.type):
+            model_ids = model_ids.dictionary_encode()
+        values = [self.classify(m)[column] for m in model_ids.dictionary.to_pylist()]
+        if column in CATEGORIES:
+            codes = pa.array([CATEGORIES[column].index(v) for v in values], pa.int32())
+            return pa.DictionaryArray.from_arrays(codes.take(model_ids.indices), pa.array(CATEGORIES[column]))
+        if column == 'display_name':
+            return pa.DictionaryArray.from_arrays(model_ids.indices, pa.array(values, pa.string()))
+        return pa.array(values, pa.float64()).take(model_ids.indices)
+
+    def attach(self, table, columns=CLASS_COLUMNS):
+        """
+        Appends the class `columns` to an Arrow table with a model_id column.
+        The classes are looked up once per distinct model and spread over
+        the rows through the model_id dictionary indices.
+        """
+        for column in columns:
+            chunks = [self._class_array(chunk, column) for chunk in table['model_id'].chunks]
+            kind = pa.float64() if column == 'params' else pa.dictionary(pa.int32(), pa.string())
+            table = table.append_column(column, pa.chunked_array(chunks, type=kind))
+        return table
+
+
+@functools.lru_cache(maxsize=None)
+def _registry(path, mtime_ns):
+    return ModelRegistry(load_metadata(path), path)
+
+
+def load_registry(path=METADATA_FILE):
+    """Cached per file; an edited metadata file is re-read and re-validated."""
+    return _registry(path, os.stat(path).st_mtime_ns if os.path.exists(path) else None)
@@ -1,31 +1,14 @@
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
+
+from cube import load_cube
+from preview import PREVIEW_FRACTION, Z_95
+from registry import load_registry
+from tables import AVERAGE, TASK_GROUPS
 
 DATA_DIR = "../inference-scratch"
 OUTPUT_FILE = "rote_vs_reason_quadrant.png"
 
-KNOWLEDGE_TASKS = [
-    'medqa', 
-    'medbullets-op5', 
-    'medbullets-op4', 
-    'pubmedqa', 
-    'med_mcqa',             
-    'mmlu_pro_health',      
-    'metamedqa',            
-    'medconceptsqa'         
-]
-
-REASONING_TASKS = [
-    'medxpertqa-reasoning', 
-    'medxpertqa-understanding', 
-    'm_arc', 
-    'longhealth',               
-    'medcalc_bench'             
-]
-
 PROMINENT_STANDARD_TAGS = [
     'llama-3-70b',
     'gemma-3-27b',
@@ -38,58 +21,33 @@ PROMINENT_STANDARD_TAGS = [
 def analyze_rote_vs_reason():
     print("Loading data for Rote vs. Reason Analysis...")
     
-    all_files = glob.glob(f"{DATA_DIR}/**/*.parquet", recursive=True)
+    cube = load_cube(DATA_DIR)
     
-    if not all_files:
+    if cube is None:
         print(f"No files found in {DATA_DIR}")
         return
 
-    knowledge_dfs = []
-    reasoning_dfs = []
-    
-    print(f"Found {len(all_files)} files. Sorting into Knowledge vs. Reasoning...")
-
-    for f in all_files:
-        if os.path.getsize(f) == 0:
-            continue
-            
-        filename = os.path.basename(f)
-        model_id = os.path.basename(os.path.dirname(f))
-        
-        try:
-            is_knowledge = any(k in filename for k in KNOWLEDGE_TASKS)
-            is_reasoning = any(r in filename for r in REASONING_TASKS)
-            
-            if is_knowledge or is_reasoning:
-                df = pd.read_parquet(f)
-                df['model_id'] = model_id
-                
-                # Keep only necessary columns
-                df = df[['model_id', 'reward']].copy()
-                
-                if is_knowledge:
-                    knowledge_dfs.append(df)
-                elif is_reasoning:
-                    reasoning_dfs.append(df)
-        
-        except Exception as e:
-            print(f"Skipping {filename}: {e}")
+    print("Aggregating scores...")
+    scores = cube.composite(TASK_GROUPS, average=AVERAGE, with_se=True)
 
-    if not knowledge_dfs or not reasoning_dfs:
+    if scores[list(TASK_GROUPS)].isna().all().any():
         print("Missing dataset files.")
         return
 
-    print("Aggregating scores...")
-    df_k = pd.concat(knowledge_dfs).groupby('model_id')['reward'].mean().rename("Knowledge Score")
-    df_r = pd.concat(reasoning_dfs).groupby('model_id')['reward'].mean().rename("Reasoning Score")
+    if PREVIEW_FRACTION:
+        print(f"PREVIEW ({PREVIEW_FRACTION:.0%} of examples) -- task-group scores with 95% sampling intervals:")
+        for group in TASK_GROUPS:
+            scores[f'{group} (95%)'] = Z_95 * scores[f'{group}_se']
+        print(scores[[c for c in scores.columns if not c.endswith('_se')]].round(3).to_string())
     
-    df = pd.concat([df_k, df_r], axis=1).dropna()
+    df = scores[list(TASK_GROUPS)].dropna()
+    df['Type'] = load_registry().frame(df.index)['family']
     print(f"Successfully analyzed {len(df)} models with complete data.")
-    
-    # Keyword detection for Thinking models
-    think_keywords = ['think', 'reason', 'qwq', 'intellect']
-    df['Type'] = df.index.map(lambda x: 'Thinking' if any(k in x.lower() for k in think_keywords) else 'Standard')
 
+    plot_rote_vs_reason(df)
+
+def plot_rote_vs_reason(df, output_file=OUTPUT_FILE):
+    # df['Type'] is the registry family of each model (index).
     print("\n--- Classification Audit ---")
     thinkers = df[df['Type'] == 'Thinking'].index.tolist()
     print(f"Classified {len(thinkers)} models as 'Thinking'.")
@@ -163,8 +121,8 @@ def analyze_rote_vs_reason():
     plt.legend(title="Model Class", loc='lower right')
     
     plt.tight_layout()
-    plt.savefig(OUTPUT_FILE, dpi=300)
-    print(f"Generated chart: {OUTPUT_FILE}")
+    plt.savefig(output_file, dpi=300)
+    print(f"Generated chart: {output_file}")
 
 if __name__ == "__main__":
     analyze_rote_vs_reason()
\ No newline at end of file
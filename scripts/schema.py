@@ -0,0 +1,106 @@
+import functools
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+# Every column an analysis can ask for, with the dtype it always comes back as.
+# `model_id` and `dataset` are attached by the loader from the file path
+# (dictionary-encoded in Arrow, plain strings once converted to pandas).
+CANONICAL_SCHEMA = pa.schema([
+    ('model_id', pa.string()),
+    ('dataset', pa.string()),
+    ('example_id', pa.int64()),
+    ('reward', pa.float64()),
+    ('model_token_completion', pa.int64()),
+])
+
+# Schema metadata key under which loader.scan_table() records what it skipped
+# and the preview fraction.
+SCAN_INFO_KEY = b'medarc_scan'
+
+# Known spellings of each column in inference-scratch, most preferred first.
+# When a file carries several, the first non-null value wins.
+COLUMN_VARIANTS = {
+    'example_id': ['example_id'],
+    'reward': ['reward'],
+    'model_token_completion': ['model_token_completion', 'generation_token_count'],
+}
+
+
+class Normalizer:
+    """
+    Per-file mapping from the physical parquet schema to CANONICAL_SCHEMA,
+    expressed as Arrow expressions so the scanner does the renaming,
+    coalescing and casting while it decodes.
+    """
+
+    def __init__(self, physical_schema):
+        self.sources = {}
+        for col, variants in COLUMN_VARIANTS.items():
+            self.sources[col] = [v for v in variants if v in physical_schema.names]
+        self.physical_schema = physical_schema
+
+    def has(self, col):
+        return bool(self.sources.get(col))
+
+    def raw(self, col):
+        """Expression over the physical columns, without the dtype cast."""
+        sources = self.sources[col]
+        if not sources:
+            return ds.scalar(None).cast(CANONICAL_SCHEMA.field(col).type)
+        if len(sources) == 1:
+            return ds.field(sources[0])
+        return pc.coalesce(*[ds.field(s) for s in sources])
+
+    def expr(self, col):
+        target = CANONICAL_SCHEMA.field(col).type
+        sources = self.sources[col]
+        if not sources:
+            return self.raw(col)
+        if len(sources) == 1 and self.physical_schema.field(sources[0]).type == target:
+            return ds.field(sources[0])
+        return self.raw(col).cast(target)
+
+    def projection(self, columns):
+        return {col: self.expr(col) for col in columns}
+
+
+@functools.lru_cache(maxsize=None)
+def _normalizer(path, size, mtime_ns):
+    return Normalizer(ds.dataset(path, format="parquet").schema)
+
+
+def normalizer_for(path):
+    """Cached per file; a rewritten file gets a fresh mapping."""
+    st = os.stat(path)
+    return _normalizer(path, st.st_size, st.st_mtime_ns)
+
+
+def scan_info(table):
+    """The {'skipped', 'preview'} record scan_table() attached to `table`."""
+    metadata = table.schema.metadata or {}
+    if SCAN_INFO_KEY not in metadata:
+        return {'skipped': [], 'preview': 0}
+    return json.loads(metadata[SCAN_INFO_KEY])
+
+
+def decode_keys(table, columns=None):
+    """Casts the dictionary-encoded columns of a scan (or just `columns`) back to plain strings."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) and (columns is None or field.name in columns):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+
+def to_frame(table):
+    """
+    Converts a scan_table() result to pandas, carrying its scan_info() over
+    to `attrs`. model_id and dataset become strings; registry class columns
+    stay categorical.
+    """
+    df = decode_keys(table, ['model_id', 'dataset']).to_pandas()
+    df.attrs.update(scan_info(table))
+    return df
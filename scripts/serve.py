@@ -0,0 +1,254 @@
+"""
+Local query service over the per-(model, dataset) aggregate tables.
+
+    python serve.py --data-dir ../inference-scratch --port 8050
+
+    GET /scores?by=model&group=reasoning&reasoning=true
+    GET /scores?model=qwq-32b&dataset=medqa,pubmedqa
+    GET /scores?by=dataset&size_without_quant=Small,Medium
+    GET /scores?by=model&family=Thinking
+    GET /figure/pass_at_k.png?group=knowledge
+    GET /figure/efficiency.png?group=efficiency
+    GET /figure/noise.png
+    GET /status
+
+Aggregates come from the persisted score cube (cube.py), which is rebuilt
+only when a parquet file is added, removed or rewritten. Query results are
+kept in an LRU cache.
+"""
+import argparse
+import functools
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+from aggregates import rollup
+from cube import group_members, load_cube
+from loader import METADATA_FILE, corpus_signature
+from registry import load_registry
+from tables import KNOWLEDGE_TASKS, REASONING_TASKS, TARGET_TASKS
+
+DATA_DIR = "../inference-scratch"
+PORT = 8050
+POLL_SECONDS = 10
+QUERY_CACHE_SIZE = 512
+
+TASK_GROUPS = {
+    'knowledge': KNOWLEDGE_TASKS,
+    # A dataset matching both lists counts as knowledge, as in rote_vs_reason.py.
+    'reasoning': {'include': REASONING_TASKS, 'exclude': KNOWLEDGE_TASKS},
+    'efficiency': TARGET_TASKS,
+}
+
+METRICS = ['accuracy', 'accuracy_se', 'mean_tokens', 'capped_accuracy', 'capped_tokens',
+           'pass_1', 'pass_k', 'noise_score', 'n_rollouts', 'n_examples']
+LEVELS = {'cell': ['model_id', 'dataset'], 'model': ['model_id'], 'dataset': ['dataset']}
+
+
+def _coerce(key, values, series):
+    # Models missing from the metadata leave NaNs, so go by the non-null values.
+    kind = pd.api.types.infer_dtype(series, skipna=True)
+    if kind == 'boolean':
+        return [v.lower() in ('1', 'true', 'yes') for v in values]
+    if kind in ('integer', 'floating', 'mixed-integer-float'):
+        try:
+            return [float(v) for v in values]
+        except ValueError:
+            raise ValueError(f"{key} takes numbers, got {','.join(values)}") from None
+    return values
+
+
+class AnalysisStore:
+    def __init__(self, data_dir, metadata_file=METADATA_FILE):
+        self.data_dir = data_dir
+        self.metadata_file = metadata_file
+        self.lock = threading.Lock()
+        self.version = 0
+        self.cells = None
+        self.k = None
+        self.signature = None
+        self.loaded_at = None
+        self.query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._query)
+        self.figure = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._figure)
+        self.reload()
+
+    def reload(self):
+        signature = corpus_signature(self.data_dir)
+        print(f"Loading aggregates for {len(signature)} files...")
+        cube = load_cube(self.data_dir)
+        if cube is None:
+            cells, k = pd.DataFrame(columns=LEVELS['cell'] + METRICS), None
+        else:
+            cells, k = cube.table(), cube.k
+
+        registry = load_registry(self.metadata_file)
+        if registry.model_ids:
+            meta = pd.DataFrame.from_dict(registry.metadata, orient='index')
+            meta.index.name = 'model_id'
+            cells = cells.merge(meta.reset_index(), on='model_id', how='left')
+        cells = registry.join(cells, ['family', 'size'])
+
+        with self.lock:
+            self.cells = cells
+            self.k = k
+            self.signature = signature
+            self.version += 1
+            self.loaded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+            self.query.cache_clear()
+            self.figure.cache_clear()
+        print(f"Aggregates ready: {len(cells)} model/dataset cells (version {self.version}).")
+
+    def watch(self, interval=POLL_SECONDS):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    if corpus_signature(self.data_dir) != self.signature:
+                        print("Corpus changed, reloading...")
+                        self.reload()
+                except Exception as e:
+                    print(f"Reload failed: {e}")
+        threading.Thread(target=loop, daemon=True).start()
+
+    def _filtered(self, filters):
+        cells = self.cells
+        for key, values in filters:
+            if key == 'group':
+                datasets = cells['dataset'].to_numpy()
+                mask = np.zeros(len(cells), dtype=bool)
+                for group in values:
+                    mask |= group_members(datasets, TASK_GROUPS[group])
+            elif key == 'dataset':
+                mask = cells['dataset'].map(lambda d: any(t in d for t in values))
+            elif key == 'model':
+                mask = cells['model_id'].isin(values)
+            elif key in cells.columns:
+                mask = cells[key].isin(_coerce(key, values, cells[key]))
+            else:
+                raise KeyError(key)
+            cells = cells[mask]
+        return cells
+
+    def _query(self, version, by, filters):
+        cells = self._filtered(filters)
+        if by != 'cell':
+            cells = rollup(cells, LEVELS[by])
+        return cells[LEVELS[by] + METRICS].sort_values(LEVELS[by]).reset_index(drop=True)
+
+    def _figure(self, version, kind, by, filters):
+        result = self.query(version, by, filters)
+        buf = io.BytesIO()
+        # pyplot keeps global state, so renders are serialised.
+        with self.lock:
+            sns.set_theme(style="whitegrid")
+            fig, ax = plt.subplots(figsize=(12, 7))
+            label = LEVELS[by][-1]
+            if kind == 'pass_at_k':
+                ranked = result.sort_values('pass_1', ascending=False)
+                sns.barplot(data=ranked, x=label, y='pass_k', color='#d62728', alpha=0.6,
+                            label=f"Pass@{self.k}", ax=ax)
+                sns.barplot(data=ranked, x=label, y='pass_1', color='#1f77b4', alpha=0.9,
+                            label='Pass@1', ax=ax)
+                ax.tick_params(axis='x', rotation=45)
+                ax.legend()
+            elif kind == 'efficiency':
+                sns.scatterplot(data=result, x='mean_tokens', y='accuracy', s=100, ax=ax)
+                for _, row in result.iterrows():
+                    ax.text(row['mean_tokens'], row['accuracy'], row[label], fontsize=8)
+            elif kind == 'noise':
+                sns.scatterplot(data=result, x='accuracy', y='noise_score', s=100, color='#d62728', ax=ax)
+                for _, row in result.iterrows():
+                    ax.text(row['accuracy'] + 0.01, row['noise_score'], row[label], fontsize=8)
+            else:
+                plt.close(fig)
+                raise KeyError(kind)
+            fig.tight_layout()
+            fig.savefig(buf, format='png')
+            plt.close(fig)
+        return buf.getvalue()
+
+
+def _parse(query_string):
+    params = parse_qs(query_string)
+    by = params.pop('by', ['cell'])[0]
+    if by not in LEVELS:
+        raise KeyError(by)
+    filters = tuple(sorted(
+        (key, tuple(sorted(v for value in values for v in value.split(','))))
+        for key, values in params.items()
+    ))
+    return by, filters
+
+
+def make_handler(store):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, content_type='application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status, payload):
+            self._send(status, json.dumps(payload, default=str).encode())
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            try:
+                if url.path == '/status':
+                    info = store.query.cache_info()
+                    self._json(200, {
+                        'version': store.version, 'loaded_at': store.loaded_at,
+                        'files': len(store.signature), 'cells': len(store.cells),
+                        'cache_hits': info.hits, 'cache_misses': info.misses,
+                    })
+                    return
+
+                by, filters = _parse(url.query)
+                if url.path == '/scores':
+                    result = store.query(store.version, by, filters)
+                    rows = result.astype(object).where(result.notna(), None).to_dict('records')
+                    self._json(200, {'k': store.k, 'rows': rows})
+                elif url.path.startswith('/figure/') and url.path.endswith('.png'):
+                    kind = url.path[len('/figure/'):-len('.png')]
+                    if by == 'cell':
+                        by = 'dataset' if kind == 'noise' else 'model'
+                    self._send(200, store.figure(store.version, kind, by, filters), 'image/png')
+                else:
+                    self._json(404, {'error': f"unknown endpoint {url.path}"})
+            except KeyError as e:
+                self._json(400, {'error': f"unknown parameter or value: {e}"})
+            except ValueError as e:
+                self._json(400, {'error': str(e)})
+
+    return Handler
+
+
+def serve(data_dir=DATA_DIR, port=PORT, metadata_file=METADATA_FILE, poll=POLL_SECONDS):
+    store = AnalysisStore(data_dir, metadata_file)
+    if poll > 0:
+        store.watch(poll)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(store))
+    print(f"Serving on http://127.0.0.1:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve aggregate lookups and figures over HTTP.")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--metadata', default=METADATA_FILE)
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS,
+                        help="seconds between corpus change checks (0 disables hot reload)")
+    args = parser.parse_args()
+    serve(args.data_dir, args.port, args.metadata, args.poll)
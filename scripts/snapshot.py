@@ -0,0 +1,357 @@
+"""
+Compare two corpus snapshots, reading only the files that differ.
+
+    python snapshot.py manifest ../inference-scratch --out scratch-2025-06.json
+    python snapshot.py diff scratch-2025-06.json ../inference-scratch
+    python snapshot.py diff /mnt/scratch-old /mnt/scratch-new --k 5 --out deltas.csv
+
+Each side of a diff is either a corpus directory (or a sync.py snapshot,
+which reads like one) or a manifest written by `manifest`. Files are
+matched by their path under the corpus root. Files of different sizes
+differ; files of the same size are compared by a sha256 of their content.
+The sha256 is taken without reading the file where one is known: the blob
+name of a sync.py snapshot, the mirror's sync index or the local digest
+cache, while the file's size and mtime match. Only the remaining
+same-size files are hashed, and only added, removed and changed files are
+scanned. A manifest carries digests and per-file tallies, so its side
+costs no reads at all. The bytes reported as scanned include the hashing.
+
+For every affected model x dataset cell, the report gives accuracy,
+Pass@k, mean completion tokens and noise score on both sides, with the
+delta and a two-sided z-test p-value. The per-model rows pool the
+model's changed cells. Deltas with p below alpha / (number of tests)
+are marked significant (Bonferroni).
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from aggregates import CELL_KEYS, accuracy_se, example_stats, example_std, grouped_sums, pass_at_k_valid
+from loader import corpus_files, scan_table
+from sync import cached_digests, content_digests, index_digests, is_manifest
+
+MANIFEST_FORMAT = "medarc-manifest"
+MANIFEST_VERSION = 3
+K = 5
+ALPHA = 0.05
+
+# Per-file sums every diff metric and its standard error is computed from.
+TALLY_COLUMNS = [
+    'n_rollouts', 'sum_reward', 'n_examples', 'ex_sum_sq', 'ex_sum_n', 'ex_n_sq',
+    'n_pass_k', 'sum_pass_k', 'sumsq_pass_k', 'n_tokens', 'sum_tokens', 'sumsq_tokens',
+    'noise_n', 'noise_sum', 'noise_sumsq',
+]
+METRICS = ['accuracy', 'pass_k', 'mean_tokens', 'noise_score']
+
+
+def list_files(data_dir):
+    """
+    {relative path: {model_id, dataset, size, digest}} for every parquet file
+    under `data_dir`, without reading any of them. The digest is None where
+    no blob name, mirror index or digest-cache entry gives it; see
+    Snapshot.resolve().
+    """
+    located = corpus_files(data_dir)
+    if is_manifest(data_dir):
+        # Blobs are named by their sha256.
+        known = {rel: os.path.basename(f) for f, rel in located}
+    else:
+        known = index_digests(data_dir)
+        cached = cached_digests([f for f, rel in located if rel not in known])
+        known.update({rel: cached[f] for f, rel in located if f in cached})
+    files = {}
+    for f, rel in located:
+        model_id, dataset = os.path.basename(os.path.dirname(rel)), os.path.basename(rel)[:-len('.parquet')]
+        files[rel] = {'model_id': model_id, 'dataset': dataset,
+                      'size': os.path.getsize(f), 'digest': known.get(rel)}
+    return files
+
+
+def file_tallies(data_dir, files, k=K):
+    """
+    TALLY_COLUMNS for each of `files` (relative paths), scanning only those
+    files. Files that cannot be read are left out.
+    """
+    if not files:
+        return {}
+    located = {rel: f for f, rel in corpus_files(data_dir)}
+    table = scan_table(data_dir, columns=['example_id', 'reward'], optional=['model_token_completion'],
+                       paths=[located[rel] for rel in files], preview=0)
+    if table is None:
+        return {}
+
+    stats = example_stats(table)
+    # NaN for examples below k rollouts and cells whose budget is below k.
+    pass_k = pass_at_k_valid(stats, k)
+    noise = example_std(stats)
+    ex = stats.assign(
+        pass_k=pass_k, pass_k_sq=pass_k ** 2, noise=noise, noise_sq=noise ** 2,
+        ex_sum_sq=stats['sum_reward'] ** 2, ex_sum_n=stats['sum_reward'] * stats['n'], ex_n_sq=stats['n'] ** 2,
+    )
+    cells = ex.groupby(CELL_KEYS, observed=True).agg(
+        n_rollouts=('n', 'sum'),
+        sum_reward=('sum_reward', 'sum'),
+        n_examples=('n', 'size'),
+        ex_sum_sq=('ex_sum_sq', 'sum'),
+        ex_sum_n=('ex_sum_n', 'sum'),
+        ex_n_sq=('ex_n_sq', 'sum'),
+        n_pass_k=('pass_k', 'count'),
+        sum_pass_k=('pass_k', 'sum'),
+        sumsq_pass_k=('pass_k_sq', 'sum'),
+        n_tokens=('n_tokens', 'sum'),
+        sum_tokens=('sum_tokens', 'sum'),
+        noise_n=('noise', 'count'),
+        noise_sum=('noise', 'sum'),
+        noise_sumsq=('noise_sq', 'sum'),
+    ).reset_index()
+
+    def squares(chunk):
+        tokens = pc.cast(chunk['model_token_completion'], pa.float64())
+        return {'sumsq_tokens': pc.multiply(tokens, tokens)}
+    cells = cells.merge(grouped_sums(table, CELL_KEYS, squares), on=CELL_KEYS)
+
+    by_cell = {(r['model_id'], r['dataset']): r for r in cells.to_dict('records')}
+    out = {}
+    for rel in files:
+        model_id, dataset = os.path.basename(os.path.dirname(rel)), os.path.basename(rel)[:-len('.parquet')]
+        if (model_id, dataset) in by_cell:
+            row = by_cell[(model_id, dataset)]
+            out[rel] = {c: float(row[c]) for c in TALLY_COLUMNS}
+    return out
+
+
+class Snapshot:
+    """One side of a diff: a corpus directory, or a manifest that stands in for one."""
+
+    def __init__(self, source, k=K):
+        self.source = source
+        self.k = k
+        self.bytes_read = 0
+        self.paths = {}
+        if os.path.isdir(source) or is_manifest(source):
+            self.data_dir = source
+            self.paths = {rel: f for f, rel in corpus_files(source)}
+            self.files = list_files(source)
+        else:
+            with open(source) as f:
+                manifest = json.load(f)
+            if manifest.get('format') != MANIFEST_FORMAT or manifest.get('version') != MANIFEST_VERSION:
+                raise ValueError(f"{source} is not a version {MANIFEST_VERSION} {MANIFEST_FORMAT}")
+            if manifest['k'] != k:
+                raise ValueError(f"{source} holds Pass@{manifest['k']} tallies; rerun with --k {manifest['k']}")
+            self.data_dir = None
+            self.files = manifest['files']
+
+    def resolve(self, rels):
+        """Fills in the digests list_files() left out for `rels`, hashing those files."""
+        todo = [rel for rel in rels if self.files[rel]['digest'] is None]
+        digests = content_digests([self.paths[rel] for rel in todo])
+        for rel in todo:
+            self.files[rel]['digest'] = digests[self.paths[rel]]
+            self.bytes_read += self.files[rel]['size']
+
+    def tallies(self, rels):
+        """Tallies for `rels`, from the manifest or by scanning just those files."""
+        if self.data_dir is None:
+            return {rel: self.files[rel]['tallies'] for rel in rels if self.files[rel].get('tallies')}
+        self.bytes_read += sum(self.files[rel]['size'] for rel in rels)
+        return file_tallies(self.data_dir, rels, self.k)
+
+
+def write_manifest(data_dir, out, k=K):
+    snapshot = Snapshot(data_dir, k)
+    snapshot.resolve(list(snapshot.files))
+    files = snapshot.files
+    tallies = file_tallies(data_dir, list(files), k)
+    for rel, entry in files.items():
+        entry['tallies'] = tallies.get(rel)
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'version': MANIFEST_VERSION,
+        'k': k,
+        'data_dir': os.path.abspath(data_dir),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'files': files,
+    }
+    with open(f"{out}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f"{out}.tmp", out)
+    print(f"Wrote manifest {out}: {len(files)} files, {sum(t is not None for t in tallies.values())} with tallies.")
+
+
+def _differs(a, b):
+    if a['size'] != b['size']:
+        return True
+    if a['digest'] is None or b['digest'] is None:
+        raise ValueError("same-size files need their digests; see Snapshot.resolve()")
+    return a['digest'] != b['digest']
+
+
+def compare_files(old, new):
+    """
+    Relative paths split into added, removed, changed and unchanged. Paths
+    on both sides with the same size need a digest on both.
+    """
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    common = sorted(set(old) & set(new))
+    changed = [rel for rel in common if _differs(old[rel], new[rel])]
+    unchanged = [rel for rel in common if not _differs(old[rel], new[rel])]
+    return {'added': added, 'removed': removed, 'changed': changed, 'unchanged': unchanged}
+
+
+def _mean_se(total, total_sq, n):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / n
+        var = (total_sq - total ** 2 / n) / (n - 1)
+        return mean, np.sqrt(np.clip(var, 0, None) / n)
+
+
+def metric_frame(tallies):
+    """Each metric and its standard error from a frame of TALLY_COLUMNS."""
+    out = pd.DataFrame(index=tallies.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['accuracy'] = tallies['sum_reward'] / tallies['n_rollouts']
+    out['accuracy_se'] = accuracy_se(tallies)
+    out['pass_k'], out['pass_k_se'] = _mean_se(tallies['sum_pass_k'], tallies['sumsq_pass_k'],
+                                             tallies['n_pass_k'].where(tallies['n_pass_k'] > 0))
+    out['mean_tokens'], out['mean_tokens_se'] = _mean_se(
+        tallies['sum_tokens'], tallies['sumsq_tokens'], tallies['n_tokens'].where(tallies['n_tokens'] > 0))
+    out['noise_score'], out['noise_score_se'] = _mean_se(
+        tallies['noise_sum'], tallies['noise_sumsq'], tallies['noise_n'].where(tallies['noise_n'] > 0))
+    return out
+
+
+def _tally_frame(tallies, files, rels):
+    rows = [{'model_id': files[rel]['model_id'], 'dataset': files[rel]['dataset'], **tallies[rel]}
+            for rel in rels if rel in tallies]
+    return pd.DataFrame(rows, columns=CELL_KEYS + TALLY_COLUMNS)
+
+
+def _compare(old, new, keys):
+    """Joins old/new metric frames on `keys` and adds deltas and z-test p-values."""
+    old_m = pd.concat([old[keys], metric_frame(old)], axis=1)
+    new_m = pd.concat([new[keys], metric_frame(new)], axis=1)
+    merged = old_m.merge(new_m, on=keys, how='outer', suffixes=('_old', '_new'))
+    for m in METRICS:
+        delta = merged[f'{m}_new'] - merged[f'{m}_old']
+        se = np.sqrt(merged[f'{m}_se_old'] ** 2 + merged[f'{m}_se_new'] ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (delta / se).abs()
+        merged[f'{m}_delta'] = delta
+        merged[f'{m}_p'] = [math.erfc(v / math.sqrt(2)) if np.isfinite(v) else np.nan for v in z]
+    return merged
+
+
+def diff_snapshots(old_source, new_source, k=K, alpha=ALPHA):
+    """
+    Returns (per-cell deltas, per-model deltas, file summary). Cells keep
+    a `status` of changed / added / removed. A `<metric>_significant`
+    column marks p-values below alpha over the number of tests.
+    """
+    old, new = Snapshot(old_source, k), Snapshot(new_source, k)
+    # A size difference settles a path unread; same-size paths need both digests.
+    same_size = [rel for rel in set(old.files) & set(new.files) if old.files[rel]['size'] == new.files[rel]['size']]
+    old.resolve(same_size)
+    new.resolve(same_size)
+    groups = compare_files(old.files, new.files)
+    affected_old = groups['changed'] + groups['removed']
+    affected_new = groups['changed'] + groups['added']
+    old_tallies = old.tallies(affected_old)
+    new_tallies = new.tallies(affected_new)
+
+    old_cells = _tally_frame(old_tallies, old.files, affected_old)
+    new_cells = _tally_frame(new_tallies, new.files, affected_new)
+    cells = _compare(old_cells, new_cells, CELL_KEYS)
+    status = {}
+    for name in ('changed', 'added', 'removed'):
+        for rel in groups[name]:
+            entry = (new.files if name == 'added' else old.files)[rel]
+            status[(entry['model_id'], entry['dataset'])] = name
+    cells.insert(2, 'status', [status.get(key, 'changed') for key in zip(cells['model_id'], cells['dataset'])])
+
+    # Per model, pool only the cells present on both sides, so a delta is
+    # never just a dataset being added or dropped.
+    both = set(zip(old_cells['model_id'], old_cells['dataset'])) & set(zip(new_cells['model_id'], new_cells['dataset']))
+
+    def pooled(frame):
+        keep = np.array([key in both for key in zip(frame['model_id'], frame['dataset'])], dtype=bool)
+        return frame[keep].groupby('model_id')[TALLY_COLUMNS].sum().reset_index()
+    models = _compare(pooled(old_cells), pooled(new_cells), ['model_id'])
+
+    for table in (cells, models):
+        for m in METRICS:
+            tests = table[f'{m}_p'].notna().sum()
+            table[f'{m}_significant'] = table[f'{m}_p'] < alpha / max(tests, 1)
+
+    summary = {name: len(rels) for name, rels in groups.items()}
+    summary['unreadable'] = (len(set(affected_old) - set(old_tallies))
+                             + len(set(affected_new) - set(new_tallies)))
+    summary['bytes_scanned'] = old.bytes_read + new.bytes_read
+    summary['bytes_total'] = sum(e['size'] for e in old.files.values()) + sum(e['size'] for e in new.files.values())
+    return cells, models, summary
+
+
+def _report(table, keys):
+    rows = table[keys].copy()
+    for m in METRICS:
+        old, new, delta = table[f'{m}_old'], table[f'{m}_new'], table[f'{m}_delta']
+        mark = np.where(table[f'{m}_significant'], '*', '')
+        rows[m] = [
+            f"{o:.3f} -> {n:.3f} ({d:+.3f}{s})" if np.isfinite(d) else
+            (f"{n:.3f} (new)" if np.isfinite(n) else f"{o:.3f} (gone)" if np.isfinite(o) else "-")
+            for o, n, d, s in zip(old, new, delta, mark)
+        ]
+    return rows.to_string(index=False)
+
+
+def print_diff(cells, models, summary, k=K, alpha=ALPHA):
+    print(f"Files: {summary['changed']} changed, {summary['added']} added, {summary['removed']} removed, "
+          f"{summary['unchanged']} unchanged, {summary['unreadable']} unreadable.")
+    print(f"Scanned {summary['bytes_scanned'] / 1e6:.1f} MB of {summary['bytes_total'] / 1e6:.1f} MB "
+          f"(hashing included).")
+    if cells.empty:
+        print("No model/dataset numbers moved.")
+        return
+    print(f"\n* = significant at {alpha} after Bonferroni; pass_k is Pass@{k} over the examples with at least {k} rollouts, mean_tokens is per rollout.")
+    if not models.empty:
+        print("\n--- Per model (changed datasets pooled) ---")
+        print(_report(models, ['model_id']))
+    print("\n--- Per model x dataset ---")
+    print(_report(cells.sort_values(['model_id', 'dataset']), ['model_id', 'dataset', 'status']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manifest a corpus snapshot, or diff two snapshots.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_manifest = sub.add_parser('manifest', help="write file digests and tallies for a corpus directory")
+    p_manifest.add_argument('data_dir')
+    p_manifest.add_argument('--out', required=True)
+    p_manifest.add_argument('--k', type=int, default=K)
+
+    p_diff = sub.add_parser('diff', help="report what moved between two snapshots")
+    p_diff.add_argument('old', help="corpus directory or manifest")
+    p_diff.add_argument('new', help="corpus directory or manifest")
+    p_diff.add_argument('--k', type=int, default=K)
+    p_diff.add_argument('--alpha', type=float, default=ALPHA)
+    p_diff.add_argument('--out', help="write per-model and per-cell deltas to this CSV")
+
+    args = parser.parse_args()
+    if args.command == 'manifest':
+        write_manifest(args.data_dir, args.out, args.k)
+    else:
+        cells, models, summary = diff_snapshots(args.old, args.new, args.k, args.alpha)
+        print_diff(cells, models, summary, args.k, args.alpha)
+        if args.out:
+            deltas = pd.concat([models.assign(level='model'), cells.assign(level='cell')], ignore_index=True)
+            front = ['level', 'model_id', 'dataset', 'status']
+            deltas[front + [c for c in deltas.columns if c not in front]].to_csv(args.out, index=False)
+            print(f"Saved deltas to {args.out}")
@@ -0,0 +1,181 @@
+"""
+Group-by sums under a memory budget.
+
+SpillingGroupBy collects pre-aggregated pieces: key columns plus additive
+value columns. While the pieces fit in the budget they stay in memory and
+are merged with one Arrow group-by, as before. Past the budget they are
+hash-partitioned on the keys and appended to Arrow IPC files in a scratch
+directory. Each partition is then merged on its own, so the merge's hash
+table only ever covers 1/SPILL_PARTITIONS of the groups. A partition that
+still exceeds the budget is split again with a different hash salt.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+SIZE_SUFFIXES = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text):
+    """Bytes from '512M', '2G', '1.5G' or a plain byte count; None for '' or 'none'."""
+    text = str(text).strip().upper().rstrip('B')
+    if text in ('', 'NONE'):
+        return None
+    suffix = text[-1] if text[-1] in SIZE_SUFFIXES else ''
+    return int(float(text[:len(text) - len(suffix)]) * SIZE_SUFFIXES[suffix])
+
+
+def _default_budget():
+    if 'MEDARC_MEMORY_BUDGET' in os.environ:
+        return parse_size(os.environ['MEDARC_MEMORY_BUDGET'])
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 4
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+# Set MEDARC_MEMORY_BUDGET=2G to cap the group-by working set (default: a
+# quarter of physical memory; 'none' disables spilling).
+MEMORY_BUDGET = _default_budget()
+# Scratch space for spilled partitions (default: the system temp directory).
+SPILL_DIR = os.environ.get("MEDARC_SPILL_DIR") or None
+SPILL_PARTITIONS = 32
+# Re-partitioning rounds before an oversized partition is merged in memory anyway.
+MAX_SPILL_DEPTH = 3
+
+
+def _column_hash(column):
+    """uint64 hash per row of a (chunked) key column, stable across processes."""
+    out = []
+    for chunk in column.chunks:
+        if pa.types.is_dictionary(chunk.type):
+            values = pd.util.hash_array(chunk.dictionary.to_numpy(zero_copy_only=False))
+            indices = chunk.indices.fill_null(0).to_numpy()
+            out.append(values[indices])
+        else:
+            out.append(pd.util.hash_array(chunk.to_numpy(zero_copy_only=False)))
+    if not out:
+        return np.zeros(0, dtype=np.uint64)
+    return np.concatenate(out)
+
+
+def partition_ids(table, keys, partitions, salt=0):
+    """Partition number in [0, partitions) for every row, from a hash of its keys."""
+    h = np.full(table.num_rows, salt, dtype=np.uint64)
+    for k in keys:
+        h = (h ^ _column_hash(table[k])) * np.uint64(0x100000001B3)
+        h ^= h >> np.uint64(29)
+    return (h % np.uint64(partitions)).astype(np.int64)
+
+
+def sum_by(table, keys):
+    """Sums every non-key column of `table` per distinct `keys`."""
+    values = [c for c in table.column_names if c not in keys]
+    return (table.group_by(keys).aggregate([(c, 'sum') for c in values])
+            .rename_columns({f'{c}_sum': c for c in values}))
+
+
+class SpillingGroupBy:
+    """
+    Key-wise sum of the pieces passed to add(), holding at most about
+    `budget` bytes of them in memory (no limit when budget is None).
+    """
+
+    def __init__(self, keys, budget=MEMORY_BUDGET, partitions=SPILL_PARTITIONS,
+                 spill_dir=SPILL_DIR, salt=0):
+        self.keys = list(keys)
+        self.budget = budget
+        self.partitions = partitions
+        self.spill_dir = spill_dir
+        self.salt = salt
+        self.pieces = []
+        self.held = 0
+        self.scratch = None
+        self.files = {}
+        self.spilled_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, piece):
+        self.pieces.append(piece)
+        self.held += piece.nbytes
+        if self.budget is not None and self.held > self.budget:
+            self._spill()
+
+    def _spill(self):
+        if not self.pieces:
+            return
+        if self.scratch is None:
+            self.scratch = tempfile.mkdtemp(prefix="medarc-spill-", dir=self.spill_dir)
+            if self.salt == 0:
+                print(f"Group-by exceeded its {self.budget / 2**20:.0f} MiB budget; "
+                      f"spilling {self.partitions} partitions to {self.scratch}")
+        table = pa.concat_tables(self.pieces).unify_dictionaries()
+        self.pieces, self.held = [], 0
+
+        part = partition_ids(table, self.keys, self.partitions, self.salt)
+        order = np.argsort(part, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(part, minlength=self.partitions))])
+        table = table.take(pa.array(order))
+        for i in range(self.partitions):
+            rows = table.slice(bounds[i], bounds[i + 1] - bounds[i])
+            if rows.num_rows == 0:
+                continue
+            if i not in self.files:
+                sink = pa.OSFile(os.path.join(self.scratch, f"part-{i:03d}.arrows"), 'wb')
+                self.files[i] = (sink, pa.ipc.new_stream(sink, table.schema))
+            self.files[i][1].write_table(rows)
+            self.spilled_bytes += rows.nbytes
+
+    def _merge_partition(self, path, regroup):
+        with pa.OSFile(path, 'rb') as source:
+            reader = pa.ipc.open_stream(source)
+            if not regroup or self.salt + 1 >= MAX_SPILL_DEPTH or os.path.getsize(path) <= (self.budget or 0):
+                table = reader.read_all().unify_dictionaries()
+                return sum_by(table, self.keys) if regroup else table
+            with SpillingGroupBy(self.keys, self.budget, self.partitions, self.spill_dir, self.salt + 1) as sub:
+                for batch in reader:
+                    sub.add(pa.Table.from_batches([batch]))
+                return sub.result(regroup)
+
+    def result(self, regroup=True):
+        """
+        The merged table, or None if nothing was added. With regroup=False the
+        pieces are known not to share keys, and are only concatenated.
+        """
+        try:
+            if self.scratch is None:
+                if not self.pieces:
+                    return None
+                table = pa.concat_tables(self.pieces).unify_dictionaries()
+                self.pieces, self.held = [], 0
+                return sum_by(table, self.keys) if regroup else table
+
+            self._spill()
+            for sink, writer in self.files.values():
+                writer.close()
+                sink.close()
+            merged = [self._merge_partition(os.path.join(self.scratch, f"part-{i:03d}.arrows"), regroup)
+                      for i in sorted(self.files)]
+            self.files = {}
+            return pa.concat_tables(merged).unify_dictionaries()
+        finally:
+            self.close()
+
+    def close(self):
+        """Drops held pieces and deletes any spill files."""
+        for sink, writer in self.files.values():
+            sink.close()
+        self.files = {}
+        self.pieces, self.held = [], 0
+        if self.scratch is not None:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+            self.scratch = None
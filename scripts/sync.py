@@ -0,0 +1,401 @@
+"""
+Pull inference-scratch from a shared mirror into a local content-addressed store.
+
+    python sync.py index /mnt/mirror/inference-scratch
+    python sync.py pull /mnt/mirror/inference-scratch --tree ../inference-scratch
+    python sync.py pull /mnt/mirror/inference-scratch --workers 16
+    python pipeline.py --data-dir .analysis_cache/store/snapshots/latest.json
+    python sync.py gc
+
+Every file is stored once, as STORE/blobs/ab/<sha256>, however many
+snapshots or models contain it. A pull writes a snapshot manifest mapping
+each path under the mirror root to its blob, and can lay the snapshot out
+as a tree of hard links that the scripts read as their DATA_DIR. The
+loader also accepts the manifest itself in place of a data directory.
+
+Only new and changed files cross the mirror link. A file whose size and
+mtime match the previous pull keeps its hash without being read; when the
+mirror carries an index (written by `index` on the mirror host), its
+hashes are used too, so a file already in the store is not copied even if
+it was touched or renamed. The rest are hashed while they are copied, by
+a pool of worker threads. Copies land in STORE/tmp as .part files and
+every finished file is journaled, so an interrupted pull picks up where
+it stopped, down to the byte offset of a half-copied file.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from quarantine import CACHE_DIR
+
+SYNC_FORMAT = "medarc-sync"
+SYNC_VERSION = 1
+MIRROR_INDEX = ".medarc-sync.json"
+# Marks a tree built by `pull --tree`; any other directory is never replaced.
+TREE_MARKER = ".medarc-sync-tree"
+STORE_DIR = os.environ.get("MEDARC_STORE", os.path.join(CACHE_DIR, "store"))
+# sha256 of local files by path, reused while their size and mtime are unchanged.
+DIGEST_CACHE = os.path.join(CACHE_DIR, "digests.json")
+WORKERS = 8
+COPY_CHUNK = 4 << 20
+
+
+def blob_path(store, digest):
+    return os.path.join(store, 'blobs', digest[:2], digest)
+
+
+def _write_json(path, payload):
+    """Writes via a temporary file, so readers never see half a manifest."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(payload, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_manifest(path):
+    """True if `path` is a snapshot manifest written by pull."""
+    if not (os.path.isfile(path) and path.endswith('.json')):
+        return False
+    payload = _read_json(path)
+    return isinstance(payload, dict) and payload.get('format') == SYNC_FORMAT
+
+
+def manifest_files(path):
+    """
+    (blob path, relative path) for every file in a snapshot manifest. The
+    blobs are looked up in the store the manifest was written to, or, if
+    that has moved, the store the manifest now sits in.
+    """
+    manifest = _read_json(path)
+    store = manifest.get('store', '')
+    if not os.path.isdir(store):
+        store = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+    return [(blob_path(store, entry['sha256']), rel) for rel, entry in sorted(manifest['files'].items())]
+
+
+def mirror_files(source):
+    """{relative path: os.stat_result} for every parquet file under `source`."""
+    files = {}
+    for f in sorted(glob.glob(f"{source}/**/*.parquet", recursive=True)):
+        files[os.path.relpath(f, source).replace(os.sep, '/')] = os.stat(f)
+    return files
+
+
+def _same_stat(entry, st):
+    return entry is not None and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cached_digests(paths, cache_file=DIGEST_CACHE):
+    """{path: sha256} for the `paths` whose size and mtime match their digest-cache entry. Reads no file."""
+    cache = (_read_json(cache_file) or {}).get('files', {})
+    digests = {}
+    for p in paths:
+        entry = cache.get(os.path.abspath(p))
+        if _same_stat(entry, os.stat(p)):
+            digests[p] = entry['sha256']
+    return digests
+
+
+def index_digests(source):
+    """
+    {relative path: sha256} from the MIRROR_INDEX under `source`, for the
+    files whose size and mtime still match their entry. Reads no file.
+    """
+    index = (_read_json(os.path.join(source, MIRROR_INDEX)) or {}).get('files', {})
+    digests = {}
+    for rel, entry in index.items():
+        path = os.path.join(source, rel)
+        if os.path.exists(path) and _same_stat(entry, os.stat(path)):
+            digests[rel] = entry['sha256']
+    return digests
+
+
+def content_digests(paths, cache_file=DIGEST_CACHE, workers=WORKERS):
+    """
+    {path: sha256} for `paths`. Size and mtime only decide which files may
+    skip the read: a file whose stat matches its cached entry keeps the
+    cached hash, and every other file is hashed in full.
+    """
+    cache = (_read_json(cache_file) or {}).get('files', {})
+    stats = {p: os.stat(p) for p in paths}
+    digests = cached_digests(paths, cache_file)
+    todo = [p for p in paths if p not in digests]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for p, digest in zip(todo, pool.map(hash_file, todo)):
+            digests[p] = digest
+            cache[os.path.abspath(p)] = {'sha256': digest, 'size': stats[p].st_size, 'mtime_ns': stats[p].st_mtime_ns}
+    if todo:
+        _write_json(cache_file, {'format': SYNC_FORMAT, 'version': SYNC_VERSION, 'files': cache})
+    return digests
+
+
+def build_index(source, workers=WORKERS):
+    """Writes MIRROR_INDEX under `source`, re-hashing only files whose size or mtime changed."""
+    previous = (_read_json(os.path.join(source, MIRROR_INDEX)) or {}).get('files', {})
+    files = mirror_files(source)
+    entries = {rel: previous[rel] for rel, st in files.items() if _same_stat(previous.get(rel), st)}
+    todo = [rel for rel in files if rel not in entries]
+    print(f"Indexing {len(files)} files under {source}: {len(todo)} to hash.")
+
+    def one(rel):
+        st = files[rel]
+        return rel, {'sha256': hash_file(os.path.join(source, rel)), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rel, entry in pool.map(one, todo):
+            entries[rel] = entry
+    _write_json(os.path.join(source, MIRROR_INDEX),
+                {'format': SYNC_FORMAT, 'version': SYNC_VERSION, 'files': entries})
+    print(f"Wrote {os.path.join(source, MIRROR_INDEX)}")
+
+
+class Store:
+    """The blob directory, its snapshot manifests and the journal of an unfinished pull."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = os.path.abspath(root)
+        self.tmp = os.path.join(self.root, 'tmp')
+        self.snapshots = os.path.join(self.root, 'snapshots')
+        self.journal = os.path.join(self.root, 'journal.jsonl')
+        self.lock = threading.Lock()
+        for d in (self.tmp, self.snapshots, os.path.join(self.root, 'blobs')):
+            os.makedirs(d, exist_ok=True)
+
+    def has(self, digest):
+        return os.path.exists(blob_path(self.root, digest))
+
+    def known_hashes(self, source):
+        """
+        {relative path: {sha256, size, mtime_ns}} recorded for `source` by its
+        latest snapshot and by the journal of a pull that did not finish.
+        """
+        known = {}
+        for path in sorted(glob.glob(os.path.join(self.snapshots, '2*.json'))):
+            manifest = _read_json(path)
+            if manifest and manifest.get('source') == source:
+                known = dict(manifest['files'])
+        if os.path.exists(self.journal):
+            with open(self.journal) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by the interruption
+                    if record.get('source') == source:
+                        known[record['rel']] = record['entry']
+        return known
+
+    def record(self, source, rel, entry):
+        with self.lock, open(self.journal, 'a') as f:
+            f.write(json.dumps({'source': source, 'rel': rel, 'entry': entry}) + "\n")
+
+    def fetch(self, path, st):
+        """
+        Copies `path` into the store, hashing it on the way, and returns
+        (sha256, bytes copied, resumed). A .part file left by an earlier
+        attempt on the same version of the file is continued, not restarted.
+        The copy is dropped if the store already has the content.
+        """
+        key = hashlib.sha1(f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}".encode()).hexdigest()
+        part = os.path.join(self.tmp, f"{key}.part")
+        h = hashlib.sha256()
+        offset = 0
+        if os.path.exists(part) and os.path.getsize(part) <= st.st_size:
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(COPY_CHUNK), b''):
+                    h.update(block)
+                    offset += len(block)
+
+        with open(path, 'rb') as src, open(part, 'ab' if offset else 'wb') as dst:
+            src.seek(offset)
+            for block in iter(lambda: src.read(COPY_CHUNK), b''):
+                h.update(block)
+                dst.write(block)
+
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns) or os.path.getsize(part) != st.st_size:
+            os.remove(part)
+            raise OSError(f"{path} changed while it was being copied")
+
+        digest = h.hexdigest()
+        blob = blob_path(self.root, digest)
+        if os.path.exists(blob):
+            os.remove(part)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.chmod(part, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(part, blob)
+        return digest, st.st_size - offset, offset > 0
+
+    def commit(self, source, files):
+        """
+        Writes the snapshot manifest, points latest.json at it and clears the
+        journal. A pull that found nothing new reuses the previous manifest.
+        """
+        digest = hashlib.sha1(json.dumps(sorted((rel, e['sha256']) for rel, e in files.items())).encode())
+        digest = digest.hexdigest()[:8]
+        latest = _read_json(os.path.join(self.snapshots, 'latest.json'))
+        if latest and latest['source'] == source and latest['files'] == files:
+            path = os.path.join(self.snapshots, f"{latest['created']}-{digest}.json")
+        else:
+            created = time.strftime('%Y%m%dT%H%M%S')
+            manifest = {'format': SYNC_FORMAT, 'version': SYNC_VERSION, 'source': source,
+                        'store': self.root, 'created': created, 'files': files}
+            path = os.path.join(self.snapshots, f"{created}-{digest}.json")
+            _write_json(path, manifest)
+            _write_json(os.path.join(self.snapshots, 'latest.json'), manifest)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        return path
+
+    def gc(self):
+        """Deletes blobs no snapshot refers to, and abandoned partial copies."""
+        live = set()
+        for path in glob.glob(os.path.join(self.snapshots, '2*.json')):
+            manifest = _read_json(path)
+            if manifest:
+                live.update(e['sha256'] for e in manifest['files'].values())
+        freed = removed = 0
+        for blob in glob.glob(os.path.join(self.root, 'blobs', '*', '*')):
+            if os.path.basename(blob) not in live:
+                freed += os.path.getsize(blob)
+                os.remove(blob)
+                removed += 1
+        if not os.path.exists(self.journal):
+            for part in glob.glob(os.path.join(self.tmp, '*.part')):
+                freed += os.path.getsize(part)
+                os.remove(part)
+        print(f"Removed {removed} unreferenced blobs, {freed / 2**20:.1f} MiB freed.")
+
+
+def pull(source, store, workers=WORKERS):
+    """
+    Brings `store` up to date with the mirror at `source` and returns the
+    path of the new snapshot manifest.
+    """
+    source = os.path.abspath(source)
+    files = mirror_files(source)
+    known = store.known_hashes(source)
+    index = (_read_json(os.path.join(source, MIRROR_INDEX)) or {}).get('files', {})
+
+    entries, todo = {}, []
+    for rel, st in files.items():
+        for entry in (known.get(rel), index.get(rel)):
+            if _same_stat(entry, st) and store.has(entry['sha256']):
+                entries[rel] = {'sha256': entry['sha256'], 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+                break
+        else:
+            todo.append(rel)
+    total = sum(files[rel].st_size for rel in todo)
+    print(f"Mirror {source}: {len(files)} files, {len(files) - len(todo)} already in the store, "
+          f"{len(todo)} to copy ({total / 2**20:.1f} MiB) with {workers} workers.")
+
+    copied = resumed = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(store.fetch, os.path.join(source, rel), files[rel]): rel for rel in todo}
+        for future in as_completed(futures):
+            rel = futures[future]
+            try:
+                digest, n_bytes, was_resumed = future.result()
+            except OSError as e:
+                failed.append(rel)
+                print(f"  failed {rel}: {e}")
+                continue
+            entry = {'sha256': digest, 'size': files[rel].st_size, 'mtime_ns': files[rel].st_mtime_ns}
+            store.record(source, rel, entry)
+            entries[rel] = entry
+            copied += n_bytes
+            resumed += was_resumed
+
+    distinct = len({e['sha256'] for e in entries.values()})
+    print(f"Copied {copied / 2**20:.1f} MiB ({resumed} resumed); {len(entries)} files, {distinct} distinct blobs.")
+    if failed:
+        raise SystemExit(f"{len(failed)} files failed; run the pull again to resume.")
+    path = store.commit(source, entries)
+    print(f"Snapshot manifest: {path}")
+    return path
+
+
+def materialize(manifest_path, tree):
+    """
+    Lays a snapshot out at `tree` as hard links into the store (copies where
+    the store is on another filesystem), swapping it in once complete. Only
+    a tree that an earlier materialize() built is ever replaced.
+    """
+    if os.path.exists(tree) and not os.path.exists(os.path.join(tree, TREE_MARKER)):
+        raise SystemExit(f"{tree} exists and was not built by sync.py; refusing to replace it.")
+    staging = f"{tree.rstrip(os.sep)}.sync-new"
+    shutil.rmtree(staging, ignore_errors=True)
+    for blob, rel in manifest_files(manifest_path):
+        dst = os.path.join(staging, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(blob, dst)
+        except OSError:
+            shutil.copyfile(blob, dst)
+    with open(os.path.join(staging, TREE_MARKER), 'w') as f:
+        f.write(os.path.abspath(manifest_path) + "\n")
+
+    if os.path.exists(tree):
+        retired = f"{tree.rstrip(os.sep)}.sync-old"
+        shutil.rmtree(retired, ignore_errors=True)
+        os.rename(tree, retired)
+        os.rename(staging, tree)
+        shutil.rmtree(retired)
+    else:
+        os.rename(staging, tree)
+    print(f"Materialized {tree}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('index', help="hash a mirror's files into its index (run on the mirror host)")
+    p.add_argument('source')
+    p.add_argument('--workers', type=int, default=WORKERS)
+    p = sub.add_parser('pull', help="copy new and changed files from a mirror into the store")
+    p.add_argument('source')
+    p.add_argument('--store', default=STORE_DIR)
+    p.add_argument('--tree', help="also lay the snapshot out here as a corpus directory")
+    p.add_argument('--workers', type=int, default=WORKERS)
+    p = sub.add_parser('gc', help="delete blobs that no snapshot refers to")
+    p.add_argument('--store', default=STORE_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        build_index(args.source, args.workers)
+    elif args.command == 'pull':
+        path = pull(args.source, Store(args.store), args.workers)
+        if args.tree:
+            materialize(path, args.tree)
+    else:
+        Store(args.store).gc()
+
+
+if __name__ == "__main__":
+    main()
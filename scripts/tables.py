@@ -0,0 +1,297 @@
+"""
+The tables behind each report figure, computed from per-example tallies
+(aggregates.example_stats) and token histograms instead of raw rollouts.
+Used by partials.py and pipeline.py; task lists and the model registry are
+passed in so the callers decide which script's settings apply.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from aggregates import (CELL_KEYS, MIN_COVERAGE, as_table, cell_budgets, cell_table, grouped_sums, pass_at_k,
+                        pass_at_k_curve)
+from cube import ScoreCube
+from variance import decompose
+
+# Histogram edges for completion tokens: 0, then ~256 log-spaced edges up to 2**18.
+TOKEN_EDGES = np.concatenate([[0.0], np.unique(np.round(np.geomspace(1, 2 ** 18, 256)))])
+HIST_KEYS = ['model_id', 'dataset', 'correct']
+# One more rollout is not worth paying for once it adds less than this to Pass@k.
+MIN_GAIN = 0.005
+# A power-law projection of that need takes at least this many gains past
+# k=1, and is trusted up to this multiple of the cell's budget.
+MIN_FIT_POINTS = 4
+MAX_PROJECTION = 4
+
+# Task settings of the report scripts. They live here, free of plotting
+# imports, so partials.py workers and serve.py can share them.
+KEYWORD_OP4 = "medbullets-op4"
+KEYWORD_OP5 = "medbullets-op5"
+
+KNOWLEDGE_TASKS = [
+    'medqa',
+    'medbullets-op5',
+    'medbullets-op4',
+    'pubmedqa',
+    'med_mcqa',
+    'mmlu_pro_health',
+    'metamedqa',
+    'medconceptsqa',
+]
+
+REASONING_TASKS = [
+    'medxpertqa-reasoning',
+    'medxpertqa-understanding',
+    'm_arc',
+    'longhealth',
+    'medcalc_bench',
+]
+
+TASK_GROUPS = {
+    'Knowledge Score': KNOWLEDGE_TASKS,
+    # A dataset matching both lists counts as knowledge.
+    'Reasoning Score': {'include': REASONING_TASKS, 'exclude': KNOWLEDGE_TASKS},
+}
+# 'micro' pools every rollout of a group (large datasets weigh more);
+# 'macro' gives each dataset equal weight.
+AVERAGE = 'micro'
+
+# Datasets behind the token-efficiency figures.
+TARGET_TASKS = [
+    'medqa',
+    'medxpertqa-reasoning',
+    'medcalc_bench',
+    'mmlu_pro_health',
+    'm_arc',
+]
+
+
+def token_histogram(data):
+    """Rollout counts per (model_id, dataset, correct, token bin) over TOKEN_EDGES."""
+    table = as_table(data)
+    table = table.filter(pc.is_valid(table['model_token_completion']))
+
+    def derive(chunk):
+        tokens = chunk['model_token_completion'].to_numpy()
+        bins = np.clip(np.searchsorted(TOKEN_EDGES, tokens, side='right') - 1, 0, len(TOKEN_EDGES) - 2)
+        return {
+            'correct': pc.greater(chunk['reward'], 0),
+            'bin': pa.array(bins.astype(np.int16)),
+            'count': pa.array(np.ones(chunk.num_rows, dtype=np.int64)),
+        }
+    return grouped_sums(table, HIST_KEYS + ['bin'], derive)
+
+
+def in_tasks(datasets, tasks):
+    members = [d for d in datasets.unique() if any(t in d for t in tasks)]
+    return datasets.isin(members)
+
+
+def efficiency_table(stats, tasks, registry=None, models=None):
+    """
+    Accuracy and mean tokens per model over `tasks`, counting only rollouts
+    within the token cap, plus each model's registry Family when a
+    registry is given.
+    """
+    stats = stats[in_tasks(stats['dataset'], tasks)]
+    if models is not None:
+        stats = stats[stats['model_id'].isin(list(models))]
+    g = stats.groupby('model_id')[['sum_reward_capped', 'sum_tokens_capped', 'n_capped']].sum()
+    g = g[g['n_capped'] > 0]
+    table = pd.DataFrame({
+        'Accuracy': g['sum_reward_capped'] / g['n_capped'],
+        'Cost': g['sum_tokens_capped'] / g['n_capped'],
+    }).reset_index()
+    if registry is not None:
+        table = registry.join(table, ['family']).rename(columns={'family': 'Family'})
+        table['Family'] = table['Family'].astype(str)
+    return table
+
+
+def token_efficiency_table(stats, tasks, registry):
+    table = efficiency_table(stats, tasks, models=registry.model_ids)
+    table = registry.join(table, ['family', 'size', 'display_name'])
+    return table.rename(columns={'family': 'Category', 'size': 'Size'}).astype({'Category': str, 'Size': str})
+
+
+def pass_at_k_table(stats, k=None, min_coverage=MIN_COVERAGE):
+    """
+    Mean Pass@1 and Pass@k per model over the same datasets for every
+    model: those where each model's cell budget reaches k. Within them only
+    the examples with at least k rollouts count. k defaults to the median
+    over datasets of the budget every model reaches. The datasets compared
+    are listed in attrs['datasets'] and the ones left out in
+    attrs['excluded'].
+    """
+    budgets = cell_budgets(stats, min_coverage)
+    # A dataset some model has no cell for has no shared budget.
+    shared = budgets.unstack('model_id').min(axis=1, skipna=False)
+    if k is None:
+        k = int(shared.median()) if shared.notna().any() else 1
+    datasets = sorted(shared.index[shared >= k])
+    per_example = stats[stats['dataset'].isin(datasets) & (stats['n'] >= k)]
+    per_example = per_example.assign(
+        pass_1=per_example['n_correct'] / per_example['n'],
+        pass_k=pass_at_k(per_example['n'], per_example['n_correct'], k),
+    )
+    table = per_example.groupby('model_id')[['pass_1', 'pass_k']].mean().reset_index()
+    table = table.rename(columns={'pass_k': f'pass_{k}'}).sort_values('pass_1', ascending=False)
+    table.attrs['k'] = k
+    table.attrs['datasets'] = datasets
+    table.attrs['excluded'] = sorted(shared.index[~(shared >= k)])
+    return table
+
+
+def pass_at_k_curve_table(stats, min_coverage=MIN_COVERAGE):
+    """
+    Pass@k for k = 1 up to each (model, dataset) cell's rollout budget, with
+    its standard error over examples, and the marginal gain of the k-th
+    rollout, Pass@k - Pass@(k-1), measured on the same examples.
+    """
+    budgets = cell_budgets(stats, min_coverage)
+    curve = pass_at_k_curve(stats, int(budgets.max()))
+    curve = curve.join(budgets, on=CELL_KEYS)
+    curve = curve[curve['k'] <= curve['budget']].reset_index(drop=True)
+
+    n = curve['n_examples']
+    for name, total, sumsq in [('pass_k', 'sum_pass_k', 'sumsq_pass_k'), ('gain', 'sum_gain', 'sumsq_gain')]:
+        mean = curve[total] / n
+        var = (curve[sumsq] / n - mean ** 2).clip(lower=0) * n / (n - 1).where(n > 1)
+        curve[name] = mean
+        curve[f'{name}_se'] = np.sqrt(var / n)
+    return curve[CELL_KEYS + ['k', 'budget', 'n_examples', 'pass_k', 'pass_k_se', 'gain', 'gain_se']]
+
+
+def _rollouts_needed(cell, min_gain):
+    """
+    (k, how it was found): the fewest rollouts after which one more adds
+    less than `min_gain`. Read off the curve when that happens within the
+    budget; otherwise projected by fitting log gain against log k over the
+    curve past k=1. With fewer than MIN_FIT_POINTS gains to fit, or a
+    projection past MAX_PROJECTION times the budget, it is (NaN, 'unresolved').
+    """
+    gains = cell.set_index('k')['gain']
+    flat = gains.index[(gains.index > 1) & (gains < min_gain)]
+    if len(flat):
+        return int(flat[0]) - 1, 'observed'
+    tail = gains[(gains.index > 1) & (gains > 0)]
+    if len(tail) < MIN_FIT_POINTS:
+        return np.nan, 'unresolved'
+    slope, intercept = np.polyfit(np.log(tail.index.to_numpy(dtype=float)), np.log(tail.to_numpy()), 1)
+    if slope >= 0:
+        return np.nan, 'unresolved'
+    needed = int(np.ceil(np.exp((np.log(min_gain) - intercept) / slope))) - 1
+    if needed > MAX_PROJECTION * cell['budget'].max():
+        return np.nan, 'unresolved'
+    return needed, 'projected'
+
+
+def rollout_budget_table(stats, curve, min_gain=MIN_GAIN):
+    """
+    One row per (model, dataset): the rollouts its examples have, the budget
+    Pass@k is valid up to, Pass@1 and Pass@budget, the gain the last rollout
+    bought, and how many rollouts the cell needs before another one gains
+    less than `min_gain`.
+    """
+    rollouts = stats.groupby(CELL_KEYS, observed=True)['n'].agg(
+        n_examples='size', min_rollouts='min', median_rollouts='median', max_rollouts='max')
+    rows = []
+    for (model_id, dataset), cell in curve.groupby(CELL_KEYS, observed=True, sort=True):
+        last = cell.iloc[-1]
+        needed, needed_from = _rollouts_needed(cell, min_gain)
+        rows.append({
+            'model_id': model_id, 'dataset': dataset, 'budget': int(last['budget']),
+            'pass_1': cell['pass_k'].iloc[0], 'pass_at_budget': last['pass_k'], 'pass_at_budget_se': last['pass_k_se'],
+            'last_gain': last['gain'] if last['k'] > 1 else np.nan,
+            'last_gain_se': last['gain_se'] if last['k'] > 1 else np.nan,
+            'rollouts_needed': needed, 'needed_from': needed_from,
+        })
+    table = pd.DataFrame(rows).join(rollouts, on=CELL_KEYS)
+    columns = CELL_KEYS + list(rollouts.columns) + [c for c in table.columns if c not in CELL_KEYS + list(rollouts.columns)]
+    table = table[columns]
+    table.attrs['min_gain'] = min_gain
+    return table
+
+
+def benchmark_budget_table(budgets):
+    """
+    Per dataset: the budgets its cells have now, and the rollouts it needs
+    for every model (max over models) and for a typical one (median), over
+    the models whose need was observed or projected. The others are counted
+    in 'unresolved'.
+    """
+    g = budgets.groupby('dataset')
+    table = pd.DataFrame({
+        'models': g.size(),
+        'min_budget': g['budget'].min(),
+        'max_budget': g['budget'].max(),
+        'median_needed': g['rollouts_needed'].median(),
+        'max_needed': g['rollouts_needed'].max(),
+        'projected': g['needed_from'].agg(lambda s: int((s == 'projected').sum())),
+        'unresolved': g['rollouts_needed'].agg(lambda s: int(s.isna().sum())),
+    }).reset_index()
+    table.attrs['min_gain'] = budgets.attrs.get('min_gain', MIN_GAIN)
+    return table
+
+
+def distractor_table(stats, op4, op5):
+    acc = {}
+    for label, keyword in [('Op4 Accuracy', op4), ('Op5 Accuracy', op5)]:
+        part = stats[in_tasks(stats['dataset'], [keyword])].groupby('model_id')[['sum_reward', 'n']].sum()
+        acc[label] = part['sum_reward'] / part['n']
+    table = pd.concat(acc, axis=1).dropna()
+    table['Performance Drop'] = table['Op4 Accuracy'] - table['Op5 Accuracy']
+    table.index.name = 'model_id'
+    return table.sort_values('Performance Drop', ascending=False).reset_index()
+
+
+def composite_table(stats, groups, average='micro'):
+    cube = ScoreCube(cell_table(stats))
+    return cube.composite(groups, average=average).dropna().reset_index()
+
+
+def snr_table(stats):
+    moments = stats.rename(columns={'sum_reward': 'sum', 'sumsq_reward': 'sumsq'})
+    table = decompose(moments)
+    table['noise_score'] = table['noise_score'].fillna(0)
+    return table
+
+
+def histogram_quantiles(counts, qs):
+    """Quantiles of a TOKEN_EDGES histogram, interpolated linearly within a bin."""
+    cum = np.cumsum(counts)
+    out = []
+    for q in qs:
+        target = q * cum[-1]
+        b = min(int(np.searchsorted(cum, target, side='left')), len(counts) - 1)
+        before = cum[b - 1] if b > 0 else 0
+        frac = (target - before) / counts[b] if counts[b] else 0.0
+        out.append(TOKEN_EDGES[b] + frac * (TOKEN_EDGES[b + 1] - TOKEN_EDGES[b]))
+    return out
+
+
+def thinking_length_table(hist, registry):
+    """
+    Box-plot statistics of completion tokens per (model, outcome) for the
+    models the registry classifies as Thinking. Interpolated from the
+    histogram, so they are accurate to within one bin width (~5%).
+    """
+    families = registry.frame(hist['model_id'].unique())['family']
+    thinkers = hist[hist['model_id'].isin(families.index[families == 'Thinking'])]
+    rows = []
+    for (model_id, correct), part in thinkers.groupby(['model_id', 'correct']):
+        counts = np.bincount(part['bin'], weights=part['count'], minlength=len(TOKEN_EDGES) - 1)
+        q1, median, q3 = histogram_quantiles(counts, [0.25, 0.5, 0.75])
+        nonzero = np.flatnonzero(counts)
+        low, high = TOKEN_EDGES[nonzero[0]], TOKEN_EDGES[nonzero[-1] + 1]
+        iqr = q3 - q1
+        rows.append({
+            'model_id': model_id,
+            'Outcome': 'Correct' if correct else 'Incorrect',
+            'n': int(counts.sum()),
+            'q1': q1, 'median': median, 'q3': q3,
+            'whisker_low': max(low, q1 - 1.5 * iqr),
+            'whisker_high': min(high, q3 + 1.5 * iqr),
+        })
+    return pd.DataFrame(rows)
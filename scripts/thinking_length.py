@@ -1,8 +1,11 @@
-import pandas as pd
+import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
+import pyarrow.compute as pc
+
+from loader import scan_table
+from preview import print_sampling_error
+from schema import to_frame
 
 DATA_DIR = "../inference-scratch"
 OUTPUT_FILE = "thinking_length_correlation.png"
@@ -10,44 +13,28 @@ OUTPUT_FILE = "thinking_length_correlation.png"
 def analyze_thinking_length():
     print("Loading data for Thinking Analysis...")
     
-    files = glob.glob(f"{DATA_DIR}/**/*.parquet", recursive=True)
-    
-    if not files:
-        print(f"No parquet files found in {DATA_DIR}")
-        return
-
-    print(f"Found {len(files)} files. Compiling dataframe...")
-    
-    df_list = []
-    for f in files:
-        try:
-            temp_df = pd.read_parquet(f)
-            df_list.append(temp_df)
-        except Exception as e:
-            print(f"Skipping bad file {f}: {e}")
+    table = scan_table(DATA_DIR, columns=['reward', 'model_token_completion'], classes=['family'])
 
-    if not df_list:
-        print("Could not load any dataframes.")
+    if table is None:
+        print(f"Could not load any dataframes from {DATA_DIR}.")
         return
 
-    df = pd.concat(df_list, ignore_index=True)
-
-    df['model_id'] = df['model_id'].astype(str)
-
-    keywords = ['think', 'reason', 'qwq']
-    df['is_thinker'] = df['model_id'].apply(lambda x: any(k in x.lower() for k in keywords))
-    
-    df_think = df[df['is_thinker']].copy()
+    # Only the thinking models' rollouts are converted to pandas for the box plot.
+    df_think = to_frame(table.filter(pc.equal(table['family'], 'Thinking')))
     
     if df_think.empty:
-        print("No thinking models found based on keywords:", keywords)
-        print("Available models:", df['model_id'].unique()[:10]) # Debug print
+        print("No models are classified as Thinking in the model metadata.")
+        print("Available models:", pc.unique(table['model_id']).to_pylist()[:10]) # Debug print
         return
 
     print(f"Analyzing {df_think['model_id'].nunique()} thinking models...")
 
-    df_think['Outcome'] = df_think['reward'].apply(lambda x: 'Correct' if x > 0 else 'Incorrect')
+    df_think['Outcome'] = np.where(df_think['reward'] > 0, 'Correct', 'Incorrect')
+    print_sampling_error(df_think, ['model_id', 'Outcome'], 'model_token_completion', label="mean tokens")
+
+    plot_thinking_length(df_think)
 
+def plot_thinking_length(df_think, output_file=OUTPUT_FILE):
     plt.figure(figsize=(14, 8)) # Increased size slightly for more models
     sns.set_theme(style="whitegrid")
     
@@ -67,8 +54,8 @@ def analyze_thinking_length():
     plt.legend(title="Outcome")
     
     plt.tight_layout()
-    plt.savefig(OUTPUT_FILE)
-    print(f"Saved analysis to {OUTPUT_FILE}")
+    plt.savefig(output_file)
+    print(f"Saved analysis to {output_file}")
 
 if __name__ == "__main__":
     analyze_thinking_length()
\ No newline at end of file
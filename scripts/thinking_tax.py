@@ -1,9 +1,9 @@
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import glob
-import os
-import numpy as np
+
+from aggregates import group_mean
+from loader import scan_table
+from preview import print_sampling_error
 
 DATA_DIR = "../inference-scratch"
 OUTPUT_FILE = "thinking_efficiency_frontier_final_previous.png"
@@ -17,6 +17,7 @@ TARGET_TASKS = [
 ]
 
 FONT_SIZE = 9
+TOKEN_CAP = 8000 # Cap extreme outliers
 
 try:
     from adjustText import adjust_text
@@ -27,48 +28,26 @@ except ImportError:
 
 def analyze_efficiency_frontier_final():
     print("Loading data...")
-    files = []
-    for task in TARGET_TASKS:
-        found = glob.glob(f"{DATA_DIR}/**/*{task}*.parquet", recursive=True)
-        files.extend(found)
-    
-    if not files:
+    table = scan_table(
+        DATA_DIR,
+        columns=['reward', 'model_token_completion'],
+        datasets=TARGET_TASKS,
+        max_tokens=TOKEN_CAP,
+        classes=['family'],
+    )
+    if table is None:
         print("No files found.")
         return
 
-    dfs = []
-    for f in files:
-        if os.path.getsize(f) == 0: continue
-        try:
-            temp_df = pd.read_parquet(f)
-            temp_df['model_id'] = os.path.basename(os.path.dirname(f))
-            
-            if 'model_token_completion' in temp_df.columns: pass
-            elif 'generation_token_count' in temp_df.columns:
-                 temp_df['model_token_completion'] = temp_df['generation_token_count']
-            else: continue 
-            
-            dfs.append(temp_df[['model_id', 'reward', 'model_token_completion']])
-        except Exception: pass
-
-    if not dfs: return
-
-    df = pd.concat(dfs, ignore_index=True)
-    df = df[df['model_token_completion'] <= 8000] # Cap extreme outliers
-
-    model_metrics = df.groupby('model_id').agg(
-        Accuracy=('reward', 'mean'),
-        Cost=('model_token_completion', 'mean')
-    ).reset_index()
+    model_metrics = group_mean(table, ['model_id', 'family'], ['reward', 'model_token_completion']).rename(
+        columns={'reward': 'Accuracy', 'model_token_completion': 'Cost', 'family': 'Family'}
+    )
+    print_sampling_error(table, 'model_id', ['reward', 'model_token_completion'], label="Accuracy / Cost")
 
-    think_keywords = [
-        'think', 'reason', 'qwq', 'intellect', 
-    #    'gpt-oss', 'sonnet-4_5', 'gpt_5_1'
-    ]
-    
-    model_metrics['Family'] = model_metrics['model_id'].apply(lambda x: 
-        'Thinking' if any(k in x.lower() for k in think_keywords) else 'Standard')
+    plot_efficiency_frontier(model_metrics)
 
+def plot_efficiency_frontier(model_metrics, output_file=OUTPUT_FILE):
+    # model_metrics['Family'] comes from the model registry (see registry.py).
     print(f"Plotting {len(model_metrics)} models...")
 
     sns.set_theme(style="whitegrid", context="paper")
@@ -121,8 +100,8 @@ def analyze_efficiency_frontier_final():
     plt.legend(title="Model Family", loc="lower right", fontsize=12)
     plt.tight_layout()
     
-    plt.savefig(OUTPUT_FILE, dpi=300)
-    print(f"Generated {OUTPUT_FILE}")
+    plt.savefig(output_file, dpi=300)
+    print(f"Generated {output_file}")
 
 if __name__ == "__main__":
     analyze_efficiency_frontier_final()
\ No newline at end of file
@@ -1,86 +1,47 @@
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.lines as mlines
 import matplotlib.patches as mpatches
-import glob
-import os
-import json
-import numpy as np
 from adjustText import adjust_text
 
+from aggregates import group_mean
+from loader import scan_table
+from preview import print_sampling_error
+from registry import METADATA_FILE, SIZE_BUCKETS, load_registry
+from tables import TARGET_TASKS
+
 DATA_DIR = "inference-scratch"
-METADATA_FILE = "model_metadata.json"
 OUTPUT_FILE = "token_efficiency.png"
 
-TARGET_TASKS = [
-    'medqa', 
-    'medxpertqa-reasoning', 
-    'medcalc_bench',    
-    'mmlu_pro_health',  
-    'm_arc'             
-]
-
 FONT_SIZE = 9
-
-def load_metadata():
-    if not os.path.exists(METADATA_FILE):
-        return {}
-    with open(METADATA_FILE, 'r') as f:
-        data = json.load(f)
-    return data
+TOKEN_CAP = 8000
 
 def analyze_token_efficiency():
     print("Loading data...")
-    metadata = load_metadata()
-    if not metadata: return
+    registry = load_registry(METADATA_FILE)
+    if not registry.model_ids: return
+
+    table = scan_table(
+        DATA_DIR,
+        columns=['reward', 'model_token_completion'],
+        datasets=TARGET_TASKS,
+        models=registry.model_ids,
+        max_tokens=TOKEN_CAP,
+        metadata_file=METADATA_FILE,
+        classes=['family', 'size', 'display_name'],
+    )
+    if table is None: return
 
-    files = []
-    for task in TARGET_TASKS:
-        found = glob.glob(f"{DATA_DIR}/**/*{task}*.parquet", recursive=True)
-        files.extend(found)
-    
-    if not files: return
-
-    dfs = []
-    for f in files:
-        if os.path.getsize(f) == 0: continue
-        try:
-            temp_df = pd.read_parquet(f)
-            mid = os.path.basename(os.path.dirname(f))
-            if mid not in metadata: continue
-
-            temp_df['model_id'] = mid
-            if 'model_token_completion' in temp_df.columns: pass
-            elif 'generation_token_count' in temp_df.columns:
-                 temp_df['model_token_completion'] = temp_df['generation_token_count']
-            else: continue 
-            
-            dfs.append(temp_df[['model_id', 'reward', 'model_token_completion']])
-        except Exception: pass
-
-    if not dfs: return
-
-    df = pd.concat(dfs, ignore_index=True)
-    df = df[df['model_token_completion'] <= 8000] 
-
-    model_metrics = df.groupby('model_id').agg(
-        Accuracy=('reward', 'mean'),
-        Cost=('model_token_completion', 'mean')
-    ).reset_index()
-
-    size_list, family_list = [], []
-    for _, row in model_metrics.iterrows():
-        info = metadata[row['model_id']]
-        family_list.append('Thinking' if info.get('reasoning', False) else 'Standard')
-        size_list.append(info.get('size_without_quant', 'Unknown'))
+    keys = ['model_id', 'family', 'size', 'display_name']
+    model_metrics = group_mean(table, keys, ['reward', 'model_token_completion']).rename(
+        columns={'reward': 'Accuracy', 'model_token_completion': 'Cost', 'family': 'Category', 'size': 'Size'}
+    )
+    print_sampling_error(table, 'model_id', ['reward', 'model_token_completion'], label="Accuracy / Cost")
 
-    model_metrics['Category'] = family_list
-    model_metrics['Size'] = size_list
+    plot_token_efficiency(model_metrics)
 
-    
-    size_order = ['Tiny', 'Small', 'Medium', 'Large', 'API', 'Unknown']
-    existing_sizes = [s for s in size_order if s in model_metrics['Size'].unique()]
+def plot_token_efficiency(model_metrics, output_file=OUTPUT_FILE):
+    existing_sizes = [s for s in SIZE_BUCKETS if s in model_metrics['Size'].unique()]
     
     palette = sns.color_palette("plasma", n_colors=len(existing_sizes))
     size_color_map = dict(zip(existing_sizes, palette))
@@ -140,9 +101,7 @@ def analyze_token_efficiency():
 
     for _, row in model_metrics.iterrows():
         mid = row['model_id']
-        info = metadata.get(mid, {})
-        
-        label_text = info.get('name', mid)
+        label_text = row['display_name']
 
         label_color = 'green' if row['Category'] == 'Thinking' else '#1f3f77'
         weight = 'bold' 
@@ -178,8 +137,8 @@ def analyze_token_efficiency():
     plt.xlim(0, 4200)
     plt.tight_layout()
     
-    plt.savefig(OUTPUT_FILE, dpi=300)
-    print(f"Generated {OUTPUT_FILE}")
+    plt.savefig(output_file, dpi=300)
+    print(f"Generated {output_file}")
 
 if __name__ == "__main__":
     analyze_token_efficiency()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from aggregates import example_std, grouped_sums
+
+# Default targets for the rollout-budget columns of decompose().
+TARGET_NOISE = 0.1
+TARGET_RELIABILITY = 0.9
+
+
+def _codes(values):
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), uniques
+
+
+def example_moments(data):
+    """
+    One pass over the rollouts (an Arrow table or DataFrame): count, sum and
+    sum of squares of reward per (dataset, model_id, example_id), grouped in
+    Arrow so only the per-example result reaches pandas.
+    """
+    def derive(chunk):
+        reward = chunk['reward']
+        return {
+            'n': pa.array(np.ones(chunk.num_rows, dtype=np.int64)),
+            'sum': reward,
+            'sumsq': pc.multiply(reward, reward),
+        }
+    return grouped_sums(data, ['dataset', 'model_id', 'example_id'], derive)
+
+
+def _per_group_sum(codes, values, size):
+    return np.bincount(codes, weights=values, minlength=size)
+
+
+def decompose(moments, target_noise=TARGET_NOISE, target_reliability=TARGET_RELIABILITY):
+    """
+    Splits reward variance within each dataset into nested random-effect
+    components -- model, example within model, rollout within example --
+    using ANOVA moment estimators for unbalanced designs. Works entirely from
+    the per-example moments, so its cost is linear in the number of examples.
+
+    Per dataset it reports:
+      var_model / var_example / var_rollout   the three components (>= 0)
+      noise_score          mean per-example std, as the SNR chart has always used
+      mean_accuracy        mean reward over all rollouts
+      reliability_example  reliability of an example's score averaged over
+                           the mean number of rollouts
+      reliability_model    reliability of a model's dataset score
+      rollouts_for_noise   rollouts per example for the rollout SE of an
+                           example's score to drop to `target_noise`
+      rollouts_for_reliability  rollouts per example for reliability_example
+                           to reach `target_reliability`
+    """
+    d, datasets = _codes(moments['dataset'])
+    dm, _ = pd.factorize(pd.MultiIndex.from_arrays([moments['dataset'], moments['model_id']]))
+    dm_dataset = np.zeros(dm.max() + 1, dtype=np.int64)
+    dm_dataset[dm] = d
+
+    n = moments['n'].to_numpy(dtype=float)
+    s = moments['sum'].to_numpy(dtype=float)
+    ss = moments['sumsq'].to_numpy(dtype=float)
+    D, C = len(datasets), len(dm_dataset)
+
+    # Totals per model cell and per dataset.
+    n_m = _per_group_sum(dm, n, C)
+    s_m = _per_group_sum(dm, s, C)
+    n_d = _per_group_sum(d, n, D)
+    s_d = _per_group_sum(d, s, D)
+    ss_d = _per_group_sum(d, ss, D)
+    examples_d = np.bincount(d, minlength=D).astype(float)
+    models_d = np.bincount(dm_dataset, minlength=D).astype(float)
+
+    # Sums of squares: total, between models, between examples within model.
+    sst = ss_d - s_d ** 2 / n_d
+    ss_model = _per_group_sum(dm_dataset, s_m ** 2 / n_m, D) - s_d ** 2 / n_d
+    ss_example = _per_group_sum(d, s ** 2 / n, D) - _per_group_sum(dm_dataset, s_m ** 2 / n_m, D)
+    ss_rollout = sst - ss_model - ss_example
+
+    df_model = models_d - 1
+    df_example = examples_d - models_d
+    df_rollout = n_d - examples_d
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ms_model = ss_model / df_model
+        ms_example = ss_example / df_example
+        ms_rollout = ss_rollout / df_rollout
+
+        # Coefficients of the expected mean squares for an unbalanced nested design.
+        sum_n2_over_nm = _per_group_sum(dm_dataset, _per_group_sum(dm, n ** 2, C) / n_m, D)
+        k_example = (n_d - sum_n2_over_nm) / df_example
+        k_model_e = (sum_n2_over_nm - _per_group_sum(d, n ** 2, D) / n_d) / df_model
+        k_model_m = (n_d - _per_group_sum(dm_dataset, n_m ** 2, D) / n_d) / df_model
+
+        var_rollout = np.nan_to_num(ms_rollout)
+        var_example = np.clip(np.nan_to_num((ms_example - var_rollout) / k_example), 0, None)
+        var_model = np.clip(np.nan_to_num((ms_model - var_rollout - k_model_e * var_example) / k_model_m), 0, None)
+
+        mean_rollouts = n_d / examples_d
+        examples_per_model = examples_d / models_d
+        reliability_example = var_example / (var_example + var_rollout / mean_rollouts)
+        reliability_model = var_model / (
+            var_model + var_example / examples_per_model
+            + var_rollout / (examples_per_model * mean_rollouts)
+        )
+        rollouts_for_noise = np.ceil(var_rollout / target_noise ** 2)
+        rollouts_for_reliability = np.ceil(
+            target_reliability / (1 - target_reliability) * var_rollout / var_example
+        )
+
+    noise = example_std(moments, 'sum', 'sumsq').to_numpy()
+    has_noise = ~np.isnan(noise)
+    noise_sum = _per_group_sum(d[has_noise], noise[has_noise], D)
+    noise_n = np.bincount(d[has_noise], minlength=D)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = pd.DataFrame({
+            'dataset': datasets,
+            'n_models': models_d.astype(int),
+            'n_examples': examples_d.astype(int),
+            'n_rollouts': n_d.astype(int),
+            'mean_accuracy': s_d / n_d,
+            'noise_score': np.where(noise_n > 0, noise_sum / noise_n, np.nan),
+            'var_model': var_model,
+            'var_example': var_example,
+            'var_rollout': var_rollout,
+            'reliability_example': reliability_example,
+            'reliability_model': reliability_model,
+            'rollouts_for_noise': rollouts_for_noise,
+            'rollouts_for_reliability': rollouts_for_reliability,
+        })
+    return out.replace([np.inf, -np.inf], np.nan)
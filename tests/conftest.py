@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+# The scripts import each other by module name and read their cache and
+# preview settings at import time, so both are set before any import.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+os.environ['MEDARC_CACHE_DIR'] = tempfile.mkdtemp(prefix="medarc-test-cache-")
+os.environ.pop('MEDARC_PREVIEW', None)
+
+
+def rollouts(n_examples, n_rollouts, seed=0, accuracy=0.6):
+    """A rollout table in the inference-scratch layout: example_id, reward, model_token_completion."""
+    rng = np.random.default_rng(seed)
+    rows = n_examples * n_rollouts
+    return pa.table({
+        'example_id': np.repeat(np.arange(n_examples, dtype=np.int64), n_rollouts),
+        'reward': (rng.random(rows) < accuracy).astype(np.float64),
+        'model_token_completion': rng.integers(100, 12000, rows),
+    })
+
+
+@pytest.fixture
+def make_corpus(tmp_path):
+    """Writes {model_id: {dataset: table}} as <root>/<model_id>/<dataset>.parquet and returns the root."""
+    def make(files, root='corpus'):
+        root = tmp_path / root
+        for model_id, datasets in files.items():
+            (root / model_id).mkdir(parents=True, exist_ok=True)
+            for dataset, table in datasets.items():
+                pq.write_table(table, root / model_id / f"{dataset}.parquet")
+        return str(root)
+    return make
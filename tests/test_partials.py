@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from aggregates import EXAMPLE_KEYS, example_stats
+from conftest import rollouts
+from loader import scan_table
+from partials import final_tables, map_shard, read_partials
+from registry import METADATA_FILE, load_registry
+from tables import HIST_KEYS, token_histogram
+
+MODELS = ['afm-4-5b', 'qwq-32b', 'medgemma-27b']
+DATASETS = ['medqa', 'pubmedqa', 'medmcqa_op4']
+SCRIPTS = os.path.dirname(sys.modules['partials'].__file__)
+
+
+@pytest.fixture
+def corpus(make_corpus):
+    return make_corpus({
+        model: {dataset: rollouts(20 + 5 * j, 3 + i, seed=10 * i + j) for j, dataset in enumerate(DATASETS)}
+        for i, model in enumerate(MODELS)
+    })
+
+
+def _canonical(frame, keys):
+    frame = frame.astype({k: str for k in keys if k in ('model_id', 'dataset')})
+    return frame.sort_values(keys).reset_index(drop=True)
+
+
+def test_sharded_partials_merge_to_the_full_scan(corpus, tmp_path):
+    table = scan_table(corpus, columns=['example_id', 'reward'], optional=['model_token_completion'], preview=0)
+    paths = [map_shard(corpus, str(tmp_path / f"shard{i}.partial"), (i, 3)) for i in range(3)]
+    stats, hist, manifests = read_partials(paths)
+
+    assert sum(len(m['files']) for m in manifests) == len(MODELS) * len(DATASETS)
+    expected = _canonical(example_stats(table), EXAMPLE_KEYS)
+    pd.testing.assert_frame_equal(_canonical(stats, EXAMPLE_KEYS)[expected.columns], expected, check_dtype=False)
+    expected = _canonical(token_histogram(table), HIST_KEYS + ['bin'])
+    pd.testing.assert_frame_equal(_canonical(hist, HIST_KEYS + ['bin'])[expected.columns], expected,
+                                  check_dtype=False)
+
+
+def test_shard_count_does_not_change_the_result(corpus, tmp_path):
+    whole, _, _ = read_partials([map_shard(corpus, str(tmp_path / "whole.partial"))])
+    sharded, _, _ = read_partials([map_shard(corpus, str(tmp_path / f"s{i}.partial"), (i, 4)) for i in range(4)])
+    pd.testing.assert_frame_equal(_canonical(sharded, EXAMPLE_KEYS), _canonical(whole, EXAMPLE_KEYS),
+                                  check_dtype=False)
+
+
+def test_overlapping_partials_are_refused(corpus, tmp_path):
+    path = map_shard(corpus, str(tmp_path / "whole.partial"))
+    with pytest.raises(ValueError, match="double count"):
+        read_partials([path, path])
+
+
+def test_files_without_example_ids_count_toward_rollout_tables(make_corpus, tmp_path):
+    no_ids = rollouts(10, 4, seed=5).drop_columns(['example_id'])
+    corpus = make_corpus({
+        'afm-4-5b': {'medbullets-op4': rollouts(10, 4, seed=1), 'medbullets-op5': no_ids},
+        'qwq-32b': {'medbullets-op4': rollouts(10, 4, seed=2), 'medbullets-op5': rollouts(10, 4, seed=3)},
+    })
+    stats, hist, _ = read_partials([map_shard(corpus, str(tmp_path / f"s{i}.partial"), (i, 2)) for i in range(2)])
+    tables = final_tables(stats, hist, load_registry(METADATA_FILE))
+
+    drop = tables['distractor'].set_index('model_id')
+    assert drop.loc['afm-4-5b', 'Op5 Accuracy'] == pytest.approx(no_ids['reward'].to_numpy().mean())
+    assert stats['example_id'].isna().sum() == 1
+    assert set(tables['pass_at_k']['model_id']) == {'afm-4-5b', 'qwq-32b'}
+
+
+def test_map_workers_do_not_import_plotting():
+    code = "import sys, partials; print(any(m in sys.modules for m in ('matplotlib', 'seaborn', 'adjustText')))"
+    out = subprocess.run([sys.executable, '-c', code], cwd=SCRIPTS, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
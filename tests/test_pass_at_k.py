@@ -0,0 +1,143 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import cell_budgets, cell_table, example_stats, pass_at_k, pass_at_k_valid
+from tables import (MAX_PROJECTION, MIN_FIT_POINTS, _rollouts_needed, benchmark_budget_table, pass_at_k_curve_table,
+                    pass_at_k_table, rollout_budget_table)
+
+
+def calculate_pass_at_k(n, c, k):
+    """The per-example estimator pass_at_k.py used to loop over: 1 - C(n-c, k) / C(n, k)."""
+    if n < k:
+        return np.nan
+    return 1.0 - math.comb(n - c, k) / math.comb(n, k)
+
+
+def _rollouts(model_id, dataset, counts, seed):
+    rng = np.random.default_rng(seed)
+    example_id = np.repeat(np.arange(len(counts)), counts)
+    return pd.DataFrame({
+        'model_id': model_id, 'dataset': dataset, 'example_id': example_id,
+        'reward': (rng.random(len(example_id)) < 0.4).astype(float),
+        'model_token_completion': rng.integers(100, 5000, len(example_id)),
+    })
+
+
+@pytest.fixture
+def stats():
+    """Three cells with budgets 8, 3 and 2; the last has 30 examples with 8 rollouts."""
+    return example_stats(pd.concat([
+        _rollouts('afm-4-5b', 'medqa', [8] * 40, 0),
+        _rollouts('afm-4-5b', 'pubmedqa', [3] * 40, 1),
+        _rollouts('qwq-32b', 'medqa', [8] * 30 + [2] * 10, 2),
+    ], ignore_index=True))
+
+
+def _reference(stats, k):
+    budget = stats.join(cell_budgets(stats), on=['model_id', 'dataset'])['budget']
+    return np.array([calculate_pass_at_k(n, c, k) if b >= k else np.nan
+                     for n, c, b in zip(stats['n'], stats['n_correct'], budget)])
+
+
+def test_vectorised_estimator_matches_the_reference():
+    for n in range(11):
+        for c in range(n + 1):
+            for k in range(1, 11):
+                np.testing.assert_allclose(pass_at_k(n, c, k), calculate_pass_at_k(n, c, k))
+
+
+def test_cell_budgets(stats):
+    budgets = cell_budgets(stats)
+    assert budgets.to_dict() == {('afm-4-5b', 'medqa'): 8, ('afm-4-5b', 'pubmedqa'): 3, ('qwq-32b', 'medqa'): 2}
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 5, 8])
+def test_pass_at_budget_matches_the_reference(stats, k):
+    expected = _reference(stats, k)
+    np.testing.assert_allclose(pass_at_k_valid(stats, k).to_numpy(), expected)
+
+    cells = cell_table(stats, k).set_index(['model_id', 'dataset'])
+    frame = stats.assign(expected=expected).groupby(['model_id', 'dataset'], observed=True)['expected']
+    np.testing.assert_allclose(cells['pass_k'], frame.mean().reindex(cells.index))
+    np.testing.assert_array_equal(cells['n_pass_k'], frame.count().reindex(cells.index))
+
+
+def test_cell_table_defaults_to_the_median_budget(stats):
+    cells = cell_table(stats)
+    assert cells.attrs['k'] == 3
+    # Below the budget there is no Pass@3, even for the examples with 8 rollouts.
+    assert cells.set_index(['model_id', 'dataset']).loc[('qwq-32b', 'medqa'), 'n_pass_k'] == 0
+
+
+def test_models_are_compared_on_the_same_datasets(stats):
+    # qwq-32b has no pubmedqa cell and a medqa budget of 2, so both models
+    # are scored on medqa alone, at Pass@2.
+    table = pass_at_k_table(stats).set_index('model_id')
+    assert (table.attrs['k'], table.attrs['datasets'], table.attrs['excluded']) == (2, ['medqa'], ['pubmedqa'])
+    medqa = stats[(stats['dataset'] == 'medqa') & (stats['n'] >= 2)]
+    expected = medqa.assign(pass_2=[calculate_pass_at_k(n, c, 2) for n, c in zip(medqa['n'], medqa['n_correct'])])
+    np.testing.assert_allclose(table['pass_2'], expected.groupby('model_id')['pass_2'].mean().reindex(table.index))
+
+    table = pass_at_k_table(stats, k=3)
+    assert table.empty and table.attrs['excluded'] == ['medqa', 'pubmedqa']
+
+
+def test_curve_follows_the_reference_up_to_each_budget(stats):
+    curve = pass_at_k_curve_table(stats)
+    assert curve.groupby(['model_id', 'dataset'])['k'].max().to_dict() == cell_budgets(stats).to_dict()
+    for (model_id, dataset), cell in curve.groupby(['model_id', 'dataset']):
+        examples = stats[(stats['model_id'] == model_id) & (stats['dataset'] == dataset)]
+        for row in cell.itertuples():
+            # Each k and its gain are taken over the examples with at least k rollouts.
+            kept = examples[examples['n'] >= row.k]
+            pass_k = [calculate_pass_at_k(n, c, row.k) for n, c in zip(kept['n'], kept['n_correct'])]
+            before = [calculate_pass_at_k(n, c, row.k - 1) if row.k > 1 else 0.0
+                      for n, c in zip(kept['n'], kept['n_correct'])]
+            assert row.n_examples == len(kept)
+            np.testing.assert_allclose(row.pass_k, np.mean(pass_k))
+            np.testing.assert_allclose(row.pass_k_se, np.std(pass_k, ddof=1) / np.sqrt(len(kept)))
+            np.testing.assert_allclose(row.gain, np.mean(np.subtract(pass_k, before)))
+
+
+def test_rollout_budget_table_reports_each_cell_at_its_budget(stats):
+    curve = pass_at_k_curve_table(stats)
+    table = rollout_budget_table(stats, curve).set_index(['model_id', 'dataset'])
+    assert table['budget'].to_dict() == cell_budgets(stats).to_dict()
+    row = table.loc[('qwq-32b', 'medqa')]
+    assert (row['n_examples'], row['min_rollouts'], row['max_rollouts']) == (40, 2, 8)
+    at_budget = curve[(curve['model_id'] == 'qwq-32b') & (curve['dataset'] == 'medqa') & (curve['k'] == 2)]
+    np.testing.assert_allclose(row['pass_at_budget'], at_budget['pass_k'].iloc[0])
+    np.testing.assert_allclose(row['last_gain'], at_budget['gain'].iloc[0])
+    # Two points cannot be fitted, so the need is left unresolved rather than guessed.
+    assert np.isnan(row['rollouts_needed']) and row['needed_from'] == 'unresolved'
+    assert benchmark_budget_table(table.reset_index()).set_index('dataset').loc['medqa', 'unresolved'] >= 1
+
+
+def _cell(gains, budget=None):
+    """A curve cell whose k-th rollout gains gains[k - 1]."""
+    k = np.arange(1, len(gains) + 1)
+    return pd.DataFrame({'k': k, 'budget': budget or len(gains), 'gain': gains})
+
+
+def test_rollouts_needed_is_read_off_the_curve():
+    assert _rollouts_needed(_cell([0.5, 0.1, 0.03, 0.004, 0.002]), 0.005) == (3, 'observed')
+
+
+def test_rollouts_needed_projects_a_power_law_within_the_cap():
+    k = np.arange(1, 9)
+    # 0.8 / k**2 stays above 0.005 up to the budget of 8 and drops below it at k = 13.
+    assert _rollouts_needed(_cell(0.8 * k ** -2.0), 0.005) == (12, 'projected')
+
+
+def test_rollouts_needed_leaves_far_or_thin_projections_unresolved():
+    k = np.arange(1, MIN_FIT_POINTS + 2)
+    # A slowly decaying gain would take thousands of rollouts, far past MAX_PROJECTION budgets.
+    needed, source = _rollouts_needed(_cell(0.1 * k ** -0.3), 0.005)
+    assert np.isnan(needed) and source == 'unresolved'
+    assert _rollouts_needed(_cell(0.1 * k ** -0.3), 0.1 * (MAX_PROJECTION * len(k)) ** -0.3 * 1.01)[1] == 'projected'
+    # One gain too few past k=1 to fit, however clean the decay.
+    needed, source = _rollouts_needed(_cell(0.8 * k[:-1] ** -2.0), 0.005)
+    assert np.isnan(needed) and source == 'unresolved'
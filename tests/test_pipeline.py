@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from pipeline import Node, Pipeline, _plot
+
+
+def _draw(scale, output_file):
+    with open(output_file, 'w') as f:
+        f.write(f"scale={scale}")
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    nodes = [
+        Node('scale', lambda scale: scale, params=['scale']),
+        Node('figure', _plot(_draw, "figure.txt"), deps=['scale'], params=['output_dir'], figure=True),
+    ]
+    return Pipeline(nodes, cache_dir=str(tmp_path / 'cache'), workers=1)
+
+
+def test_figure_is_redrawn_after_another_key_overwrote_it(pipeline, tmp_path, capsys):
+    out = str(tmp_path / 'figures')
+    path = os.path.join(out, 'figure.txt')
+
+    def run(scale):
+        pipeline.run(scale=scale, output_dir=out)
+        status = {line.split()[0]: line.split()[1] for line in capsys.readouterr().out.splitlines()}
+        with open(path) as f:
+            return f.read(), status['figure']
+
+    assert run(1) == ("scale=1", 'computed')
+    assert run(2) == ("scale=2", 'computed')
+    # The memo for scale=1 still exists, but the file now holds the scale=2 plot.
+    assert run(1) == ("scale=1", 'computed')
+    assert run(1) == ("scale=1", 'cached')
+
+
+def test_figure_is_redrawn_when_deleted(pipeline, tmp_path, capsys):
+    out = str(tmp_path / 'figures')
+    pipeline.run(scale=1, output_dir=out)
+    os.remove(os.path.join(out, 'figure.txt'))
+    pipeline.run(scale=1, output_dir=out)
+    assert os.path.exists(os.path.join(out, 'figure.txt'))
@@ -0,0 +1,86 @@
+import numpy as np
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from conftest import rollouts
+from loader import in_ranges, scan_table
+from preview import _chosen, select_examples, select_ranges
+
+IDS = np.arange(1000)
+
+
+def test_fraction_one_or_more_keeps_every_id():
+    for fraction in (1.0, 1.5):
+        np.testing.assert_array_equal(select_examples(IDS, fraction), IDS)
+
+
+def test_fraction_just_below_one_does_not_overflow():
+    kept = select_examples(IDS, np.nextafter(1.0, 0.0))
+    assert 990 <= len(kept) <= 1000
+
+
+def test_fraction_zero_keeps_the_minimum():
+    kept = select_examples(IDS, 0.0, min_examples=30)
+    assert len(kept) == 30
+    np.testing.assert_array_equal(kept, select_examples(IDS, -0.5, min_examples=30))
+
+
+def test_small_stratum_is_kept_whole():
+    np.testing.assert_array_equal(select_examples(IDS[:10], 0.0, min_examples=30), IDS[:10])
+
+
+def test_samples_are_nested_and_deterministic():
+    small, large = select_examples(IDS, 0.1, min_examples=0), select_examples(IDS, 0.5, min_examples=0)
+    assert set(small) <= set(large)
+    assert 50 <= len(small) <= 150
+    np.testing.assert_array_equal(select_examples(IDS[::-1], 0.1, min_examples=0), small)
+
+
+# 1000 examples of 8 rollouts in row groups of 100 rows, so half the groups
+# end partway through an example.
+ROLLOUTS = np.repeat(IDS, 8)
+ROW_GROUPS = [100] * 80
+
+
+def _ids_in(ranges):
+    lo, hi = ranges
+    return {i for i in IDS if ((lo <= i) & (i <= hi)).any()}
+
+
+def test_ranges_follow_row_groups_and_are_nested():
+    small, large = (select_ranges(ROLLOUTS, ROW_GROUPS, f, min_examples=0) for f in (0.1, 0.5))
+    starts = set(ROLLOUTS[::100])
+    assert set(small[0]) <= starts and _ids_in(small) <= _ids_in(large)
+    assert 2 <= len(small[0]) <= 20
+
+
+def test_ranges_are_topped_up_to_the_minimum():
+    assert len(_ids_in(select_ranges(ROLLOUTS, ROW_GROUPS, 0.0, min_examples=30))) >= 30
+    assert _ids_in(select_ranges(ROLLOUTS, ROW_GROUPS, 1.0)) == set(IDS)
+
+
+def test_ids_out_of_order_are_sampled_one_by_one():
+    lo, hi = select_ranges(ROLLOUTS[::-1], ROW_GROUPS, 0.1)
+    np.testing.assert_array_equal(lo, select_examples(IDS, 0.1))
+    np.testing.assert_array_equal(lo, hi)
+
+
+def test_preview_reads_whole_examples_from_few_row_groups(make_corpus):
+    # Two models with different rollout counts and row group sizes still get
+    # the same examples, each with all of its rollouts.
+    corpus = make_corpus({'afm-4-5b': {'medqa': rollouts(1000, 8)}, 'qwq-32b': {'medqa': rollouts(1000, 4, seed=1)}})
+    for model_id, size in [('afm-4-5b', 100), ('qwq-32b', 64)]:
+        path = f"{corpus}/{model_id}/medqa.parquet"
+        pq.write_table(pq.read_table(path), path, row_group_size=size)
+    _chosen.clear()
+    table = scan_table(corpus, columns=['example_id', 'reward'], preview=0.1)
+
+    counts = table.group_by(['model_id', 'example_id']).aggregate([('reward', 'count')]).to_pandas()
+    per_model = counts.groupby('model_id')
+    assert per_model['example_id'].apply(frozenset).nunique() == 1
+    assert per_model['reward_count'].agg(set).to_dict() == {'afm-4-5b': {8}, 'qwq-32b': {4}}
+    assert 30 <= per_model.size().iloc[0] <= 300
+
+    lo, hi, _ = next(iter(_chosen.values()))
+    fragment = next(ds.dataset(f"{corpus}/qwq-32b/medqa.parquet").get_fragments())
+    assert fragment.subset(filter=in_ranges(ds.field('example_id'), lo, hi)).num_row_groups < fragment.num_row_groups / 2
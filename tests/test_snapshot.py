@@ -0,0 +1,110 @@
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from conftest import rollouts
+from snapshot import compare_files, diff_snapshots, write_manifest
+from sync import Store, build_index, pull
+
+MEDQA = os.path.join('qwq-32b', 'medqa.parquet')
+PUBMEDQA = os.path.join('qwq-32b', 'pubmedqa.parquet')
+
+
+@pytest.fixture
+def snapshots(make_corpus):
+    old = make_corpus({'qwq-32b': {'medqa': rollouts(40, 5, seed=1), 'pubmedqa': rollouts(40, 5, seed=2)}}, 'old')
+    new = os.path.join(os.path.dirname(old), 'new')
+    shutil.copytree(old, new)
+    return old, new
+
+
+def _regrade(path):
+    """Flips every reward in place, keeping the file's size and mtime."""
+    st = os.stat(path)
+    table = pq.read_table(path)
+    table = table.set_column(1, 'reward', pa.array(1.0 - table['reward'].to_numpy()))
+    pq.write_table(table, path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.path.getsize(path) == st.st_size
+
+
+def _size(root, *rels):
+    return sum(os.path.getsize(os.path.join(root, rel)) for rel in rels)
+
+
+def test_content_change_is_detected_with_same_size_and_mtime(snapshots):
+    old, new = snapshots
+    _regrade(os.path.join(new, MEDQA))
+
+    cells, _, summary = diff_snapshots(old, new)
+    assert (summary['changed'], summary['unchanged']) == (1, 1)
+    assert cells['dataset'].tolist() == ['medqa']
+    # Both sides hashed in full the first time, plus the changed file scanned on each side.
+    assert summary['bytes_scanned'] == 2 * _size(old, MEDQA, PUBMEDQA) + 2 * _size(old, MEDQA)
+
+
+def test_cached_digests_are_not_rehashed(snapshots):
+    old, new = snapshots
+    _regrade(os.path.join(new, MEDQA))
+    diff_snapshots(old, new)
+
+    _, _, summary = diff_snapshots(old, new)
+    assert summary['changed'] == 1
+    assert summary['bytes_scanned'] == 2 * _size(old, MEDQA)
+
+
+def test_size_change_needs_no_hash(snapshots):
+    old, new = snapshots
+    pq.write_table(rollouts(60, 5, seed=3), os.path.join(new, MEDQA))
+
+    _, _, summary = diff_snapshots(old, new)
+    assert summary['changed'] == 1
+    assert summary['bytes_scanned'] == 2 * _size(old, PUBMEDQA) + _size(old, MEDQA) + _size(new, MEDQA)
+
+
+def test_sync_snapshots_compare_by_blob_name(snapshots, tmp_path):
+    old, new = snapshots
+    store = Store(str(tmp_path / 'store'))
+    before = pull(old, store)
+    _regrade(os.path.join(old, MEDQA))
+    os.utime(os.path.join(old, MEDQA))
+    after = pull(old, store)
+
+    cells, _, summary = diff_snapshots(before, after)
+    assert (summary['changed'], summary['unchanged']) == (1, 1)
+    assert summary['bytes_scanned'] == 2 * _size(old, MEDQA)
+    np.testing.assert_allclose(cells['accuracy_new'], 1 - cells['accuracy_old'])
+
+
+def test_diff_against_a_manifest_reports_the_regraded_cell(snapshots, tmp_path):
+    old, new = snapshots
+    manifest = str(tmp_path / 'old.json')
+    write_manifest(old, manifest)
+    _regrade(os.path.join(new, MEDQA))
+
+    cells, _, summary = diff_snapshots(manifest, new)
+    assert summary['changed'] == 1 and summary['unchanged'] == 1
+    row = cells.set_index('dataset').loc['medqa']
+    assert row['status'] == 'changed'
+    np.testing.assert_allclose(row['accuracy_new'], 1 - row['accuracy_old'])
+
+
+def test_unresolved_same_size_files_are_refused():
+    entry = {'model_id': 'm', 'dataset': 'd', 'size': 10, 'digest': None}
+    with pytest.raises(ValueError):
+        compare_files({'m/d.parquet': entry}, {'m/d.parquet': dict(entry, digest='ab')})
+
+
+def test_mirror_index_supplies_digests(snapshots):
+    old, new = snapshots
+    _regrade(os.path.join(new, MEDQA))
+    build_index(new)
+
+    _, _, summary = diff_snapshots(old, new)
+    assert summary['changed'] == 1
+    # Only the old side is hashed.
+    assert summary['bytes_scanned'] == _size(old, MEDQA, PUBMEDQA) + 2 * _size(old, MEDQA)
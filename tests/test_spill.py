@@ -0,0 +1,59 @@
+import numpy as np
+import pyarrow as pa
+
+from aggregates import EXAMPLE_KEYS, example_stats, grouped_sums
+from conftest import rollouts
+from loader import scan_tables
+from spill import SpillingGroupBy
+
+
+def _pieces(n_pieces=12, rows=500, seed=0):
+    """Pre-aggregated pieces whose (model_id, example_id) keys overlap across pieces."""
+    rng = np.random.default_rng(seed)
+    models = pa.array(['afm-4-5b', 'qwq-32b', 'medgemma-27b'])
+    for _ in range(n_pieces):
+        yield pa.table({
+            'model_id': pa.DictionaryArray.from_arrays(pa.array(rng.integers(0, 3, rows), pa.int32()), models),
+            'example_id': pa.array(rng.integers(0, 200, rows)),
+            'n': pa.array(np.ones(rows, dtype=np.int64)),
+            'sum': pa.array(rng.random(rows)),
+        })
+
+
+def _merged(budget, **kwargs):
+    with SpillingGroupBy(['model_id', 'example_id'], budget, **kwargs) as groups:
+        for piece in _pieces():
+            groups.add(piece)
+        spilled = groups.spilled_bytes
+        table = groups.result()
+    frame = table.to_pandas().astype({'model_id': str})
+    return frame.sort_values(['model_id', 'example_id']).reset_index(drop=True), spilled
+
+
+def test_spilled_merge_matches_in_memory():
+    expected, spilled = _merged(None)
+    assert spilled == 0
+    # A budget below one piece spills everything, and re-splits each partition.
+    for budget, partitions in [(1, 4), (4096, 32)]:
+        frame, spilled = _merged(budget, partitions=partitions)
+        assert spilled > 0
+        assert frame['n'].sum() == 12 * 500
+        np.testing.assert_array_equal(frame[['model_id', 'example_id', 'n']], expected[['model_id', 'example_id', 'n']])
+        np.testing.assert_allclose(frame['sum'], expected['sum'])
+
+
+def test_example_stats_under_a_tiny_budget(make_corpus):
+    corpus = make_corpus({m: {d: rollouts(50, 4, seed=i * 3 + j) for j, d in enumerate(['medqa', 'pubmedqa'])}
+                          for i, m in enumerate(['afm-4-5b', 'qwq-32b'])})
+
+    def derive(chunk):
+        return {'n': pa.array(np.ones(chunk.num_rows, dtype=np.int64)), 'sum_reward': chunk['reward']}
+
+    def stream():
+        return scan_tables(corpus, columns=['example_id', 'reward'], preview=0)
+
+    expected = example_stats(stream())[EXAMPLE_KEYS + ['n', 'sum_reward']]
+    spilled = grouped_sums(stream(), EXAMPLE_KEYS, derive, budget=1)
+    assert len(spilled) == len(expected) == 2 * 2 * 50
+    np.testing.assert_array_equal(spilled.astype({'model_id': str, 'dataset': str}).to_numpy(),
+                                  expected.astype({'model_id': str, 'dataset': str}).to_numpy())